@@ -0,0 +1,257 @@
+import time
+from datetime import datetime
+
+import psutil
+
+from connection_refresher import ConnectionRefresher
+from counter_table import OTHER_REMOTE, CounterTable, RemoteCounters
+from flow_table import FlowTable, unpack_address
+from heavy_hitters import TopTalkers
+from host_names import HostNameCache
+from pending_flows import PendingFlows, UNATTRIBUTED_PID, UNATTRIBUTED_NAME
+from process_cache import ProcessInfoCache
+from rate_engine import RateEngine
+
+
+class AppAccounting:
+    """Flow -> process attribution and per-PID byte totals, with no UI attached.
+
+    `apply` takes the {flow: [upload, download, packets]} batches of a capture backend,
+    `run_connections` keeps the flow table in step with the OS and `processes` builds
+    the per-process rows the usage model and the tracker daemon's clients consume.
+    """
+
+    def __init__(self, on_exit=None):
+        self.flow_table = FlowTable()
+        self.pending_flows = PendingFlows()
+        self.process_cache = ProcessInfoCache()
+        # pid -> upload / download / packets, in typed columns rather than a list per PID
+        self.counters = CounterTable()
+        # per-PID bytes/s, fed as the bytes are counted rather than diffed from totals
+        self.rates = RateEngine()
+        # heaviest processes, peers and process/peer pairs, bounded however many peers there are
+        self.talkers = TopTalkers()
+        # pid -> remote address -> upload / download, and the names of those addresses,
+        # which a NameSniffer fills and which are only looked up when asked for
+        self.remote_counters = RemoteCounters()
+        self.host_names = HostNameCache()
+        # called with each PID that exited since the last processes() call
+        self.on_exit = on_exit
+
+    def apply(self, counters):
+        # PIDs released by processes() on the reading thread are freed here, between adds
+        self.counters.collect()
+        self.remote_counters.collect()
+        add, add_rate, add_remote = self.counters.add, self.rates.add, self.remote_counters.add
+        now = time.monotonic()
+        # (pid, remote address, bytes) for the top talkers, counted in one go
+        traffic = []
+        talk = traffic.append
+        for flow, (upload, download, packets) in counters.items():
+            packet_pid = self.flow_table.lookup(flow)
+            if packet_pid:
+                add(packet_pid, upload, download, packets)
+                add_rate(packet_pid, upload, download, now)
+                add_remote(packet_pid, flow[3], upload, download)
+                talk((packet_pid, flow[3], upload + download))
+            else:
+                # the connection refresher hasn't seen this flow yet, hold its bytes
+                self.pending_flows.add(flow, upload, download)
+                talk((None, flow[3], upload + download))
+        settled = self.pending_flows.settle(self.flow_table.lookup, self.flow_table.generation)
+        for pid, (upload, download) in settled.items():
+            add(pid, upload, download)
+            add_rate(pid, upload, download, now)
+            # the flows are gone by now, only their owner is known
+            add_remote(pid, OTHER_REMOTE, upload, download)
+            talk((pid, None, upload + download))
+        self.talkers.add(traffic, now)
+
+    def run_connections(self, is_running):
+        # only connection adds/removes are applied, and the poll interval adapts to churn
+        refresher = ConnectionRefresher(self.flow_table)
+        while is_running():
+            refresher.refresh()
+            time.sleep(refresher.interval)
+
+    def processes(self):
+        _, exited = self.process_cache.refresh()
+        if self.on_exit is not None:
+            for pid in exited:
+                self.on_exit(pid)
+        columns = self.counters.snapshot()
+        now = time.monotonic()
+        processes = []
+        for pid, upload, download in zip(columns.pids.tolist(), columns.upload.tolist(), columns.download.tolist()):
+            if pid == UNATTRIBUTED_PID:
+                processes.append({
+                    "pid": pid,
+                    "name": UNATTRIBUTED_NAME,
+                    "exe": None,
+                    "create_time": datetime.fromtimestamp(psutil.boot_time()),
+                    "Upload": upload,
+                    "Download": download,
+                    "Data Usage": upload + download,
+                    **self.speed(pid, now),
+                })
+                continue
+            # cached metadata, psutil is only asked about processes that started or exited
+            info = self.process_cache.get(pid)
+            if info is None:
+                if pid not in self.process_cache.running_pids:
+                    # exited and no longer remembered by the cache, its row is gone for good
+                    self.counters.release(pid)
+                    self.rates.forget(pid)
+                    self.remote_counters.release(pid)
+                continue
+            process = {
+                "pid": pid,
+                "name": info.name,
+                "exe": info.exe,
+                "create_time": datetime.fromtimestamp(info.create_time),
+                "Upload": upload,
+                "Download": download,
+                "Data Usage": upload + download,
+                **self.speed(pid, now),
+            }
+            processes.append(process)
+        return processes
+
+    def speed(self, pid, now):
+        """Row fields with the bytes/s of `pid`: the shortest window, and every Rates"""
+        rates = self.rates.rates(pid, now)
+        if rates is None:
+            return {"Upload Speed": 0.0, "Download Speed": 0.0, "Rates": None}
+        return {"Upload Speed": rates.upload[0], "Download Speed": rates.download[0], "Rates": rates}
+
+    def top_talkers(self, limit=20):
+        """Heaviest processes, remote addresses and process/remote pairs of the last minute.
+
+        {"processes": rows, "remotes": rows, "pairs": rows}; each row has "pid", "name"
+        and "remote" (None where they don't apply), "recent" bytes and "total" bytes
+        since start (None once the key dropped out of the all-time top).
+        """
+        now = time.monotonic()
+        talkers = self.talkers
+        return {
+            "processes": [
+                self._talker_row(hitter.key, None, hitter.count, talkers.processes.count(hitter.key))
+                for hitter in talkers.processes.recent(now, limit)
+            ],
+            "remotes": [
+                self._talker_row(None, hitter.key, hitter.count, talkers.remotes.count(hitter.key))
+                for hitter in talkers.remotes.recent(now, limit)
+            ],
+            "pairs": [
+                self._talker_row(*hitter.key, hitter.count, talkers.pairs.count(hitter.key))
+                for hitter in talkers.pairs.recent(now, limit)
+            ],
+        }
+
+    def _talker_row(self, pid, remote, recent, total):
+        name = None
+        if pid == UNATTRIBUTED_PID:
+            name = UNATTRIBUTED_NAME
+        elif pid is not None:
+            info = self.process_cache.get(pid)
+            name = info.name if info is not None else f"PID {pid}"
+        return {
+            "pid": pid,
+            "name": name,
+            "remote": unpack_address(remote) if remote is not None else None,
+            "host": self.host_names.name(remote) if remote is not None else None,
+            "recent": recent,
+            "total": total,
+        }
+
+    def remote_hosts(self, app=None, by_name=False):
+        """What each application sent to and received from each remote host.
+
+        {app key: rows} with app keys as app_totals makes them, only `app` if given.
+        Rows are heaviest first, each has "host" (the name DNS or SNI gave the address,
+        None if none was seen), "addresses" and "Upload" / "Download". `by_name` puts
+        the addresses of one host name into one row. Bytes no single address can be
+        given are in a row with host and addresses both None.
+        """
+        now = time.monotonic()
+        host_name = self.host_names.name
+        apps = {}
+        for pid in list(self.remote_counters.by_pid):
+            if pid == UNATTRIBUTED_PID:
+                key = UNATTRIBUTED_NAME
+            else:
+                info = self.process_cache.get(pid)
+                if info is None:
+                    continue
+                key = info.exe or info.name
+            if app is not None and key != app:
+                continue
+            hosts = apps.setdefault(key, {})
+            for remote, (upload, download) in self.remote_counters.get(pid).items():
+                host = host_name(remote, now) if remote is not None else None
+                group = host if by_name and host is not None else remote
+                row = hosts.get(group)
+                if row is None:
+                    row = hosts[group] = {"host": host, "addresses": [], "Upload": 0, "Download": 0}
+                if remote is not None and remote not in row["addresses"]:
+                    row["addresses"].append(remote)
+                row["Upload"] += upload
+                row["Download"] += download
+        for key, hosts in apps.items():
+            rows = sorted(hosts.values(), key=lambda row: row["Upload"] + row["Download"], reverse=True)
+            for row in rows:
+                row["addresses"] = tuple(unpack_address(address) for address in row["addresses"])
+            apps[key] = rows
+        return apps
+
+
+class UsageRecorder:
+    """Appends what each application used since the last call to a UsageStore and rollups.
+
+    Deltas are taken per process and summed per app, so a process whose counters are
+    released doesn't make its application's total go down.
+    """
+
+    def __init__(self, usage_store, rollups):
+        self.usage_store = usage_store
+        self.rollups = rollups
+        # (pid, app key) -> (upload, download) already recorded
+        self.recorded = {}
+
+    def record(self, processes):
+        """`processes` are the dicts AppAccounting.processes builds"""
+        now = time.time()
+        deltas = {}
+        recorded = {}
+        for process in processes:
+            key = app_key(process)
+            upload_total, download_total = process["Upload"], process["Download"]
+            last_upload, last_download = self.recorded.get((process["pid"], key), (0, 0))
+            if upload_total < last_upload or download_total < last_download:
+                # the PID was released and its counters started over
+                last_upload = last_download = 0
+            recorded[process["pid"], key] = (upload_total, download_total)
+            if upload_total != last_upload or download_total != last_download:
+                counters = deltas.setdefault(key, [0, 0])
+                counters[0] += upload_total - last_upload
+                counters[1] += download_total - last_download
+        # processes that dropped out are forgotten, their bytes were recorded while they showed
+        self.recorded = recorded
+        for key, (upload, download) in deltas.items():
+            self.usage_store.record(key, upload, download, now)
+            self.rollups.add(key, now, upload, download)
+
+
+def app_key(process):
+    """Key an application is grouped and stored under: its executable, else its name"""
+    return process.get("exe") or process["name"]
+
+
+def app_totals(processes):
+    """{app key: [upload, download]} with processes grouped the way AppUsageModel groups them"""
+    totals = {}
+    for process in processes:
+        totals_for_app = totals.setdefault(app_key(process), [0, 0])
+        totals_for_app[0] += process["Upload"]
+        totals_for_app[1] += process["Download"]
+    return totals
@@ -1,92 +1,80 @@
-from PyQt5.QtCore import QThread, pyqtSignal, QTimer
-import psutil
-from scapy.all import sniff, IP
-from scapy.layers.inet import IP
-from scapy.all import ifaces
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import *
-from PyQt5.QtCore import *
-from collections import defaultdict
-import psutil
-import win32gui
-import win32ui
-from datetime import datetime
-import time
-from settings import SettingsWindow  # Import the settings window class
-from PyQt5.QtGui import QPixmap, QCursor
-
-class SniffingThread(QThread):
-    update = pyqtSignal()
-
-    def __init__(self, process_packet, parent=None):
+from startup_profile import startup_profile
+
+with startup_profile.phase("import Qt"):
+    from PyQt5.QtCore import QSize, QThread, QTimer, Qt, pyqtSignal
+    from PyQt5.QtGui import QCursor, QPixmap
+    from PyQt5.QtWidgets import (
+        QAbstractItemView, QApplication, QCheckBox, QComboBox, QHBoxLayout, QHeaderView, QLabel,
+        QTabWidget, QTableView, QVBoxLayout, QWidget,
+    )
+with startup_profile.phase("import window modules"):
+    from settings import SettingsWindow  # Import the settings window class
+    from tracker_client import DaemonClientThread, TrackerClient, connect
+    from icon_cache import IconCache
+    from usage_store import UsageStore
+    from rollups import RollupSet
+    from usage_model import (
+        APP_COLUMN, USAGE_COLUMN, SPEED_COLUMN, AppUsageModel, TopTalkersModel, UsageBarDelegate,
+        UsageSortProxyModel, get_size,
+    )
+# capture_backends, packet_batch (NumPy), app_accounting and capture_threads are only
+# imported once the window is up, and scapy only by the capture thread
+
+def default_source():
+    from capture_backends import ScapyLiveBackend
+    return ScapyLiveBackend()
+
+
+class SourceThread(QThread):
+    """Opens the window's data source off the GUI thread, so the window shows first.
+
+    `open_source` returns a TrackerClient, or a capture backend which also gets the
+    AppAccounting that will attribute its traffic.
+    """
+
+    ready = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, open_source, parent=None):
         super().__init__(parent)
-        self.process_packet = process_packet
+        self.open_source = open_source
 
     def run(self):
-        sniff(prn=self.process_packet, store=False, count=0)
-        self.update.emit()
-
-class ConnectionThread(QThread):
-    update = pyqtSignal()
+        try:
+            with startup_profile.phase("open data source"):
+                source = self.open_source()
+            accounting = None
+            if not isinstance(source, TrackerClient):
+                with startup_profile.phase("import accounting"):
+                    from app_accounting import AppAccounting
+                    accounting = AppAccounting()
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.ready.emit(source, accounting)
 
-    def __init__(self, connection2pid, is_program_running, parent=None):
-        super().__init__(parent)
-        self.connection2pid = connection2pid
-        self.is_program_running = is_program_running
 
-    def run(self):
-        while self.is_program_running:
-            for c in psutil.net_connections():
-                if c.laddr and c.raddr and c.pid:
-                    self.connection2pid[(c.laddr.port, c.raddr.port)] = c.pid
-                    self.connection2pid[(c.raddr.port, c.laddr.port)] = c.pid
-            time.sleep(1)  # Adjusted interval for better efficiency
-        self.update.emit()
-
-class ExeDataWidget(QWidget):
-    def get_size(self, bytes: int) -> str:
-        for unit in ["", "K", "M", "G", "T", "P"]:
-            if bytes < 1024:
-                return f"{bytes:.2f}{unit}B"
-            bytes /= 1024
-
-    def __init__(self, lay: QVBoxLayout, pixmap: QPixmap, name: str):
-        super().__init__()
+# AppAccounting.top_talkers lists the "top talkers" tab can show
+TALKER_KINDS = (("Processes", "processes"), ("Remote hosts", "remotes"), ("Process -> remote host", "pairs"))
 
-        self.value = 0
-        hlay = QHBoxLayout(self)
-        self.pixmap = QLabel()
-        self.pixmap.setPixmap(pixmap)
-        self.pixmap.setFixedSize(32, 32)
-        hlay.addWidget(self.pixmap)
-        vlay = QVBoxLayout()
-        hlay.addLayout(vlay)
-        hlay2 = QHBoxLayout()
-        vlay.addLayout(hlay2)
-        self.name = QLabel(name)
-        hlay2.addWidget(self.name)
-        hlay2.addStretch()
-        self.data_usage = QLabel()
-        hlay2.addWidget(self.data_usage)
-        self.progress = QProgressBar()
-        vlay.addWidget(self.progress)
-        lay.addWidget(self)
-
-    def setValue(self, value: int):
-        self.data_usage.setText(self.get_size(value))
-        self.progress.setValue(value)
-
-    def setMaximum(self, maximum: int):
-        self.progress.setMaximum(maximum)
 
 class NetworkUsageGUI(QWidget):
-    all_macs = {iface.mac for iface in ifaces.values()}
+    # the daemon connection or the capture is up
+    source_opened = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, source=None):
+        """`source` is a TrackerClient, a capture backend, or a callable returning either
+        that is run in the background (ScapyLiveBackend by default)"""
         super().__init__()
         self.is_program_running = True
-        self.connection2pid = {}
-        self.pid2traffic = defaultdict(lambda: [0, 0])
+        # attached to the tracker daemon the window only displays what it pushes,
+        # standalone it runs its own capture and accounting
+        self.client = None
+        self.remote_processes = []
+        self.remote_talkers = None
+        self.accounting = None
+        self.capture_backend = None
+        self.open_source = source or default_source
 
         self.setWindowTitle("App Data Tracker")
         self.setGeometry(100, 100, 300, 400)
@@ -97,16 +85,47 @@ class NetworkUsageGUI(QWidget):
         self.total_data_usage_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         main_layout.addWidget(self.total_data_usage_label)
 
-        scroll_area = QScrollArea(self)
-        scroll_area.setWidgetResizable(True)
-        
-        widget = QWidget()
-        
-        self.lay = QVBoxLayout(widget)
-        self.lay.setAlignment(Qt.AlignmentFlag.AlignTop)
-        
-        scroll_area.setWidget(widget)
-        main_layout.addWidget(scroll_area)
+        # one virtualised row per executable; only visible rows get painted
+        self.icon_cache = IconCache(parent=self)
+        self.usage_model = AppUsageModel(self.icon_cache.pixmap, self)
+        self.icon_cache.icon_ready.connect(self.usage_model.refresh_icon)
+        sort_model = UsageSortProxyModel(self)
+        sort_model.setSourceModel(self.usage_model)
+
+        self.usage_view = QTableView(self)
+        self.usage_view.setModel(sort_model)
+        self.usage_view.setItemDelegateForColumn(USAGE_COLUMN, UsageBarDelegate(self.usage_model, self))
+        self.usage_view.setSortingEnabled(True)
+        self.usage_view.sortByColumn(USAGE_COLUMN, Qt.DescendingOrder)
+        self.usage_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.usage_view.setIconSize(QSize(32, 32))
+        self.usage_view.verticalHeader().hide()
+        self.usage_view.verticalHeader().setDefaultSectionSize(36)
+        self.usage_view.horizontalHeader().setSectionResizeMode(APP_COLUMN, QHeaderView.Stretch)
+        self.usage_view.horizontalHeader().setSectionResizeMode(SPEED_COLUMN, QHeaderView.ResizeToContents)
+        self.usage_view.setShowGrid(False)
+
+        # heaviest processes and peers of the last minute, from bounded top-k counters
+        talkers_page = QWidget(self)
+        talkers_layout = QVBoxLayout(talkers_page)
+        self.talker_kind = QComboBox(talkers_page)
+        for title, kind in TALKER_KINDS:
+            self.talker_kind.addItem(title, kind)
+        self.talker_kind.currentIndexChanged.connect(lambda _: self.update_talkers())
+        talkers_layout.addWidget(self.talker_kind)
+        self.talkers_model = TopTalkersModel(self)
+        self.talkers_view = QTableView(talkers_page)
+        self.talkers_view.setModel(self.talkers_model)
+        self.talkers_view.verticalHeader().hide()
+        self.talkers_view.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.talkers_view.setShowGrid(False)
+        talkers_layout.addWidget(self.talkers_view)
+
+        self.tabs = QTabWidget(self)
+        self.tabs.addTab(self.usage_view, "Applications")
+        self.tabs.addTab(talkers_page, "Top talkers")
+        self.tabs.currentChanged.connect(lambda _: self.update_talkers())
+        main_layout.addWidget(self.tabs)
         
         # Bottom layout
         bottom_layout = QHBoxLayout()
@@ -132,130 +151,112 @@ class NetworkUsageGUI(QWidget):
         # Add the bottom layout to the main layout
         main_layout.addLayout(bottom_layout)
 
-        self.listItems: dict[str, ExeDataWidget] = {}
-
         self.startTimer(1000)  # Adjusted to update every second
 
         self.start_monitoring()
 
-    def get_executable_path(self, process_name):
-        try:
-            for proc in psutil.process_iter(attrs=["name", "exe"]):
-                if proc.info["name"] == process_name:
-                    return proc.info["exe"]
-        except psutil.NoSuchProcess:
-            pass
-        return None
+    def get_executable_path(self, pid):
+        # answered from the process index instead of walking psutil.process_iter
+        if self.client is not None:
+            return next((p["exe"] for p in self.remote_processes if p["pid"] == pid), None)
+        if self.accounting is None:
+            return None
+        return self.accounting.process_cache.exe_for_pid(pid)
 
     def timerEvent(self, _):
+        if self.client is None and self.accounting is None:
+            return  # the data source is still being opened
         process_data = self.print_pid2traffic()
-        total_upload = 0
-        total_download = 0
-
-        for process in process_data:
-            executable_path = self.get_executable_path(process["name"])
-            try:
-                icons = win32gui.ExtractIconEx(executable_path, 0)
-                icon = icons[0][0]
-                width = height = 32
-                hdc = win32ui.CreateDCFromHandle(win32gui.GetDC(0))
-                hbmp = win32ui.CreateBitmap()
-                hbmp.CreateCompatibleBitmap(hdc, width, height)
-                hdc = hdc.CreateCompatibleDC()
-                hdc.SelectObject(hbmp)
-                win32gui.DrawIconEx(hdc.GetHandleOutput(), 0, 0, icon, width, height, 0, None, 0x0003)
-                
-                for iconList in icons:
-                    for icon in iconList:
-                        win32gui.DestroyIcon(icon)
-                hdc.DeleteDC()
-                win32gui.ReleaseDC(0, win32gui.GetDC(0))
-                
-                bitmapbits = hbmp.GetBitmapBits(True)
-                image = QImage(bitmapbits, width, height, QImage.Format_ARGB32_Premultiplied)
-                buffer = QBuffer()
-                buffer.setOpenMode(QIODevice.ReadWrite)
-                image.save(buffer, "PNG")
-                image.loadFromData(buffer.data(), "PNG")
-                pixmap = QPixmap.fromImage(image)
-            except Exception:
-                pixmap = QPixmap("default-icon.png")
-                if not pixmap.isNull():
-                    pixmap = pixmap.scaled(32, 32)
-            
-            process_name = process["name"]
-            total_data_usage = process["Upload"] + process["Download"]
-            data_usage = process["Data Usage"] if total_data_usage == 0 else total_data_usage
-            total_upload += process["Upload"]
-            total_download += process["Download"]
-            pid = process["pid"]
-            item = self.listItems.get(pid)
-            if not item:
-                item = ExeDataWidget(self.lay, pixmap, process_name)
-                self.listItems[pid] = item
-            item.setValue(data_usage)
-        
-        total = total_download + total_upload
-        self.total_data_usage_label.setText(f"Total data usage: {ExeDataWidget.get_size(None, total)}")
-        
-        for item in self.listItems.values():
-            item.setMaximum(total)
-
-    def _process_packet(self, packet):
-        try:
-            if IP in packet:
-                ip_layer = packet[IP]
-                packet_connection = (ip_layer.sport, ip_layer.dport)
-                packet_pid = self.connection2pid.get(packet_connection)
-                if packet_pid:
-                    if packet.src in self.all_macs:
-                        self.pid2traffic[packet_pid][0] += len(packet)
-                    else:
-                        self.pid2traffic[packet_pid][1] += len(packet)
-        except AttributeError:
-            pass
+        # rows are grouped per executable and only those whose counters moved repaint
+        self.usage_model.update(process_data)
+        if self.client is None:
+            self.record_usage(process_data)
+        self.total_data_usage_label.setText(f"Total data usage: {get_size(self.usage_model.total)}")
+        self.update_talkers()
+
+    def update_talkers(self):
+        # only built while the tab is showing
+        if self.tabs.currentIndex() != 1:
+            return
+        if self.client is not None:
+            talkers = self.remote_talkers
+        elif self.accounting is not None:
+            talkers = self.accounting.top_talkers()
+        else:
+            talkers = None
+        if talkers is not None:
+            self.talkers_model.update(talkers[self.talker_kind.currentData()])
+
+    def record_usage(self, processes):
+        # store what each application used since the previous tick
+        self.usage_recorder.record(processes)
 
     def print_pid2traffic(self):
-        processes = []
-        for pid, traffic in self.pid2traffic.items():
-            try:
-                p = psutil.Process(pid)
-                name = p.name()
-                try:
-                    create_time = datetime.fromtimestamp(p.create_time())
-                except OSError:
-                    create_time = datetime.fromtimestamp(psutil.boot_time())
-                process = {
-                    "pid": pid,
-                    "name": name,
-                    "create_time": create_time,
-                    "Upload": traffic[0],
-                    "Download": traffic[1],
-                    "Data Usage": traffic[0] + traffic[1],
-                }
-                try:
-                    process["Upload Speed"] = traffic[0] - self.global_df.at[pid, "Upload"]
-                    process["Download Speed"] = traffic[1] - self.global_df.at[pid, "Download"]
-                except (KeyError, AttributeError):
-                    process["Upload Speed"] = traffic[0]
-                    process["Download Speed"] = traffic[1]
-                    process["Data Usage"] = traffic[0] + traffic[1]
-                processes.append(process)
-            except psutil.NoSuchProcess:
-                continue
-        return processes
+        if self.client is not None:
+            return self.remote_processes
+        return self.accounting.processes()
+
+    def on_daemon_update(self, update):
+        self.remote_processes = update["apps"]
+        self.remote_talkers = update.get("talkers")
 
     # Start the monitoring threads
     def start_monitoring(self):
         self.is_program_running = True
-        self.connection_thread = ConnectionThread(self.connection2pid, self.is_program_running)
-        self.sniffing_thread = SniffingThread(self._process_packet)
+        if isinstance(self.open_source, TrackerClient):
+            self.attach(self.open_source)
+        elif callable(self.open_source):
+            self.total_data_usage_label.setText("Starting capture...")
+            self.source_thread = SourceThread(self.open_source, self)
+            self.source_thread.ready.connect(self.on_source_ready)
+            self.source_thread.failed.connect(self.on_source_failed)
+            self.source_thread.start()
+        else:
+            from app_accounting import AppAccounting
+            self.start_capture(self.open_source, AppAccounting())
+
+    def on_source_ready(self, source, accounting):
+        if not self.is_program_running:
+            return
+        if accounting is None:
+            self.attach(source)
+        else:
+            self.start_capture(source, accounting)
+        self.total_data_usage_label.setText(f"Total data usage: {get_size(0)}")
+        startup_profile.mark("data source ready")
+        self.source_opened.emit()
+
+    def on_source_failed(self, error):
+        self.total_data_usage_label.setText(f"Capture failed: {error}")
+
+    def attach(self, client):
+        self.client = client
+        self.client_thread = DaemonClientThread(self.client, ("apps", "talkers"), 1.0)
+        self.client_thread.updated.connect(self.on_daemon_update)
+        self.client_thread.start()
+
+    def start_capture(self, capture_backend, accounting):
+        from app_accounting import UsageRecorder
+        from capture_threads import AccountingThread, ConnectionThread
+        self.accounting = accounting
+        # the capture backend only queues (flow, direction, length), AccountingThread folds them
+        self.capture_backend = capture_backend
+        # per-app deltas go to disk so history survives restarts; a store has one
+        # writer, "apps" belongs to the tracker daemon
+        self.usage_store = UsageStore("window-apps")
+        self.app_rollups = RollupSet()
+        self.usage_recorder = UsageRecorder(self.usage_store, self.app_rollups)
+        self.connection_thread = ConnectionThread(self.accounting, lambda: self.is_program_running)
+        self.accounting_thread = AccountingThread(self.capture_backend, self.accounting.apply)
+        # names for the remote addresses, read off DNS answers and TLS handshakes
+        from host_names import NameSniffer
+        self.name_sniffer = NameSniffer.for_backend(self.accounting.host_names, self.capture_backend)
         
         self.connection_thread.update.connect(self.update_ui)
-        self.sniffing_thread.update.connect(self.update_ui)
         
         self.connection_thread.start()
-        self.sniffing_thread.start()
+        self.accounting_thread.start()
+        self.name_sniffer.start()
 
     def update_ui(self):
         self.timerEvent(None)
@@ -267,6 +268,13 @@ class NetworkUsageGUI(QWidget):
 
     def closeEvent(self, _):
         self.is_program_running = False
+        if self.client is not None:
+            self.client.close()
+        elif self.capture_backend is not None:
+            self.usage_store.close()
+            self.capture_backend.stop()
+            self.name_sniffer.stop()
+            self.accounting_thread.requestInterruption()
         QApplication.instance().quit()
         
 
@@ -276,9 +284,36 @@ class NetworkUsageGUI(QWidget):
         settings_window.exec_()
 
 
+def open_source(args):
+    """TrackerClient of the daemon, or the capture backend the arguments ask for"""
+    if not (args.backend or args.standalone):
+        try:
+            return connect()
+        except OSError as e:
+            print(f"Tracker daemon unavailable ({e}), capturing in this window")
+    from capture_backends import create_backend
+    options = {"path": args.pcap, "speed": args.speed or None} if args.backend == "pcap" else {}
+    return create_backend(args.backend or "scapy", **options)
+
+
 if __name__ == "__main__":
+    import argparse
     import sys
-    app = QApplication(sys.argv)
-    ex = NetworkUsageGUI()
-    ex.show()
+    parser = argparse.ArgumentParser(description="Per-application data usage tracker")
+    parser.add_argument("--backend", help="capture in this window: scapy, pydivert, pcap or conntrack")
+    parser.add_argument("--pcap", help="capture file to replay with --backend pcap")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 for as fast as possible")
+    parser.add_argument("--standalone", action="store_true", help="don't attach to the tracker daemon")
+    parser.add_argument("--startup-report", action="store_true", help="print where start-up time went")
+    args, qt_args = parser.parse_known_args()
+    with startup_profile.phase("QApplication"):
+        app = QApplication(sys.argv[:1] + qt_args)
+    with startup_profile.phase("build window"):
+        # the daemon connection (which may have to start it) or the capture backend is
+        # opened in the background, the window doesn't wait for it
+        ex = NetworkUsageGUI(lambda: open_source(args))
+        ex.show()
+    QTimer.singleShot(0, lambda: startup_profile.mark("window shown"))
+    if args.startup_report:
+        ex.source_opened.connect(lambda: print(startup_profile.report(), flush=True))
     sys.exit(app.exec())
@@ -1,100 +1,69 @@
-from PyQt5.QtCore import QThread, pyqtSignal, QTimer, Qt
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import *
-import psutil
-import pydivert
-from collections import defaultdict
-import win32gui
-import win32ui
+from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QCursor, QPixmap
+from PyQt5.QtWidgets import (
+    QAbstractItemView, QApplication, QCheckBox, QHBoxLayout, QHeaderView, QLabel,
+    QTableView, QVBoxLayout, QWidget,
+)
 from datetime import datetime
 import time
 from settings import SettingsWindow  # Import the settings window class
-
-class SniffingThread(QThread):
-    update = pyqtSignal()
-
-    def __init__(self, process_packet, parent=None):
-        super().__init__(parent)
-        self.process_packet = process_packet
-
-    def run(self):
-        with pydivert.WinDivert("inbound or outbound") as w:
-            for packet in w:
-                self.process_packet(packet)
-                w.send(packet)
-        self.update.emit()
-
-class ConnectionThread(QThread):
-    update = pyqtSignal()
-
-    def __init__(self, connection2pid, is_program_running, parent=None):
-        super().__init__(parent)
-        self.connection2pid = connection2pid
-        self.is_program_running = is_program_running
-
-    def run(self):
-        while self.is_program_running:
-            for c in psutil.net_connections():
-                if c.laddr and c.raddr and c.pid:
-                    self.connection2pid[(c.laddr.port, c.raddr.port)] = c.pid
-                    self.connection2pid[(c.raddr.port, c.laddr.port)] = c.pid
-            time.sleep(1)
-        self.update.emit()
-
-class ExeDataWidget(QWidget):
-    def get_size(self, bytes: int) -> str:
-        for unit in ["", "K", "M", "G", "T", "P"]:
-            if bytes < 1024:
-                return f"{bytes:.2f}{unit}B"
-            bytes /= 1024
-
-    def __init__(self, lay: QVBoxLayout, pixmap: QPixmap, name: str):
-        super().__init__()
-        self.value = 0
-        hlay = QHBoxLayout(self)
-        self.pixmap = QLabel()
-        self.pixmap.setPixmap(pixmap)
-        self.pixmap.setFixedSize(32, 32)
-        hlay.addWidget(self.pixmap)
-        vlay = QVBoxLayout()
-        hlay.addLayout(vlay)
-        hlay2 = QHBoxLayout()
-        vlay.addLayout(hlay2)
-        self.name = QLabel(name)
-        hlay2.addWidget(self.name)
-        hlay2.addStretch()
-        self.data_usage = QLabel()
-        hlay2.addWidget(self.data_usage)
-        self.progress = QProgressBar()
-        vlay.addWidget(self.progress)
-        lay.addWidget(self)
-
-    def setValue(self, value: int):
-        self.data_usage.setText(self.get_size(value))
-        self.progress.setValue(value)
-
-    def setMaximum(self, maximum: int):
-        self.progress.setMaximum(maximum)
+from capture_threads import AccountingThread, ConnectionThread
+from icon_cache import IconCache
+from capture_backends import PydivertBackend
+from app_accounting import AppAccounting, UsageRecorder
+from usage_store import UsageStore
+from rollups import RollupSet
+from app_policy import PolicyEngine
+from settings_service import SettingsService
+from tracker_client import connect
+from usage_model import (
+    APP_COLUMN, USAGE_COLUMN, SPEED_COLUMN, AppUsageModel, UsageBarDelegate, UsageSortProxyModel, get_size
+)
 
 class NetworkUsageGUI(QWidget):
     def __init__(self):
         super().__init__()
         self.is_program_running = True
-        self.connection2pid = {}
-        self.pid2traffic = defaultdict(lambda: [0, 0])
+        # per-app budgets; only apps with an "app-quotas" entry are ever slowed down
+        self.policy_engine = PolicyEngine()
+        self.accounting = AppAccounting(on_exit=self.policy_engine.forget)
+        # per-app deltas go to disk so history survives restarts; a store has one
+        # writer, "apps" belongs to the tracker daemon
+        self.usage_store = UsageStore("pydivert-apps")
+        self.app_rollups = RollupSet()
+        self.usage_recorder = UsageRecorder(self.usage_store, self.app_rollups)
+        # settings_data.json is watched, saved quotas apply without a restart
+        self.settings_service = SettingsService()
+        self.settings = self.settings_service.settings
+        self.load_app_policies()
+        self.settings_service.changed.connect(self.apply_settings)
+        self.settings_service.start()
+        # without quotas the capture thread only copies headers, parsing happens in batches
+        self.capture_backend = PydivertBackend(self._decide if self.policy_engine.active else None)
         self.setWindowTitle("App Data Tracker")
         self.setGeometry(100, 100, 300, 400)
         main_layout = QVBoxLayout(self)
         self.total_data_usage_label = QLabel("Total data usage: 0B")
         self.total_data_usage_label.setAlignment(Qt.AlignCenter)
         main_layout.addWidget(self.total_data_usage_label)
-        scroll_area = QScrollArea(self)
-        scroll_area.setWidgetResizable(True)
-        widget = QWidget()
-        self.lay = QVBoxLayout(widget)
-        self.lay.setAlignment(Qt.AlignTop)
-        scroll_area.setWidget(widget)
-        main_layout.addWidget(scroll_area)
+        self.icon_cache = IconCache(parent=self)
+        self.usage_model = AppUsageModel(self.icon_cache.pixmap, self)
+        self.icon_cache.icon_ready.connect(self.usage_model.refresh_icon)
+        sort_model = UsageSortProxyModel(self)
+        sort_model.setSourceModel(self.usage_model)
+        self.usage_view = QTableView(self)
+        self.usage_view.setModel(sort_model)
+        self.usage_view.setItemDelegateForColumn(USAGE_COLUMN, UsageBarDelegate(self.usage_model, self))
+        self.usage_view.setSortingEnabled(True)
+        self.usage_view.sortByColumn(USAGE_COLUMN, Qt.DescendingOrder)
+        self.usage_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.usage_view.setIconSize(QSize(32, 32))
+        self.usage_view.verticalHeader().hide()
+        self.usage_view.verticalHeader().setDefaultSectionSize(36)
+        self.usage_view.horizontalHeader().setSectionResizeMode(APP_COLUMN, QHeaderView.Stretch)
+        self.usage_view.horizontalHeader().setSectionResizeMode(SPEED_COLUMN, QHeaderView.ResizeToContents)
+        self.usage_view.setShowGrid(False)
+        main_layout.addWidget(self.usage_view)
         bottom_layout = QHBoxLayout()
         always_on_top_checkbox = QCheckBox("Always on top")
         always_on_top_checkbox.setChecked(False)
@@ -107,62 +76,57 @@ class NetworkUsageGUI(QWidget):
         settings_icon.mousePressEvent = self.open_settings
         bottom_layout.addWidget(settings_icon)
         main_layout.addLayout(bottom_layout)
-        self.listItems = {}
         self.startTimer(1000)
         self.start_monitoring()
 
     def timerEvent(self, _):
-        process_data = self.print_pid2traffic()
-        total_upload = 0
-        total_download = 0
-        for process in process_data:
-            process_name = process["name"]
-            total_data_usage = process["Upload"] + process["Download"]
-            total_upload += process["Upload"]
-            total_download += process["Download"]
-            pid = process["pid"]
-            item = self.listItems.get(pid)
-            if not item:
-                item = ExeDataWidget(self.lay, QPixmap("default-icon.png"), process_name)
-                self.listItems[pid] = item
-            item.setValue(total_data_usage)
-        total = total_download + total_upload
-        self.total_data_usage_label.setText(f"Total data usage: {ExeDataWidget.get_size(None, total)}")
-        for item in self.listItems.values():
-            item.setMaximum(total)
-
-    def _process_packet(self, packet):
-        try:
-            packet_pid = self.connection2pid.get((packet.src_port, packet.dst_port))
-            if packet_pid:
-                if packet.is_outbound:
-                    self.pid2traffic[packet_pid][0] += len(packet.raw)
-                else:
-                    self.pid2traffic[packet_pid][1] += len(packet.raw)
-        except AttributeError:
-            pass
+        if datetime.now().date() != self.policy_day:
+            # a new day, every app gets its full budget back
+            self.load_app_policies(new_day=True)
+        processes = self.print_pid2traffic()
+        self.usage_model.update(processes)
+        self.record_usage(processes)
+        self.total_data_usage_label.setText(f"Total data usage: {get_size(self.usage_model.total)}")
+
+    def record_usage(self, processes):
+        # store what each application used since the previous tick
+        self.usage_recorder.record(processes)
+
+    def apply_settings(self, settings):
+        self.settings = settings
+        self.load_app_policies()
+        self.update_backend()
+
+    def update_backend(self):
+        """Hold traffic for verdicts only while there are app quotas to enforce"""
+        if (self.capture_backend.decide is not None) == self.policy_engine.active:
+            return
+        self.capture_backend = PydivertBackend(self._decide if self.policy_engine.active else None)
+        self.accounting_thread.backend = self.capture_backend
+
+    def load_app_policies(self, new_day=False):
+        # budgets are per day, so start from what each app already used today
+        self.policy_day = datetime.now().date()
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        used_today = {
+            app: upload + download
+            for app, (upload, download) in self.usage_store.totals(midnight, time.time() + 1).items()
+        }
+        self.policy_engine.set_policies(self.settings.app_policies, used_today, reset=new_day)
+
+    def _decide(self, flow, length):
+        """(verdict, delay) for a packet of `flow`, called by the capture thread"""
+        return self.policy_engine.decide(self.accounting.flow_table.lookup(flow), length, time.monotonic())
 
     def print_pid2traffic(self):
-        processes = []
-        for pid, traffic in self.pid2traffic.items():
-            try:
-                p = psutil.Process(pid)
-                processes.append({
-                    "pid": pid,
-                    "name": p.name(),
-                    "Upload": traffic[0],
-                    "Download": traffic[1],
-                })
-            except psutil.NoSuchProcess:
-                continue
-        return processes
+        return self.accounting.processes()
 
     def start_monitoring(self):
         self.is_program_running = True
-        self.connection_thread = ConnectionThread(self.connection2pid, self.is_program_running)
-        self.sniffing_thread = SniffingThread(self._process_packet)
+        self.connection_thread = ConnectionThread(self.accounting, lambda: self.is_program_running)
+        self.accounting_thread = AccountingThread(self.capture_backend, self.accounting.apply)
         self.connection_thread.start()
-        self.sniffing_thread.start()
+        self.accounting_thread.start()
 
     def handle_always_on_top(self, toggled):
         self.setWindowFlag(Qt.WindowStaysOnTopHint, toggled)
@@ -170,15 +134,37 @@ class NetworkUsageGUI(QWidget):
 
     def closeEvent(self, _):
         self.is_program_running = False
+        self.settings_service.stop()
+        self.usage_store.close()
+        self.capture_backend.stop()
+        self.accounting_thread.requestInterruption()
         QApplication.instance().quit()
 
     def open_settings(self, event):
         settings_window = SettingsWindow(self)
         settings_window.exec_()
 
+def open_window(standalone=False):
+    """The daemon's window when the tracker daemon runs (or can be started), which
+    already captures through WinDivert and enforces the app quotas; a window with its
+    own capture and quotas only without it, so there is never a second engine"""
+    if not standalone:
+        try:
+            client = connect()
+        except OSError as e:
+            print(f"Tracker daemon unavailable ({e}), capturing in this window")
+        else:
+            from app_data_usage import NetworkUsageGUI as DaemonUsageGUI
+            return DaemonUsageGUI(client)
+    return NetworkUsageGUI()
+
 if __name__ == "__main__":
+    import argparse
     import sys
-    app = QApplication(sys.argv)
-    window = NetworkUsageGUI()
+    parser = argparse.ArgumentParser(description="Per-application data usage tracker with app quotas")
+    parser.add_argument("--standalone", action="store_true", help="don't attach to the tracker daemon")
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = open_window(args.standalone)
     window.show()
     sys.exit(app.exec())
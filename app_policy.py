@@ -0,0 +1,233 @@
+import heapq
+import ntpath
+import threading
+import time
+from typing import NamedTuple
+
+import psutil
+
+ACCEPT = 0
+DELAY = 1
+DROP = 2
+
+THROTTLE = "throttle"
+BLOCK = "block"
+
+# packets waiting in the delay line before new ones are dropped instead
+MAX_DELAYED_PACKETS = 2048
+# throttled packets that would wait longer than this are dropped, like a full router queue
+MAX_DELAY = 2.0
+# pid -> app state cache is cleared when it grows past this
+MAX_CACHED_PIDS = 4096
+
+
+class AppPolicy(NamedTuple):
+    # process name ("updater.exe") or full executable path, matched case-insensitively
+    app: str
+    # bytes the app may use before the action kicks in
+    budget: int
+    action: str = THROTTLE
+    # bytes/s allowed once throttled
+    rate: int = 64 * 1024
+
+
+def load_app_policies(settings_data):
+    """Read the "app-quotas" section of settings_data.json:
+
+        "app-quotas": {"updater.exe": {"budget": 104857600, "action": "throttle", "rate": 65536}}
+    """
+    policies = []
+    for app, quota in settings_data.get("app-quotas", {}).items():
+        try:
+            action = quota.get("action", THROTTLE)
+            if action not in (THROTTLE, BLOCK):
+                raise ValueError(action)
+            policies.append(AppPolicy(app, int(quota["budget"]), action, int(quota.get("rate", 64 * 1024))))
+        except (KeyError, TypeError, ValueError):
+            print(f"Ignoring invalid app quota for {app}: {quota}")
+    return policies
+
+
+def process_identity(pid):
+    """(name, exe) of a process, both lower-cased, for matching against policies"""
+    try:
+        info = psutil.Process(pid).as_dict(attrs=["name", "exe"], ad_value=None)
+    except (psutil.NoSuchProcess, psutil.AccessDenied, ValueError):
+        return None, None
+    return (info["name"] or "").lower() or None, (info["exe"] or "").lower() or None
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity=None, now=0.0):
+        self.rate = rate
+        # allow a short burst of a quarter second worth of traffic
+        self.capacity = capacity if capacity is not None else max(rate // 4, 1500)
+        self.tokens = self.capacity
+        self.updated = now
+
+    def reserve(self, size, now):
+        """Take `size` tokens, returns how long the packet has to wait for them"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class AppState:
+    __slots__ = ("policy", "used", "bucket")
+
+    def __init__(self, policy, used=0):
+        self.policy = policy
+        self.used = used
+        self.bucket = None
+
+
+class PolicyEngine:
+    """Per-application byte budgets evaluated inline for every packet.
+
+    `decide` is two dict lookups plus a counter update, the PID -> app resolution
+    only happens the first time a PID is seen. Apps over budget are either throttled
+    through a token bucket (DELAY with a wait time) or have their packets dropped;
+    every other app is always ACCEPTed.
+    """
+
+    def __init__(self, policies=(), resolve=process_identity):
+        self.resolve = resolve
+        self.lock = threading.Lock()
+        self.apps = {}
+        self.set_policies(policies)
+
+    def set_policies(self, policies, usage=None, reset=False):
+        """Install policies; `usage` optionally seeds {app: bytes already used}.
+
+        `usage` is keyed like the usage store, by executable path or process name, and
+        a policy given as a bare name is seeded with everything used under that name.
+        Apps whose policy didn't change keep what they used so far unless `reset`.
+        """
+        by_key, by_name = {}, {}
+        for app, used in (usage or {}).items():
+            app = app.lower()
+            by_key[app] = by_key.get(app, 0) + used
+            name = ntpath.basename(app)
+            by_name[name] = by_name.get(name, 0) + used
+        with self.lock:
+            previous = {} if reset else self.apps
+            apps = {}
+            for policy in policies:
+                app = policy.app.lower()
+                used = by_key.get(app, 0) if app != ntpath.basename(app) else by_name.get(app, 0)
+                state = AppState(policy, used)
+                kept = previous.get(app)
+                if kept is not None and kept.policy == policy:
+                    # bytes counted since the store last recorded them are kept too
+                    state.used = max(used, kept.used)
+                    state.bucket = kept.bucket
+                apps[app] = state
+            self.apps = apps
+            # pid -> AppState, or None for processes without a policy
+            self.pids = {}
+
+    @property
+    def active(self):
+        return bool(self.apps)
+
+    def state_for(self, pid):
+        try:
+            return self.pids[pid]
+        except KeyError:
+            pass
+        name, exe = self.resolve(pid)
+        state = self.apps.get(exe) or self.apps.get(name)
+        if len(self.pids) >= MAX_CACHED_PIDS:
+            self.pids.clear()
+        self.pids[pid] = state
+        return state
+
+    def forget(self, pid):
+        """Drop the cached app of an exited PID so a reused PID is resolved again"""
+        self.pids.pop(pid, None)
+
+    def decide(self, pid, length, now):
+        """(verdict, delay seconds) for a packet of `length` bytes belonging to `pid`"""
+        if not pid:
+            return ACCEPT, 0.0
+        state = self.state_for(pid)
+        if state is None:
+            return ACCEPT, 0.0
+        state.used += length
+        if state.used <= state.policy.budget:
+            return ACCEPT, 0.0
+        if state.policy.action == BLOCK:
+            return DROP, 0.0
+        if state.bucket is None:
+            state.bucket = TokenBucket(state.policy.rate, now=now)
+        delay = state.bucket.reserve(length, now)
+        if delay > MAX_DELAY:
+            # give the tokens back, the dropped packet never uses them
+            state.bucket.tokens += length
+            return DROP, 0.0
+        return (DELAY, delay) if delay > 0 else (ACCEPT, 0.0)
+
+    def usage(self):
+        return {app: state.used for app, state in self.apps.items()}
+
+
+class DelayLine(threading.Thread):
+    """Holds throttled packets and hands each to `send` once its delay has passed"""
+
+    def __init__(self, send, max_packets=MAX_DELAYED_PACKETS):
+        super().__init__(daemon=True)
+        self.send = send
+        self.max_packets = max_packets
+        self.queue = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.dropped = 0
+
+    def put(self, packet, due):
+        """Queue `packet` until monotonic time `due`, False if the line is full"""
+        with self.condition:
+            if len(self.queue) >= self.max_packets:
+                self.dropped += 1
+                return False
+            self.sequence += 1
+            heapq.heappush(self.queue, (due, self.sequence, packet))
+            if self.queue[0][1] == self.sequence:
+                self.condition.notify()
+            return True
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    timeout = self.queue[0][0] - time.monotonic() if self.queue else None
+                    self.condition.wait(timeout)
+                due_packets = []
+                now = time.monotonic()
+                while self.queue and self.queue[0][0] <= now:
+                    due_packets.append(heapq.heappop(self.queue)[2])
+            for packet in due_packets:
+                self.send(packet)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+
+def simulate(engine, packets):
+    """Run (pid, length, timestamp) tuples through `engine` without any capture driver.
+
+    Returns {pid: [accepted bytes, delayed bytes, dropped bytes, total delay]}, which
+    is enough to check budgets and throttle rates on any platform.
+    """
+    results = {}
+    for pid, length, timestamp in packets:
+        verdict, delay = engine.decide(pid, length, timestamp)
+        stats = results.setdefault(pid, [0, 0, 0, 0.0])
+        stats[verdict] += length
+        stats[3] += delay
+    return results
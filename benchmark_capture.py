@@ -0,0 +1,358 @@
+"""Offline benchmark of the capture -> accounting -> attribution path.
+
+Runs anywhere (no capture driver or admin rights needed) and drives the same code the
+GUIs and the tracker daemon use: the accountant ring, fold_batch, AppAccounting.apply,
+ConnectionRefresher.refresh and AppAccounting.processes.
+
+    python benchmark_capture.py --flows 2000 --packets 500000 --churn 0.02 --output new.json
+    python benchmark_capture.py --pcap capture.pcapng --output new.json
+    python benchmark_capture.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import psutil
+
+from app_accounting import AppAccounting
+from capture_backends import PcapReplayBackend
+from connection_refresher import ConnectionRefresher
+from flow_table import FlowKey
+from packet_batch import np, PacketAccountant, HeaderAccountant, UPLOAD, DOWNLOAD, flow_of, fold_batch
+from packet_headers import PROTO_TCP, PROTO_UDP, parse_ip_packet
+from pending_flows import UNATTRIBUTED_PID
+
+# results that are better when higher, everything else compared is better when lower
+HIGHER_IS_BETTER = {"packets_per_second", "attribution_accuracy"}
+COMPARED = (
+    "packets_per_second", "cpu_ns_per_packet", "capture_ns_per_packet",
+    "batch_latency_ms.p50", "batch_latency_ms.p99", "refresh_latency_ms.p99",
+    "report_latency_ms.p99", "attribution_accuracy", "rss_mb.growth",
+)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(seconds):
+    milliseconds = [s * 1000 for s in seconds]
+    return {
+        "count": len(milliseconds),
+        "p50": percentile(milliseconds, 0.5),
+        "p99": percentile(milliseconds, 0.99),
+        "max": max(milliseconds) if milliseconds else None,
+    }
+
+
+def ip_header(proto, src, sport, dst, dport, length):
+    """IPv4/IPv6 + first 8 bytes of TCP/UDP, with `length` in the IP length field"""
+    if len(src) == 4:
+        header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, length, 0, 0, 64, proto, 0, src, dst)
+    else:
+        header = struct.pack("!IHBB16s16s", 6 << 28, length - 40, proto, 64, src, dst)
+    return header + struct.pack("!HHI", sport, dport, 0)
+
+
+class SyntheticWorkload:
+    """Packet batches over a set of flows with known owners.
+
+    Packet sizes are uniform in [min_size, max_size], flow popularity is Zipf-like, and
+    after every batch `churn` of the flows are closed and replaced by new ones. The
+    simulated OS connection table lags `refresh_lag` batches behind, so new flows go
+    through the pending-flow path just like on a real machine.
+    """
+
+    def __init__(self, flows=1000, packets=200000, batch_size=2000, churn=0.01,
+                 min_size=64, max_size=1500, ipv6=0.2, refresh_lag=2, seed=1):
+        self.params = {
+            "workload": "synthetic", "flows": flows, "packets": packets, "batch_size": batch_size,
+            "churn": churn, "min_size": min_size, "max_size": max_size, "ipv6": ipv6,
+            "refresh_lag": refresh_lag, "seed": seed,
+        }
+        self.random = random.Random(seed)
+        # real PIDs, so the report stage does real process lookups
+        self.pids = [pid for pid in psutil.pids() if pid] or [os.getpid()]
+        self.next_port = 1024
+        self.truth = defaultdict(int)
+        self.batches = []
+        self.os_views = []
+        active = [self._new_flow(ipv6) for _ in range(flows)]
+        weights = [1 / (rank + 1) for rank in range(flows)]
+        cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        for start in range(0, packets, batch_size):
+            count = min(batch_size, packets - start)
+            chosen = self.random.choices(active, cum_weights=cumulative, k=count)
+            batch = []
+            for key, pid in chosen:
+                length = self.random.randint(min_size, max_size)
+                direction = UPLOAD if self.random.random() < 0.3 else DOWNLOAD
+                if direction == UPLOAD:
+                    raw = ip_header(key.proto, key.laddr, key.lport, key.raddr, key.rport, length)
+                else:
+                    raw = ip_header(key.proto, key.raddr, key.rport, key.laddr, key.lport, length)
+                batch.append((raw, direction))
+                self.truth[pid] += length
+            self.batches.append(batch)
+            self.os_views.append(dict(active))
+            for _ in range(int(churn * flows)):
+                active[self.random.randrange(flows)] = self._new_flow(ipv6)
+        lag = max(0, refresh_lag)
+        # what the connection refresher sees while batch i is being accounted
+        self.os_views = [{}] * lag + self.os_views[:len(self.os_views) - lag] if lag else self.os_views
+
+    def _new_flow(self, ipv6):
+        self.next_port = self.next_port + 1 if self.next_port < 65535 else 1024
+        proto = PROTO_TCP if self.random.random() < 0.8 else PROTO_UDP
+        if self.random.random() < ipv6:
+            local = socket.inet_pton(socket.AF_INET6, "2001:db8::10")
+            remote = socket.inet_pton(socket.AF_INET6, f"2001:db8:1::{self.random.randrange(1, 0xFFFF):x}")
+        else:
+            local = socket.inet_aton("192.168.1.10")
+            remote = struct.pack("!I", self.random.randrange(0x01000000, 0xDF000000))
+        key = FlowKey(proto, local, self.next_port, remote, self.random.choice((443, 80, 53, 5223, 3478)))
+        return key, self.random.choice(self.pids)
+
+
+class PcapWorkload:
+    """Batches replayed from a capture file; every flow gets a PID up front as ground truth"""
+
+    def __init__(self, path, interval=0.1):
+        self.params = {"workload": "pcap", "path": path, "interval": interval}
+        pids = [pid for pid in psutil.pids() if pid] or [os.getpid()]
+        self.batches = list(PcapReplayBackend(path, speed=None, interval=interval).batches())
+        owners = {}
+        self.truth = defaultdict(int)
+        for flows, _, lengths in self.batches:
+            for flow, length in zip(flows, lengths):
+                key = FlowKey(*flow)
+                if key not in owners:
+                    owners[key] = pids[len(owners) % len(pids)]
+                self.truth[owners[key]] += length
+        self.os_views = [owners] * len(self.batches)
+        self.params["flows"] = len(owners)
+        self.params["packets"] = sum(len(batch[0]) for batch in self.batches)
+
+
+class SyntheticRefresher(ConnectionRefresher):
+    """ConnectionRefresher whose OS snapshot is whatever the workload says it is"""
+
+    def __init__(self, flow_table):
+        super().__init__(flow_table, use_proc=False)
+        self.view = {}
+
+    def snapshot(self):
+        return self.view
+
+
+class RssSampler:
+    def __init__(self):
+        self.process = psutil.Process()
+        self.started = time.monotonic()
+        self.samples = []
+
+    def sample(self):
+        self.samples.append((round(time.monotonic() - self.started, 3), self.process.memory_info().rss))
+
+    def summary(self, max_points=50):
+        step = max(1, len(self.samples) // max_points)
+        rss = [value for _, value in self.samples]
+        return {
+            "start": rss[0] / 2 ** 20,
+            "peak": max(rss) / 2 ** 20,
+            "end": rss[-1] / 2 ** 20,
+            "growth": (rss[-1] - rss[0]) / 2 ** 20,
+            "series": [(t, round(value / 2 ** 20, 2)) for t, value in self.samples[::step]],
+        }
+
+
+def run(workload, accountant="header", refresh_every=5, report_every=10):
+    """Push the workload through the accounting path, returns the results dict"""
+    pipeline = AppAccounting()
+    refresher = SyntheticRefresher(pipeline.flow_table)
+    rss = RssSampler()
+    rss.sample()
+    header_mode = accountant == "header" and isinstance(workload, SyntheticWorkload)
+    ring = HeaderAccountant(capacity=1 << 17) if header_mode else PacketAccountant(capacity=1 << 17)
+
+    capture_time = 0.0
+    batch_latency, refresh_latency, report_latency = [], [], []
+    packets = 0
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for number, batch in enumerate(workload.batches):
+        if number % refresh_every == 0:
+            refresher.view = workload.os_views[number]
+            t = time.perf_counter()
+            refresher.refresh()
+            refresh_latency.append(time.perf_counter() - t)
+
+        # producer side: what the capture thread does per packet
+        t = time.perf_counter()
+        if isinstance(workload, SyntheticWorkload):
+            add = ring.add
+            if header_mode:
+                for raw, direction in batch:
+                    add(raw, direction)
+            else:
+                for raw, direction in batch:
+                    header = parse_ip_packet(raw)
+                    add(flow_of(header, direction), direction, header.length)
+            packets += len(batch)
+        else:
+            packets += len(batch[0])
+        capture_time += time.perf_counter() - t
+
+        # consumer side: drain, fold and attribute one batch
+        t = time.perf_counter()
+        columns = ring.drain() if isinstance(workload, SyntheticWorkload) else batch
+        pipeline.apply(fold_batch(*columns))
+        batch_latency.append(time.perf_counter() - t)
+
+        if number % report_every == 0:
+            t = time.perf_counter()
+            pipeline.processes()
+            report_latency.append(time.perf_counter() - t)
+            rss.sample()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    rss.sample()
+
+    # whatever is still pending at the end counts as unattributed
+    settled = pipeline.pending_flows.settle(pipeline.flow_table.lookup, now=float("inf"))
+    for pid, (upload, download) in settled.items():
+        pipeline.counters.add(pid, upload, download)
+    total = sum(workload.truth.values())
+    correct = sum(min(sum(pipeline.counters.get(pid)), truth) for pid, truth in workload.truth.items())
+    unattributed = sum(pipeline.counters.get(UNATTRIBUTED_PID))
+
+    return {
+        "packets": packets,
+        "seconds": elapsed,
+        "packets_per_second": packets / elapsed if elapsed else None,
+        "cpu_ns_per_packet": cpu / packets * 1e9 if packets else None,
+        "capture_ns_per_packet": capture_time / packets * 1e9 if packets else None,
+        "batch_latency_ms": latency_summary(batch_latency),
+        "refresh_latency_ms": latency_summary(refresh_latency),
+        "report_latency_ms": latency_summary(report_latency),
+        "attribution_accuracy": correct / total if total else None,
+        "unattributed_fraction": unattributed / total if total else None,
+        "dropped_packets": ring.ring.dropped_packets,
+        "rss_mb": rss.summary(),
+    }
+
+
+def environment():
+    try:
+        revision = subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np is not None,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def lookup(results, dotted):
+    value = results
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(old_path, new_path, tolerance):
+    """Print old vs new for the headline metrics, returns True if nothing regressed"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    ok = True
+    print(f"{'metric':28} {'old':>12} {'new':>12} {'change':>8}")
+    for metric in COMPARED:
+        before, after = lookup(old["results"], metric), lookup(new["results"], metric)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = -change if metric.split(".")[0] in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  REGRESSED"
+            ok = False
+        print(f"{metric:28} {before:12.4g} {after:12.4g} {change:+8.1%}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pcap", help="replay this pcap/pcapng instead of a synthetic workload")
+    parser.add_argument("--flows", type=int, default=1000)
+    parser.add_argument("--packets", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--churn", type=float, default=0.01, help="fraction of flows replaced per batch")
+    parser.add_argument("--min-size", type=int, default=64)
+    parser.add_argument("--max-size", type=int, default=1500)
+    parser.add_argument("--ipv6", type=float, default=0.2, help="fraction of IPv6 flows")
+    parser.add_argument("--refresh-lag", type=int, default=2, help="batches the OS view lags behind")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--accountant", choices=("header", "packet"), default="header",
+                        help="queue raw headers (pydivert pass-through) or parsed flows (scapy)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed regression for --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(0 if compare(*args.compare, args.tolerance) else 1)
+
+    if args.pcap:
+        workload = PcapWorkload(args.pcap)
+    else:
+        workload = SyntheticWorkload(
+            args.flows, args.packets, args.batch_size, args.churn,
+            args.min_size, args.max_size, args.ipv6, args.refresh_lag, args.seed,
+        )
+    results = run(workload, args.accountant)
+    report = {"environment": environment(), "workload": dict(workload.params, accountant=args.accountant),
+              "results": results}
+
+    print(f"{results['packets']} packets in {results['seconds']:.2f}s: "
+          f"{results['packets_per_second']:,.0f} packets/s, {results['cpu_ns_per_packet']:.0f} ns CPU/packet "
+          f"({results['capture_ns_per_packet']:.0f} ns on the capture side)")
+    for stage in ("batch_latency_ms", "refresh_latency_ms", "report_latency_ms"):
+        latency = results[stage]
+        if latency["count"]:
+            print(f"{stage}: p50 {latency['p50']:.3f} p99 {latency['p99']:.3f} max {latency['max']:.3f}")
+    print(f"attribution accuracy {results['attribution_accuracy']:.2%}, "
+          f"unattributed {results['unattributed_fraction']:.2%}, dropped {results['dropped_packets']}")
+    rss = results["rss_mb"]
+    print(f"RSS {rss['start']:.1f} MB -> {rss['end']:.1f} MB (peak {rss['peak']:.1f} MB)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
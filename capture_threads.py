@@ -0,0 +1,38 @@
+"""The two threads a standalone window runs next to its GUI thread: one keeps the
+AppAccounting flow table in step with the OS, the other folds a capture backend's
+batches into it."""
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from packet_batch import fold_batch
+
+
+class ConnectionThread(QThread):
+    update = pyqtSignal()
+
+    def __init__(self, accounting, is_program_running, parent=None):
+        super().__init__(parent)
+        self.accounting = accounting
+        self.is_program_running = is_program_running
+
+    def run(self):
+        self.accounting.run_connections(self.is_program_running)
+        self.update.emit()
+
+
+class AccountingThread(QThread):
+    def __init__(self, backend, apply, parent=None):
+        super().__init__(parent)
+        self.backend = backend
+        self.apply = apply
+
+    def run(self):
+        # the backend captures on its own thread and hands over (flow, direction, length)
+        # batches; assigning another backend stops this one and carries on with that
+        while not self.isInterruptionRequested():
+            backend = self.backend
+            for batch in backend.batches():
+                self.apply(fold_batch(*batch))
+                if self.isInterruptionRequested() or backend is not self.backend:
+                    backend.stop()
+            if backend is self.backend:
+                break
@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+
+import psutil
+
+from flow_table import FlowKey, flow_key_from_connection
+from packet_headers import PROTO_TCP, PROTO_UDP
+
+# (file under /proc/net, protocol, packed address length)
+PROC_NET_FILES = (
+    ("tcp", PROTO_TCP, 4),
+    ("tcp6", PROTO_TCP, 16),
+    ("udp", PROTO_UDP, 4),
+    ("udp6", PROTO_UDP, 16),
+)
+
+_IPV4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"
+
+
+def _decode_proc_address(field, size):
+    """Decode '0100007F:0035' style /proc/net addresses into (packed ip, port)"""
+    address, port = field.split(":")
+    raw = bytes.fromhex(address)
+    # the kernel prints each 32-bit word in host (little endian) order
+    packed = b"".join(raw[i:i + 4][::-1] for i in range(0, size, 4))
+    if size == 16 and packed.startswith(_IPV4_MAPPED_PREFIX):
+        packed = packed[12:]
+    return packed, int(port, 16)
+
+
+def read_proc_net(proc_root="/proc"):
+    """Return {inode: FlowKey} for every connected TCP/UDP socket on the machine"""
+    sockets = {}
+    for name, proto, size in PROC_NET_FILES:
+        try:
+            with open(os.path.join(proc_root, "net", name)) as f:
+                next(f)  # header line
+                for line in f:
+                    fields = line.split()
+                    inode = int(fields[9])
+                    # listening/unconnected sockets have no remote port, TIME_WAIT has no inode
+                    if not inode or fields[2].endswith(":0000"):
+                        continue
+                    laddr, lport = _decode_proc_address(fields[1], size)
+                    raddr, rport = _decode_proc_address(fields[2], size)
+                    sockets[inode] = FlowKey(proto, laddr, lport, raddr, rport)
+        except (FileNotFoundError, StopIteration):
+            # e.g. IPv6 disabled
+            continue
+    return sockets
+
+
+class InodePidIndex:
+    """Cached socket inode -> PID map built from /proc/<pid>/fd.
+
+    Only inodes that are not cached yet trigger a scan, and processes that already own
+    sockets are scanned first since they are the most likely owners of new ones.
+    Inodes no readable process owns (other users' sockets when unprivileged) are
+    remembered and only looked for again in processes started since.
+    """
+
+    def __init__(self, proc_root="/proc"):
+        self.proc_root = proc_root
+        self.inode2pid = {}
+        self.known_pids = set()
+        self.unresolved = set()
+
+    def scan_pid(self, pid):
+        fd_dir = os.path.join(self.proc_root, str(pid), "fd")
+        found = {}
+        try:
+            with os.scandir(fd_dir) as entries:
+                for entry in entries:
+                    try:
+                        target = os.readlink(entry.path)
+                    except OSError:
+                        continue
+                    if target.startswith("socket:["):
+                        found[int(target[8:-1])] = pid
+        except OSError:
+            # process exited or we lack permission to look at it
+            pass
+        return found
+
+    def scan(self, groups, wanted):
+        """Scan the pids of each group in turn until every inode in `wanted` is found"""
+        for group in groups:
+            for pid in group:
+                found = self.scan_pid(pid)
+                self.inode2pid.update(found)
+                wanted -= found.keys()
+                if not wanted:
+                    return
+
+    def resolve(self, inodes):
+        """Return {inode: pid} for `inodes`, scanning /proc only for uncached ones"""
+        # forget sockets that are gone
+        for inode in self.inode2pid.keys() - inodes:
+            del self.inode2pid[inode]
+        missing = inodes - self.inode2pid.keys()
+        self.unresolved &= missing
+        if missing:
+            pids = {int(name) for name in os.listdir(self.proc_root) if name.isdigit()}
+            new_pids = pids - self.known_pids
+            fresh = missing - self.unresolved
+            if fresh:
+                owners = set(self.inode2pid.values()) & pids
+                self.scan((owners, new_pids, pids - owners - new_pids), fresh)
+            # a full scan didn't find these before, only a new process can own them now
+            retry = self.unresolved - self.inode2pid.keys()
+            if retry and new_pids:
+                self.scan((new_pids,), retry)
+            self.unresolved = missing - self.inode2pid.keys()
+            self.known_pids = pids
+        return {inode: self.inode2pid[inode] for inode in inodes if inode in self.inode2pid}
+
+
+class ConnectionRefresher:
+    """Keep a FlowTable in step with the OS by applying only added/removed connections.
+
+    The polling interval halves whenever connections churn and slowly backs off
+    towards `max_interval` while the table is stable.
+    """
+
+    def __init__(self, flow_table, min_interval=0.25, max_interval=2.0, use_proc=None):
+        self.flow_table = flow_table
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = 1.0
+        self.previous = {}
+        if use_proc is None:
+            use_proc = sys.platform.startswith("linux") and os.path.exists("/proc/net/tcp")
+        self.inode_index = InodePidIndex() if use_proc else None
+
+    def snapshot(self):
+        """Current {FlowKey: pid} of every connected socket"""
+        if self.inode_index is not None:
+            sockets = read_proc_net(self.inode_index.proc_root)
+            inode2pid = self.inode_index.resolve(sockets.keys())
+            return {key: inode2pid[inode] for inode, key in sockets.items() if inode in inode2pid}
+        connections = {}
+        for c in psutil.net_connections():
+            if c.pid:
+                key = flow_key_from_connection(c)
+                if key:
+                    connections[key] = c.pid
+        return connections
+
+    def refresh(self, now=None):
+        """Apply one diff to the flow table, returns (added, removed) counts"""
+        current = self.snapshot()
+        previous = self.previous
+        added = 0
+        for key, pid in current.items():
+            if previous.get(key) != pid:
+                self.flow_table.add(key, pid)
+                added += 1
+        removed = previous.keys() - current.keys()
+        for key in removed:
+            self.flow_table.close(key, now)
+        self.flow_table.expire(now)
+        self.previous = current
+
+        if added or removed:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.25)
+        return added, len(removed)
+
+    def run(self, is_running):
+        while is_running():
+            self.refresh()
+            time.sleep(self.interval)
@@ -0,0 +1,102 @@
+import threading
+import time
+from typing import NamedTuple
+
+import psutil
+
+COUNTER_32 = 1 << 32
+COUNTER_64 = 1 << 64
+
+
+class CounterSample(NamedTuple):
+    timestamp: float
+    # bytes moved since the sampler was created, never decreasing
+    bytes_sent: int
+    bytes_recv: int
+    # nic name -> (bytes sent, bytes received) since the sampler was created
+    pernic: dict
+
+    @property
+    def total(self):
+        return self.bytes_sent + self.bytes_recv
+
+
+def counter_delta(old, new):
+    """Bytes between two raw readings of one counter, allowing for wraps and resets"""
+    if new >= old:
+        return new - old
+    # a counter that wrapped was close to its limit and is now small
+    for limit in (COUNTER_32, COUNTER_64):
+        if old < limit and limit - old + new < limit // 4:
+            return limit - old + new
+    # otherwise the NIC was reset (driver reload, unplug) and counts from zero again
+    return new
+
+
+class CounterSampler:
+    """Per-NIC psutil.net_io_counters() sampler with monotonic totals.
+
+    Every consumer in the process shares one instance (see `shared_sampler`) and a
+    sample younger than `max_age` seconds is reused, so several timers polling at
+    different rates cost one syscall per tick and always agree with each other.
+    """
+
+    def __init__(self, max_age=0.1):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # nic -> last raw (sent, recv)
+        self.raw = {}
+        # nic -> accumulated [sent, recv]
+        self.accumulated = {}
+        self.bytes_sent = 0
+        self.bytes_recv = 0
+        self.last_sample = None
+        self._read(first=True)
+
+    def _read(self, first=False):
+        counters = psutil.net_io_counters(pernic=True, nowrap=False)
+        for nic, stats in counters.items():
+            previous = self.raw.get(nic)
+            self.raw[nic] = (stats.bytes_sent, stats.bytes_recv)
+            totals = self.accumulated.setdefault(nic, [0, 0])
+            if previous is None:
+                # NICs present at start are the baseline; ones that show up later
+                # (VPN, hotplug) count from zero
+                if first:
+                    continue
+                sent, recv = stats.bytes_sent, stats.bytes_recv
+            else:
+                sent = counter_delta(previous[0], stats.bytes_sent)
+                recv = counter_delta(previous[1], stats.bytes_recv)
+            totals[0] += sent
+            totals[1] += recv
+            self.bytes_sent += sent
+            self.bytes_recv += recv
+        # a NIC that went away starts from zero if it comes back
+        for nic in self.raw.keys() - counters.keys():
+            del self.raw[nic]
+        self.last_sample = CounterSample(
+            time.monotonic(), self.bytes_sent, self.bytes_recv,
+            {nic: tuple(totals) for nic, totals in self.accumulated.items()},
+        )
+        return self.last_sample
+
+    def sample(self):
+        """Latest CounterSample, re-reading the NICs at most once per `max_age`"""
+        with self.lock:
+            if time.monotonic() - self.last_sample.timestamp < self.max_age:
+                return self.last_sample
+            return self._read()
+
+
+_shared_sampler = None
+_shared_lock = threading.Lock()
+
+
+def shared_sampler():
+    """The process-wide CounterSampler, created on first use"""
+    global _shared_sampler
+    with _shared_lock:
+        if _shared_sampler is None:
+            _shared_sampler = CounterSampler()
+        return _shared_sampler
@@ -0,0 +1,172 @@
+from array import array
+from collections import deque
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, snapshots are then plain arrays
+    np = None
+
+# pid column value of a recycled slot; UNATTRIBUTED_PID (-1) is a real row
+FREE_PID = -2
+
+
+class CounterColumns(NamedTuple):
+    """Column-wise copy of a CounterTable, one entry per live PID.
+
+    NumPy int64 arrays when NumPy is installed, array("q") otherwise.
+    """
+
+    pids: object
+    upload: object
+    download: object
+    packets: object
+
+    def totals(self):
+        """(upload, download) over every PID"""
+        if np is not None:
+            return int(self.upload.sum()), int(self.download.sum())
+        return sum(self.upload), sum(self.download)
+
+    def by_usage(self, limit=None):
+        """Row indices, heaviest users first"""
+        if np is not None:
+            order = np.argsort(-(self.upload + self.download), kind="stable")
+        else:
+            usage = [up + down for up, down in zip(self.upload, self.download)]
+            order = sorted(range(len(usage)), key=usage.__getitem__, reverse=True)
+        return order[:limit] if limit is not None else order
+
+
+class CounterTable:
+    """Per-PID upload / download / packet counters in flat typed columns.
+
+    A PID owns one slot (row index) until it is released; released slots are zeroed
+    and handed to the next new PID, so the columns only grow with the number of PIDs
+    alive at once, and adding to a known PID allocates nothing.
+
+    One thread adds while another may take snapshots: the pid column is extended
+    last, so a snapshot never sees a slot whose counters are missing. Releases from
+    the snapshot side are only queued, the adding thread applies them in `collect`,
+    so bytes can't be added to a slot that was just handed to another PID.
+    """
+
+    def __init__(self):
+        self.slot_of = {}
+        self.free_slots = []
+        self.released = deque()
+        self.pids = array("q")
+        self.upload = array("q")
+        self.download = array("q")
+        self.packets = array("q")
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, pid):
+        return pid in self.slot_of
+
+    def slot(self, pid):
+        slot = self.slot_of.get(pid)
+        if slot is None:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+                # zeroed before the pid is set, a snapshot never sees the old counts
+                self.upload[slot] = self.download[slot] = self.packets[slot] = 0
+                self.pids[slot] = pid
+            else:
+                slot = len(self.pids)
+                self.upload.append(0)
+                self.download.append(0)
+                self.packets.append(0)
+                self.pids.append(pid)
+            self.slot_of[pid] = slot
+        return slot
+
+    def add(self, pid, upload, download, packets=0):
+        slot = self.slot(pid)
+        self.upload[slot] += upload
+        self.download[slot] += download
+        self.packets[slot] += packets
+
+    def get(self, pid):
+        """(upload, download) of `pid`, zeros when it has no slot"""
+        slot = self.slot_of.get(pid)
+        if slot is None:
+            return 0, 0
+        return self.upload[slot], self.download[slot]
+
+    def release(self, pid):
+        """Forget `pid` and recycle its slot, at the adding thread's next `collect`"""
+        self.released.append(pid)
+
+    def collect(self):
+        """Apply the queued releases; called by the thread that adds"""
+        while self.released:
+            slot = self.slot_of.pop(self.released.popleft(), None)
+            if slot is None:
+                continue
+            self.pids[slot] = FREE_PID
+            self.upload[slot] = self.download[slot] = self.packets[slot] = 0
+            self.free_slots.append(slot)
+
+    def snapshot(self):
+        """CounterColumns of every live PID"""
+        pids = array("q", self.pids)
+        count = len(pids)
+        columns = (pids, self.upload[:count], self.download[:count], self.packets[:count])
+        if np is not None:
+            pids, upload, download, packets = (np.frombuffer(column, dtype=np.int64) for column in columns)
+            live = pids != FREE_PID
+            return CounterColumns(pids[live], upload[live], download[live], packets[live])
+        live = [slot for slot, pid in enumerate(pids) if pid != FREE_PID]
+        if len(live) == count:
+            return CounterColumns(*columns)
+        return CounterColumns(*(array("q", (column[slot] for slot in live)) for column in columns))
+
+
+# RemoteCounters key of the bytes that can't be put on one remote address
+OTHER_REMOTE = None
+
+
+class RemoteCounters:
+    """Upload / download per (PID, remote address).
+
+    A PID keeps at most `max_remotes` addresses, beyond that (and for bytes whose flow
+    is no longer known) its traffic is summed under OTHER_REMOTE, so a process talking
+    to huge numbers of peers costs bounded memory.
+    """
+
+    def __init__(self, max_remotes=256):
+        self.max_remotes = max_remotes
+        # pid -> {remote address: [upload, download]}
+        self.by_pid = {}
+        # released on the reading side, dropped by the adding thread in `collect`
+        self.released = deque()
+
+    def add(self, pid, remote, upload, download):
+        remotes = self.by_pid.get(pid)
+        if remotes is None:
+            remotes = self.by_pid[pid] = {}
+        counters = remotes.get(remote)
+        if counters is None:
+            if len(remotes) >= self.max_remotes:
+                remote = OTHER_REMOTE
+                counters = remotes.get(remote)
+            if counters is None:
+                counters = remotes[remote] = [0, 0]
+        counters[0] += upload
+        counters[1] += download
+
+    def get(self, pid):
+        """{remote address: (upload, download)} of `pid`"""
+        # dict() copies in one step, the adding thread may insert meanwhile
+        return {remote: tuple(counters) for remote, counters in dict(self.by_pid.get(pid, {})).items()}
+
+    def release(self, pid):
+        self.released.append(pid)
+
+    def collect(self):
+        """Drop the released PIDs; called by the thread that adds"""
+        while self.released:
+            self.by_pid.pop(self.released.popleft(), None)
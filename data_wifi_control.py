@@ -1,11 +1,11 @@
 import os
-import psutil
 import time
-import json
 import pywifi
 import sys
+import math
+import threading
 
-from PyQt5.QtCore import Qt, QTimerEvent
+from PyQt5.QtCore import Qt
 from pywifi import const
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QMessageBox
@@ -19,45 +19,71 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
 )
 from PyQt5.QtCore import QThread, pyqtSignal
+from rollups import RollupEngine
+from counter_sampler import shared_sampler
+from quota_engine import DEFAULT_RATE_FLOOR, Threshold, ThresholdEngine, link_capacity
+from settings_service import SettingsService
+
+# fractions of the data limit that raise an early warning
+WARNING_LEVELS = (0.8, 0.9)
+# time the "Wi-Fi disabled" message stays up before the disconnect happens
+DISCONNECT_DELAY = 3
 
 class DataUsageTracker(QThread):
     # Signals for GUI updates
     wifi_disabled = pyqtSignal()
     data_limit_alert = pyqtSignal()
     exceeded_data_limit_alert = pyqtSignal()
+    data_limit_warning = pyqtSignal(int)
     data_usage_updated = pyqtSignal(float)
 
-    def __init__(self, enable_exceeded_limit=False):
+    def __init__(self, enable_exceeded_limit=False, settings_service=None, exit_app=True):
         super().__init__()
+        # whether cutting the connection or an unlimited exceeded limit ends the program
+        self.exit_app = exit_app
         
         # Store the initial baseline network stats
-        self.initial_data_sent = psutil.net_io_counters().bytes_sent
-        self.initial_data_received = psutil.net_io_counters().bytes_recv
+        # (one shared, wrap- and reset-safe per-NIC sampler for the whole process)
+        self.sampler = shared_sampler()
+        initial_stats = self.sampler.sample()
+        self.initial_data_sent = initial_stats.bytes_sent
+        self.initial_data_received = initial_stats.bytes_recv
         self.total_data_used = 0.0  # Initialize total data used to 0
+        self.started_at = time.time()
+        self.recorded_data_sent = self.initial_data_sent
+        self.recorded_data_received = self.initial_data_received
+        # Usage rollups, the limit checks read totals from the coarsest tier that fits
+        self.rollups = RollupEngine()
         #print("Tracking already.. --")
         self.data_limit = None  # in bytes
         #self.total_data_used = 0  # in bytes
         self.total_exceeded_data = 0.0
         self.check_data_limit = False  # preventing data enable-alert-message popping up multiple times
-        self.exceeded_data_limit = enable_exceeded_limit
         #self.adapter_name = self.get_wifi_adapter()
-        self.settings_data = self.load_settings()
+        # Settings follow settings_data.json, a saved limit applies without a restart
+        if settings_service is None:
+            settings_service = SettingsService()
+            settings_service.start()
+        self.settings_service = settings_service
+        self.settings = settings_service.settings
         self.running = True
+        # The thread sleeps until the next threshold could be crossed, or until woken
+        self.wakeup = threading.Event()
+        self.engine = ThresholdEngine(rate_floor=max(DEFAULT_RATE_FLOOR, link_capacity()))
+        self.disconnect_at = None
+        self.exceeded_data_limit = enable_exceeded_limit
+        self.settings_service.subscribe(self.apply_settings)
         #print(f'settings are: {self.settings_data['data-limit']}')
         #print(f'running is {self.running}')
-        self.startTimer(100)
         #self.run()
         #self.show()
         
 
-    def load_settings(self):
-        try:
-            with open("settings_data.json", "r") as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
-
-        # Default enable states can be hardcoded or loaded from other files
+    def apply_settings(self, settings):
+        # called by the settings service whenever the file changes
+        self.settings = settings
+        self.arm_thresholds()
+        self.wakeup.set()
         
     def disconnect_wifi(self):
         wifi = pywifi.PyWiFi()
@@ -79,19 +105,50 @@ class DataUsageTracker(QThread):
 
     def get_data_usage(self):
         """Get total data usage for the Wi-Fi adapter."""
-        if self.adapter_name and self.adapter_name in psutil.net_io_counters(pernic=True):
-            stats = psutil.net_io_counters(pernic=True)[self.adapter_name]
-            return stats.bytes_sent + stats.bytes_recv
+        pernic = self.sampler.sample().pernic
+        if self.adapter_name and self.adapter_name in pernic:
+            sent, received = pernic[self.adapter_name]
+            return sent + received
         return 0
         
-    def timerEvent(self, event: QTimerEvent):
+    @property
+    def exceeded_data_limit(self):
+        return self._exceeded_data_limit
+
+    @exceeded_data_limit.setter
+    def exceeded_data_limit(self, enabled):
+        # set from the GUI thread once the user accepts the exceeded limit
+        self._exceeded_data_limit = enabled
+        self.arm_thresholds()
+        self.wakeup.set()
+
+    def arm_thresholds(self):
+        """Translate the settings into the byte thresholds the engine waits for"""
+        thresholds = []
+        data_limit = self.settings.data_limit
+        if self.settings.enable_data_limit and data_limit is not None:
+            for level in WARNING_LEVELS:
+                thresholds.append(Threshold(f"warning-{int(level * 100)}", int(data_limit * level)))
+            thresholds.append(Threshold("data-limit", data_limit))
+            exceeded_limit = self.settings.exceeded_data_limit
+            if self.exceeded_data_limit == True and exceeded_limit is not None:
+                #resetting data limit to the sum of data-limit and exceeded-data-limit
+                self.total_exceeded_data = data_limit + exceeded_limit
+                thresholds.append(Threshold("exceeded-data-limit", self.total_exceeded_data))
+        self.engine.set_thresholds(thresholds)
+
+    def update_usage(self):
         # Use psutil to monitor network usage
-        network_stats = psutil.net_io_counters()
+        network_stats = self.sampler.sample()
         data_sent = network_stats.bytes_sent
         data_received = network_stats.bytes_recv
 
+        # Feed what was used since the last tick into the rollups
+        self.rollups.add(time.time(), data_sent - self.recorded_data_sent, data_received - self.recorded_data_received)
+        self.recorded_data_sent, self.recorded_data_received = data_sent, data_received
+
         # Calculate total data usage since program start
-        self.total_data_used = (data_sent - self.initial_data_sent) + (data_received - self.initial_data_received)
+        self.total_data_used = sum(self.rollups.total(self.started_at))
 
         # Convert to MB for display
         '''total_data_in_mb = self.total_data_used / (1024 ** 2)
@@ -109,50 +166,52 @@ class DataUsageTracker(QThread):
     def run(self):
         """Start tracking data usage."""
         while self.running:
-            #current_data_usage = self.get_data_usage()
-            #self.total_data_used = current_data_usage - initial_data_usage
-            #print("The program is running.. --")
-
-            #if self.enable_data_limit and self.data_limit and self.total_data_used >= self.data_limit:
-            if self.settings_data['enable-data-limit'] == True and self.settings_data['data-limit'] != 'Null':
-                if self.total_data_used >= self.settings_data['data-limit']:
-                    if self.check_data_limit == False:
-                        if self.settings_data['enable-alert-message'] == True:
-                            self.data_limit_alert.emit()
-                            self.check_data_limit = True
-                        else:
-                            self.wifi_disabled.emit()
-                            time.sleep(3)
-                            self.disconnect_wifi()
-                            #self.running = False
-                            
-
-                if self.exceeded_data_limit == True:
-                    
-                    #print(f'exceeded settings for are: {self.settings_data['exceeded-data-limit']}')
-                    if self.settings_data['exceeded-data-limit'] == "Unlimited":
-                        # Stop tracking when exceeded limit is unlimited
-                        self.exit_program()
-                        #self.running = False
-                        
-                    elif isinstance(self.settings_data['exceeded-data-limit'], (int, float)) == True:
-                        #resetting data limit to the sum of data-limit and exceeded-data-limit 
-                        self.total_exceeded_data = self.settings_data['data-limit'] + self.settings_data['exceeded-data-limit']   
-                        if self.total_data_used >= self.total_exceeded_data:
-                            self.exceeded_data_limit_alert.emit()
-                            time.sleep(3)
-                            #self.running = False
-                            self.disconnect_wifi()
-
-            time.sleep(1)  # Check every second
-            
+            now = time.monotonic()
+            self.update_usage()
+            for threshold in self.engine.observe(self.total_data_used, now):
+                self.handle_threshold(threshold, now)
+
+            if self.exceeded_data_limit == True and self.settings.exceeded_data_limit is None:
+                # Stop tracking when exceeded limit is unlimited
+                self.exit_program()
+                break
+
+            if self.disconnect_at is not None and now >= self.disconnect_at:
+                self.disconnect_at = None
+                self.disconnect_wifi()
+
+            # Sleep until the next threshold could possibly be crossed
+            timeout = self.engine.sleep_time()
+            if self.disconnect_at is not None:
+                timeout = min(timeout, self.disconnect_at - now)
+            self.wakeup.wait(None if timeout == math.inf else max(0, timeout))
+            self.wakeup.clear()
+
+    def handle_threshold(self, threshold, now):
+        if threshold.name == "data-limit":
+            if self.settings.enable_alert_message:
+                self.data_limit_alert.emit()
+                self.check_data_limit = True
+            else:
+                self.wifi_disabled.emit()
+                self.disconnect_at = now + DISCONNECT_DELAY
+        elif threshold.name == "exceeded-data-limit":
+            self.exceeded_data_limit_alert.emit()
+            self.disconnect_at = now + DISCONNECT_DELAY
+        else:
+            self.data_limit_warning.emit(int(threshold.name.split("-")[1]))
+
     '''def stop(self):
         self.running = False'''
         
     def exit_program(self):
-        """Exit the entire program."""     
-        QApplication.quit() # Exit the application
+        """Exit the entire program, or only stop tracking when `exit_app` is off."""     
         self.running = False
+        self.wakeup.set()
+        if not self.exit_app:
+            # the tracker daemon keeps counting without the limit checks
+            return
+        QApplication.quit() # Exit the application
         # Terminate Python interpreter
         sys.exit()
     
@@ -167,6 +226,7 @@ class DataUsageApp(QWidget):
         self.tracker.wifi_disabled.connect(self.show_wifi_disabled_message)
         self.tracker.data_limit_alert.connect(self.show_data_limit_alert)
         self.tracker.exceeded_data_limit_alert.connect(self.show_exceeded_data_limit_alert)
+        self.tracker.data_limit_warning.connect(self.show_data_limit_warning)
         self.tracker.start()
         
         
@@ -179,6 +239,9 @@ class DataUsageApp(QWidget):
     def show_wifi_disabled_message(self):
         QMessageBox.critical(self, "Wi-Fi Disabled", "Your Wi-Fi has been disabled because you exceeded your data limit.")
 
+    def show_data_limit_warning(self, percent):
+        QMessageBox.warning(self, "Data Limit Warning", f"You have used {percent}% of your data limit.")
+
     def show_data_limit_alert(self):
         """Show a confirmation dialog for data limit reached and handle user response."""
         if hasattr(self, "alert_in_progress") and self.alert_in_progress:
@@ -0,0 +1,137 @@
+import socket
+import time
+from functools import lru_cache
+from typing import NamedTuple
+
+from packet_headers import PROTO_TCP, PROTO_UDP
+
+# how long a closed connection keeps its PID so late packets are still attributed
+DEFAULT_LINGER = 30.0
+
+
+class FlowKey(NamedTuple):
+    proto: int
+    # packed local / remote addresses, same form as PacketHeader.src / dst
+    laddr: bytes
+    lport: int
+    raddr: bytes
+    rport: int
+
+
+@lru_cache(maxsize=4096)
+def pack_address(ip: str) -> bytes:
+    """Pack a psutil address string, folding IPv4-mapped IPv6 back to IPv4"""
+    if ":" in ip:
+        if ip.startswith("::ffff:") and "." in ip:
+            return socket.inet_aton(ip[7:])
+        # strip the zone id of link-local addresses ("fe80::1%eth0")
+        return socket.inet_pton(socket.AF_INET6, ip.split("%", 1)[0])
+    return socket.inet_aton(ip)
+
+
+def unpack_address(address: bytes) -> str:
+    """Printable form of a pack_address result"""
+    return socket.inet_ntop(socket.AF_INET if len(address) == 4 else socket.AF_INET6, address)
+
+
+def flow_key_from_connection(conn):
+    """Build a FlowKey from a psutil connection, None if it has no remote end"""
+    if not (conn.laddr and conn.raddr):
+        return None
+    proto = PROTO_TCP if conn.type == socket.SOCK_STREAM else PROTO_UDP
+    return FlowKey(
+        proto, pack_address(conn.laddr.ip), conn.laddr.port,
+        pack_address(conn.raddr.ip), conn.raddr.port,
+    )
+
+
+class FlowTable:
+    """5-tuple -> PID table with a (proto, lport, rport) index and ageing of closed flows.
+
+    Keys are always local-oriented, so one connection is stored once. Lookups first try
+    the exact key; the port index covers packets whose local address differs from the
+    one psutil reports (wildcard binds, virtual adapters).
+    """
+
+    def __init__(self, linger=DEFAULT_LINGER):
+        self.linger = linger
+        self.flows = {}
+        # (proto, lport, rport) -> FlowKey, or {raddr: FlowKey} when ports collide
+        self.port_index = {}
+        # FlowKey -> time it disappeared from the OS connection table
+        self.closed = {}
+        # bumped on every add so readers can tell when new owners may be known
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __contains__(self, key):
+        return key in self.flows
+
+    def add(self, key, pid):
+        self.flows[key] = pid
+        self.generation += 1
+        self.closed.pop(key, None)
+        ports = (key.proto, key.lport, key.rport)
+        indexed = self.port_index.get(ports)
+        if indexed is None or indexed == key:
+            self.port_index[ports] = key
+        elif isinstance(indexed, dict):
+            indexed[key.raddr] = key
+        else:
+            self.port_index[ports] = {indexed.raddr: indexed, key.raddr: key}
+
+    def close(self, key, now=None):
+        """Mark `key` as gone from the OS table, it is dropped after `linger` seconds"""
+        if key in self.flows and key not in self.closed:
+            self.closed[key] = time.monotonic() if now is None else now
+
+    def remove(self, key):
+        self.closed.pop(key, None)
+        if self.flows.pop(key, None) is None:
+            return
+        ports = (key.proto, key.lport, key.rport)
+        indexed = self.port_index.get(ports)
+        if isinstance(indexed, dict):
+            if indexed.get(key.raddr) == key:
+                del indexed[key.raddr]
+            if len(indexed) == 1:
+                self.port_index[ports] = next(iter(indexed.values()))
+            elif not indexed:
+                del self.port_index[ports]
+        elif indexed == key:
+            del self.port_index[ports]
+
+    def expire(self, now=None):
+        """Drop closed flows older than `linger`, returns how many were removed"""
+        deadline = (time.monotonic() if now is None else now) - self.linger
+        expired = [key for key, closed_at in self.closed.items() if closed_at <= deadline]
+        for key in expired:
+            self.remove(key)
+        return len(expired)
+
+    def sync(self, connections, now=None):
+        """Make the table match a full {FlowKey: pid} snapshot of the OS"""
+        for key, pid in connections.items():
+            if self.flows.get(key) != pid or key in self.closed:
+                self.add(key, pid)
+        for key in self.flows.keys() - connections.keys():
+            self.close(key, now)
+        self.expire(now)
+
+    def lookup(self, key):
+        """PID owning the local-oriented flow `key` (a FlowKey or plain tuple), or None"""
+        pid = self.flows.get(key)
+        if pid is not None:
+            return pid
+        indexed = self.port_index.get((key[0], key[2], key[4]))
+        if indexed is None:
+            return None
+        if isinstance(indexed, dict):
+            indexed = indexed.get(key[3])
+            if indexed is None:
+                return None
+        elif indexed.raddr != key[3]:
+            return None
+        return self.flows.get(indexed)
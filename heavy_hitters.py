@@ -0,0 +1,191 @@
+"""Heaviest keys of a weighted stream in bounded memory.
+
+SpaceSaving keeps `capacity` counters, however many distinct keys (remote addresses,
+process/peer pairs) go by: a new key takes over the smallest counter and inherits its
+count as the error bound. Any key heavier than total / capacity is always kept, and
+its count overestimates the true one by at most the error.
+"""
+import heapq
+import threading
+from itertools import count as sequence
+from typing import NamedTuple
+
+DEFAULT_CAPACITY = 256
+# windowed counts cover the last WINDOW seconds, rotated SLICES times per window
+WINDOW = 60.0
+SLICES = 6
+
+
+class HeavyHitter(NamedTuple):
+    key: object
+    # bytes, at most `error` more than were really seen
+    count: int
+    error: int
+
+
+class SpaceSaving:
+    """Space-Saving counters with a lazily refreshed min-heap for eviction"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.counters = {}
+        # (count when pushed, tie breaker, key), one entry per monitored key; entries
+        # go stale as counts grow and are refreshed when they reach the top
+        self.heap = []
+        self.order = sequence()
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counters)
+
+    def add(self, key, weight):
+        self.total += weight
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [weight, 0]
+            heapq.heappush(self.heap, (weight, next(self.order), key))
+            return
+        heap, counters = self.heap, self.counters
+        while True:
+            smallest, _, victim = heap[0]
+            current = counters[victim][0]
+            if current == smallest:
+                break
+            heapq.heapreplace(heap, (current, next(self.order), victim))
+        del counters[victim]
+        counters[key] = [smallest + weight, smallest]
+        heapq.heapreplace(heap, (smallest + weight, next(self.order), key))
+
+    def min_count(self):
+        """Upper bound of the count of any key that isn't monitored"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    def top(self, limit=None):
+        """HeavyHitters, heaviest first"""
+        hitters = sorted(
+            (HeavyHitter(key, count, error) for key, (count, error) in self.counters.items()),
+            key=lambda hitter: hitter.count, reverse=True,
+        )
+        return hitters[:limit] if limit is not None else hitters
+
+
+def merge_top(sketches, limit=None):
+    """Top of several SpaceSaving sketches of disjoint parts of one stream.
+
+    A key a full sketch doesn't monitor may still have up to its min_count there, which
+    is added to the key's error.
+    """
+    floors = [sketch.min_count() for sketch in sketches]
+    merged = {}
+    for sketch in sketches:
+        for key, (count, error) in sketch.counters.items():
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [count, error]
+            else:
+                entry[0] += count
+                entry[1] += error
+    unseen = sum(floors)
+    hitters = []
+    for key, (count, error) in merged.items():
+        missing = unseen - sum(floor for floor, sketch in zip(floors, sketches) if key in sketch.counters)
+        hitters.append(HeavyHitter(key, count, error + missing))
+    hitters.sort(key=lambda hitter: hitter.count, reverse=True)
+    return hitters[:limit] if limit is not None else hitters
+
+
+class WindowedTopK:
+    """Top keys since start and over the last `window` seconds.
+
+    The window is `slices` SpaceSaving sketches of window / slices seconds each; the
+    oldest is cleared as time moves on, and `recent` merges them. A slice is folded
+    into the all-time sketch when it closes, so a batch only updates one sketch.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, window=WINDOW, slices=SLICES):
+        self.capacity = capacity
+        self.slice_length = window / slices
+        self.all_time = SpaceSaving(capacity)
+        self.slices = [SpaceSaving(capacity) for _ in range(slices)]
+        self.current = None
+        self.lock = threading.Lock()
+
+    def _rotate(self, now):
+        current = int(now // self.slice_length)
+        if self.current is None:
+            self.current = current
+        elif current > self.current:
+            add = self.all_time.add
+            for key, (count, _) in self.slices[self.current % len(self.slices)].counters.items():
+                add(key, count)
+            # clear the slices that fell out of the window, at most all of them
+            for index in range(self.current + 1, min(current, self.current + len(self.slices)) + 1):
+                self.slices[index % len(self.slices)] = SpaceSaving(self.capacity)
+            self.current = current
+        return self.slices[self.current % len(self.slices)]
+
+    def add(self, key, weight, now):
+        self.add_many(((key, weight),), now)
+
+    def add_many(self, items, now):
+        """Count (key, weight) pairs, all at `now`"""
+        with self.lock:
+            add = self._rotate(now).add
+            for key, weight in items:
+                add(key, weight)
+
+    def recent(self, now, limit=None):
+        """HeavyHitters of the last window"""
+        with self.lock:
+            self._rotate(now)
+            return merge_top(self.slices, limit)
+
+    def top(self, limit=None):
+        """HeavyHitters since start"""
+        with self.lock:
+            return merge_top(self._since_start(), limit)
+
+    def count(self, key):
+        """Count since start, None if `key` isn't monitored"""
+        with self.lock:
+            counters = [sketch.counters[key][0] for sketch in self._since_start() if key in sketch.counters]
+            return sum(counters) if counters else None
+
+    def _since_start(self):
+        sketches = [self.all_time]
+        if self.current is not None:
+            sketches.append(self.slices[self.current % len(self.slices)])
+        return sketches
+
+
+class TopTalkers:
+    """Heaviest processes, remote addresses and (process, remote address) pairs by bytes"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, window=WINDOW, slices=SLICES):
+        self.processes = WindowedTopK(capacity, window, slices)
+        self.remotes = WindowedTopK(capacity, window, slices)
+        self.pairs = WindowedTopK(capacity, window, slices)
+
+    def add(self, traffic, now):
+        """Count the (pid, remote address, bytes) of one batch; `pid` or the remote
+        address is None when it isn't known"""
+        # a batch has many flows per process and peer, summing them first keeps the
+        # number of (heap-touching) sketch updates down to one per key
+        processes, remotes, pairs = {}, {}, {}
+        for pid, remote, length in traffic:
+            if pid is not None:
+                processes[pid] = processes.get(pid, 0) + length
+            if remote is not None:
+                remotes[remote] = remotes.get(remote, 0) + length
+                if pid is not None:
+                    pair = (pid, remote)
+                    pairs[pair] = pairs.get(pair, 0) + length
+        self.processes.add_many(processes.items(), now)
+        self.remotes.add_many(remotes.items(), now)
+        self.pairs.add_many(pairs.items(), now)
@@ -0,0 +1,278 @@
+"""Names of remote hosts, learned from traffic that is captured anyway.
+
+DNS answers map the addresses an application is about to connect to onto the name it
+asked for, and a TLS ClientHello names the server it goes to (SNI). NameSniffer reads
+just those packets on a capture of its own, filtered in the kernel, and fills a bounded
+HostNameCache; no lookups are sent and the accounting path never waits for a name.
+"""
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from packet_headers import PROTO_TCP, PROTO_UDP, ethernet_payload_offset, ip_payload
+
+DNS_PORT = 53
+TLS_PORT = 443
+
+# DNS responses, and TLS handshake records going out to port 443 (BPF can't look into
+# IPv6 TCP payloads, so that filter lets every outgoing IPv6 segment to 443 through)
+NAME_FILTER = (
+    f"(udp src port {DNS_PORT}) or "
+    f"(tcp dst port {TLS_PORT} and (ip6 or tcp[((tcp[12:1] & 0xf0) >> 2):1] = 0x16))"
+)
+PYDIVERT_NAME_FILTER = (
+    f"(inbound and udp.SrcPort == {DNS_PORT}) or "
+    f"(outbound and tcp.DstPort == {TLS_PORT} and tcp.PayloadLength > 0 and tcp.Payload[0] == 0x16)"
+)
+
+# answers are kept for their DNS TTL, but at least MIN_TTL and at most MAX_TTL seconds
+MIN_TTL = 60
+MAX_TTL = 3600
+MAX_NAMES = 8192
+# ClientHellos split over several segments are put back together up to this size
+MAX_HELLO = 16384
+MAX_PARTIAL_HELLOS = 256
+
+DNS_A = 1
+DNS_CNAME = 5
+DNS_AAAA = 28
+TLS_HANDSHAKE = 0x16
+TLS_CLIENT_HELLO = 0x01
+TLS_SERVER_NAME = 0x0000
+
+_unpack_u16 = struct.Struct("!H").unpack_from
+_unpack_dns_header = struct.Struct("!HHHHHH").unpack_from
+_unpack_dns_record = struct.Struct("!HHIH").unpack_from
+
+
+def read_dns_name(message, offset):
+    """(name, offset after it) of a possibly compressed name at `offset`"""
+    labels = []
+    end = None
+    # compression pointers may loop in a hostile packet
+    for _ in range(128):
+        length = message[offset]
+        if length == 0:
+            offset += 1
+            break
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            continue
+        labels.append(message[offset + 1:offset + 1 + length].decode("ascii", "replace"))
+        offset += 1 + length
+    else:
+        raise ValueError("DNS name too long")
+    return ".".join(labels).lower(), end if end is not None else offset
+
+
+def parse_dns_response(message):
+    """[(packed address, name, ttl)] of the A / AAAA answers of a DNS response.
+
+    The name is the one that was asked for, not the end of a CNAME chain, since that is
+    what the application connected to.
+    """
+    try:
+        _, flags, questions, answers, _, _ = _unpack_dns_header(message)
+        # responses only, without an error code
+        if not flags & 0x8000 or flags & 0x000F:
+            return []
+        offset = 12
+        asked = None
+        for _ in range(questions):
+            name, offset = read_dns_name(message, offset)
+            asked = asked or name
+            offset += 4
+        addresses = []
+        for _ in range(answers):
+            owner, offset = read_dns_name(message, offset)
+            record_type, _, ttl, length = _unpack_dns_record(message, offset)
+            offset += 10
+            if (record_type == DNS_A and length == 4) or (record_type == DNS_AAAA and length == 16):
+                address = bytes(message[offset:offset + length])
+                if len(address) == length:
+                    addresses.append((address, asked or owner, ttl))
+            offset += length
+        return addresses
+    except (IndexError, ValueError, struct.error):
+        return []
+
+
+def client_hello_length(payload):
+    """Bytes the TLS record starting `payload` needs, None if it isn't a ClientHello"""
+    if len(payload) < 6 or payload[0] != TLS_HANDSHAKE or payload[5] != TLS_CLIENT_HELLO:
+        return None
+    return 5 + _unpack_u16(payload, 3)[0]
+
+
+def parse_client_hello(payload):
+    """Server name (SNI) of a TLS ClientHello, None if there is none"""
+    try:
+        if client_hello_length(payload) is None:
+            return None
+        # record header, handshake header, client version, random
+        offset = 5 + 4 + 2 + 32
+        offset += 1 + payload[offset]  # session id
+        offset += 2 + _unpack_u16(payload, offset)[0]  # cipher suites
+        offset += 1 + payload[offset]  # compression methods
+        end = min(len(payload), offset + 2 + _unpack_u16(payload, offset)[0])
+        offset += 2
+        while offset + 4 <= end:
+            extension, length = struct.unpack_from("!HH", payload, offset)
+            offset += 4
+            if extension == TLS_SERVER_NAME:
+                # server name list length, then name type (0 = host name) and length
+                if payload[offset + 2] != 0:
+                    return None
+                name_length = _unpack_u16(payload, offset + 3)[0]
+                name = bytes(payload[offset + 5:offset + 5 + name_length])
+                return name.decode("ascii").lower() if len(name) == name_length else None
+            offset += length
+    except (IndexError, UnicodeDecodeError, struct.error):
+        pass
+    return None
+
+
+class HostNameCache:
+    """Packed address -> host name, least recently learned dropped beyond `max_names`.
+
+    A name learned from SNI is kept over one from DNS for the same address until it
+    expires: the SNI is where a connection to that address really went, while several
+    names can resolve to one (CDN) address.
+    """
+
+    def __init__(self, max_names=MAX_NAMES, min_ttl=MIN_TTL, max_ttl=MAX_TTL):
+        self.max_names = max_names
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        # address -> (name, source, expires)
+        self.names = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def learn(self, address, name, source, ttl=None, now=None):
+        now = time.monotonic() if now is None else now
+        ttl = self.max_ttl if ttl is None else min(max(ttl, self.min_ttl), self.max_ttl)
+        with self.lock:
+            known = self.names.pop(address, None)
+            if known is not None and source == "dns" and known[1] == "sni" and known[2] > now:
+                self.names[address] = known
+                return
+            self.names[address] = (name, source, now + ttl)
+            if len(self.names) > self.max_names:
+                self.names.popitem(last=False)
+
+    def name(self, address, now=None):
+        """Host name of `address`, None when none was seen or it expired"""
+        with self.lock:
+            known = self.names.get(address)
+            if known is None:
+                return None
+            if known[2] <= (time.monotonic() if now is None else now):
+                del self.names[address]
+                return None
+            return known[0]
+
+
+class NameSniffer(threading.Thread):
+    """Fills a HostNameCache from DNS answers and TLS ClientHellos.
+
+    `source` is "scapy" (raw frames behind NAME_FILTER), "pydivert" (a sniffing
+    WinDivert handle) or "pcap" (the DNS and TLS packets of the file at `path`). It runs
+    on its own daemon thread; when the capture can't be opened there are no names,
+    and accounting goes on without them.
+    """
+
+    def __init__(self, cache, source="scapy", path=None):
+        super().__init__(name="name-sniffer", daemon=True)
+        self.cache = cache
+        self.source = source
+        self.path = path
+        self.running = True
+        # flow -> start of a ClientHello larger than one segment, without the name yet
+        self.partial_hellos = OrderedDict()
+
+    @classmethod
+    def for_backend(cls, cache, backend):
+        """Sniffer that watches the same traffic as a capture backend"""
+        if backend.name == "pcap":
+            return cls(cache, "pcap", backend.path)
+        if backend.name == "pydivert":
+            return cls(cache, "pydivert")
+        # conntrack captures nothing itself, names still need a packet capture
+        return cls(cache, "scapy")
+
+    def run(self):
+        try:
+            getattr(self, f"capture_{self.source}")()
+        except Exception as e:
+            print(f"Host names unavailable ({self.source}): {e}")
+
+    def stop(self):
+        self.running = False
+
+    def capture_scapy(self):
+        from scapy.all import conf
+        from capture_backends import wait_readable
+        sock = conf.L2listen(filter=NAME_FILTER)
+        try:
+            while self.running:
+                if not wait_readable(sock):
+                    continue
+                raw = sock.recv_raw(65535)[1]
+                if raw:
+                    offset = ethernet_payload_offset(raw)
+                    if offset is not None:
+                        self.feed(raw, offset)
+        finally:
+            sock.close()
+
+    def capture_pydivert(self):
+        import pydivert
+        with pydivert.WinDivert(PYDIVERT_NAME_FILTER, flags=pydivert.Flag.SNIFF) as w:
+            for packet in w:
+                self.feed(packet.raw)
+                if not self.running:
+                    break
+
+    def capture_pcap(self):
+        from capture_backends import ip_offset, read_capture
+        for _, linktype, data in read_capture(self.path):
+            if not self.running:
+                break
+            offset = ip_offset(linktype, data)
+            if offset is not None:
+                self.feed(data, offset)
+
+    def feed(self, raw, offset=0):
+        """Learn from one IP packet, anything but a DNS answer or a ClientHello is ignored"""
+        packet = ip_payload(raw, offset)
+        if packet is None:
+            return
+        proto, src, sport, dst, dport, payload = packet
+        if proto == PROTO_UDP and sport == DNS_PORT:
+            for address, name, ttl in parse_dns_response(payload):
+                self.cache.learn(address, name, "dns", ttl)
+        elif proto == PROTO_TCP and dport == TLS_PORT and payload:
+            flow = (src, sport, dst)
+            start = self.partial_hellos.pop(flow, None)
+            if start is not None:
+                payload = start + payload
+            needed = client_hello_length(payload)
+            if needed is None:
+                return
+            # SNI comes early in the hello, so it is nearly always in the first segment
+            # even when post-quantum key shares push the hello past one segment
+            name = parse_client_hello(payload)
+            if name:
+                self.cache.learn(dst, name, "sni")
+            elif len(payload) < needed and len(payload) < MAX_HELLO:
+                # the filters only pass continuation segments of IPv6 flows and pcap
+                # files, there the rest may still bring the name
+                self.partial_hellos[flow] = payload
+                if len(self.partial_hellos) > MAX_PARTIAL_HELLOS:
+                    self.partial_hellos.popitem(last=False)
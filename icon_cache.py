@@ -0,0 +1,162 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+
+try:
+    import win32gui
+    import win32ui
+except ImportError:  # not on Windows, PngIconLoader is used instead
+    win32gui = win32ui = None
+
+ICON_SIZE = 32
+DEFAULT_ICON = "images/default-icon.png"
+DEFAULT_DISK_DIR = os.path.join(os.path.expanduser("~"), ".data_usage_tracker", "icons")
+
+
+class IconLoader:
+    """Turns an executable path into a QImage. Runs on a worker thread, so no QPixmap here."""
+
+    def load(self, executable_path):
+        raise NotImplementedError
+
+
+class WindowsIconLoader(IconLoader):
+    def load(self, executable_path):
+        icons = win32gui.ExtractIconEx(executable_path, 0)
+        try:
+            if not icons[0]:
+                return None
+            # Create DC and bitmap and make them compatible, then draw the icon into it
+            screen_dc = win32gui.GetDC(0)
+            hdc = win32ui.CreateDCFromHandle(screen_dc)
+            hbmp = win32ui.CreateBitmap()
+            hbmp.CreateCompatibleBitmap(hdc, ICON_SIZE, ICON_SIZE)
+            mem_dc = hdc.CreateCompatibleDC()
+            mem_dc.SelectObject(hbmp)
+            win32gui.DrawIconEx(
+                mem_dc.GetHandleOutput(), 0, 0, icons[0][0], ICON_SIZE, ICON_SIZE, 0, None, 0x0003
+            )
+            bitmapbits = hbmp.GetBitmapBits(True)
+            mem_dc.DeleteDC()
+            win32gui.ReleaseDC(0, screen_dc)
+        finally:
+            for iconList in icons:
+                for icon in iconList:
+                    win32gui.DestroyIcon(icon)
+        # copy() so the image owns its pixels once bitmapbits goes away
+        return QImage(bitmapbits, ICON_SIZE, ICON_SIZE, QImage.Format_ARGB32_Premultiplied).copy()
+
+
+class PngIconLoader(IconLoader):
+    """Stand-in loader: `<icon_dir>/<exe name>.png` if present, else one fixed PNG"""
+
+    def __init__(self, icon_dir="images", fallback=DEFAULT_ICON):
+        self.icon_dir = icon_dir
+        self.fallback = fallback
+
+    def load(self, executable_path):
+        name = os.path.splitext(os.path.basename(executable_path or ""))[0]
+        path = os.path.join(self.icon_dir, f"{name}.png")
+        image = QImage(path if name and os.path.exists(path) else self.fallback)
+        return None if image.isNull() else image
+
+
+def default_icon_loader():
+    return WindowsIconLoader() if win32gui is not None else PngIconLoader()
+
+
+class _IconJobSignals(QObject):
+    done = pyqtSignal(str, QImage)
+
+
+class _IconJob(QRunnable):
+    def __init__(self, loader, executable_path, disk_path, signals):
+        super().__init__()
+        self.loader = loader
+        self.executable_path = executable_path
+        self.disk_path = disk_path
+        self.signals = signals
+
+    def run(self):
+        image = None
+        if self.disk_path and os.path.exists(self.disk_path):
+            image = QImage(self.disk_path)
+        if image is None or image.isNull():
+            try:
+                image = self.loader.load(self.executable_path)
+            except Exception:
+                image = None
+            if image is not None and not image.isNull() and self.disk_path:
+                image.save(self.disk_path, "PNG")
+        try:
+            self.signals.done.emit(self.executable_path, image if image is not None else QImage())
+        except RuntimeError:
+            # the cache was destroyed while we were loading (application exit)
+            pass
+
+
+class IconCache(QObject):
+    """Executable path -> QPixmap cache with an LRU memory layer and optional PNG store.
+
+    `pixmap` never blocks: a miss returns the default icon and schedules extraction
+    on a thread pool; `icon_ready(path)` fires once the real icon is cached.
+    """
+
+    icon_ready = pyqtSignal(str)
+
+    def __init__(self, loader=None, max_items=128, disk_dir=DEFAULT_DISK_DIR, parent=None):
+        super().__init__(parent)
+        self.loader = loader or default_icon_loader()
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self.pixmaps = OrderedDict()
+        self.loading = set()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = _IconJobSignals(self)
+        self.signals.done.connect(self._on_loaded)
+        self.default_pixmap = QPixmap(DEFAULT_ICON)
+        if not self.default_pixmap.isNull():
+            self.default_pixmap = self.default_pixmap.scaled(ICON_SIZE, ICON_SIZE)
+
+    def _disk_path(self, executable_path):
+        if not self.disk_dir:
+            return None
+        try:
+            mtime = os.path.getmtime(executable_path)
+        except (OSError, TypeError):
+            mtime = 0
+        digest = hashlib.sha1(f"{executable_path}|{mtime}".encode()).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.png")
+
+    def pixmap(self, executable_path):
+        if not executable_path:
+            return self.default_pixmap
+        pixmap = self.pixmaps.get(executable_path)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(executable_path)
+            return pixmap
+        if executable_path not in self.loading:
+            self.loading.add(executable_path)
+            self.pool.start(_IconJob(
+                self.loader, executable_path, self._disk_path(executable_path), self.signals
+            ))
+        return self.default_pixmap
+
+    def _on_loaded(self, executable_path, image):
+        self.loading.discard(executable_path)
+        if image.isNull():
+            pixmap = self.default_pixmap
+        else:
+            pixmap = QPixmap.fromImage(image)
+            if pixmap.width() != ICON_SIZE or pixmap.height() != ICON_SIZE:
+                pixmap = pixmap.scaled(ICON_SIZE, ICON_SIZE)
+        self.pixmaps[executable_path] = pixmap
+        while len(self.pixmaps) > self.max_items:
+            self.pixmaps.popitem(last=False)
+        self.icon_ready.emit(executable_path)
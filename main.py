@@ -1,8 +1,4 @@
-import psutil
-import os
-import sys
-from PyQt5.QtCore import Qt, QTimerEvent
-import subprocess
+from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
@@ -10,11 +6,12 @@ from PyQt5.QtWidgets import (
     QVBoxLayout,
     QCheckBox,
     QHBoxLayout,
+    QMessageBox,
 )
-from multiprocessing import Process
 from PyQt5.QtGui import QPixmap, QCursor
 from settings import SettingsWindow  # Import the settings window class
-from data_wifi_control import DataUsageTracker # Import the data usage tracker class
+from tracker_client import DaemonClientThread, connect
+from shared_counters import SharedCountersReader
 
 class RealTimeInternetUsageMonitor(QWidget):
     def __init__(self):
@@ -23,11 +20,18 @@ class RealTimeInternetUsageMonitor(QWidget):
         self.setWindowTitle("Real-Time Internet Usage Monitor")
         self.setGeometry(100, 100, 400, 100)
         
-        # Store the initial baseline network stats
-        self.initial_data_sent = psutil.net_io_counters().bytes_sent
-        self.initial_data_received = psutil.net_io_counters().bytes_recv
-        self.total_data_used = 0.0  # Initialize total data used to 0
-        
+        # The tracker daemon samples the counters, keeps the history and runs the data
+        # limit checks; this window only shows what it pushes
+        self.client = connect()
+        self.session_baseline = None  # daemon totals when this window attached
+        self.alert_in_progress = False
+        # Totals are read straight from the daemon's shared memory block when it can
+        # be mapped, so the label can refresh often without any IPC
+        try:
+            self.counters = SharedCountersReader()
+        except (OSError, ValueError):
+            self.counters = None
+        self.counters_sequence = None
 
         layout = QVBoxLayout(self)
 
@@ -64,43 +68,75 @@ class RealTimeInternetUsageMonitor(QWidget):
         # Add the bottom layout to the main layout
         layout.addLayout(bottom_layout)
 
-        self.startTimer(100)
+        if self.counters is not None:
+            self.client_thread = DaemonClientThread(self.client, ("events",))
+            self.startTimer(50)
+        else:
+            self.client_thread = DaemonClientThread(self.client, ("totals", "events"), 0.1)
+            self.client_thread.updated.connect(self.on_update)
+        self.client_thread.event.connect(self.on_event)
+        self.client_thread.disconnected.connect(self.on_disconnected)
+        self.client_thread.start()
         self.show()
-        
-        self.update_data_usage = 0.0
-        # Data Wifi Control
-        """if os.path.exists("settings_data.json"):
-            # Initialize data tracking
-            '''self.data_tracker = DataUsageTracker(self)
-            self.data_tracker.exec_()
-            self.data_tracker.start_tracking()
-            # Start the data tracker as a separate process
-            data_tracker_process = Process(target=self.start_data_tracker)
-            data_tracker_process.start()'''
-            self.start_data_tracker()"""
-    
-
-    def timerEvent(self, event: QTimerEvent):
-        # Use psutil to monitor network usage
-        network_stats = psutil.net_io_counters()
-        data_sent = network_stats.bytes_sent
-        data_received = network_stats.bytes_recv
-
-        # Calculate total data usage since program start
-        self.total_data_used = (data_sent - self.initial_data_sent) + (data_received - self.initial_data_received)
-        
-        # Calculate total data usage in MB
-        total_data_mb = self.total_data_used / (1024**2)
 
-        # Update the label in the main thread
-        self.update_label(total_data_mb)
-
-    
-    def update_label(self, data_usage_mb: float):
+    def timerEvent(self, event):
+        if self.counters.sequence == self.counters_sequence:
+            return  # nothing published since the last tick
+        totals = self.counters.totals()
+        self.counters_sequence = totals.sequence
+        self.show_totals(totals.upload + totals.download, totals.today)
+
+    def on_update(self, update):
+        totals = update["totals"]
+        self.show_totals(totals["upload"] + totals["download"], totals["today"])
+
+    def show_totals(self, used, today):
+        if self.session_baseline is None:
+            self.session_baseline = used
+        # Calculate total data usage since program start, in MB
+        total_data_mb = (used - self.session_baseline) / (1024**2)
+        self.update_label(total_data_mb, today / (1024**2))
+
+    def update_label(self, data_usage_mb: float, today_mb: float):
         # Update the label with the new data usage
-        self.data_usage_label.setText(f"Data Usage: {data_usage_mb:.2f} MB")
+        self.data_usage_label.setText(f"Data Usage: {data_usage_mb:.2f} MB (today: {today_mb:.2f} MB)")
+
+    def on_disconnected(self):
+        self.data_usage_label.setText("Data Usage: tracker stopped")
+
+    def on_event(self, event):
+        if event["name"] == "wifi-disabled":
+            QMessageBox.critical(self, "Wi-Fi Disabled", "Your Wi-Fi has been disabled because you exceeded your data limit.")
+        elif event["name"] == "data-limit-warning":
+            QMessageBox.warning(self, "Data Limit Warning", f"You have used {event['percent']}% of your data limit.")
+        elif event["name"] == "data-limit":
+            self.show_data_limit_alert()
+        elif event["name"] == "exceeded-data-limit":
+            QMessageBox.critical(self, "Exceeded Data Limit Reached", "You have exceeded your data limit.")
+
+    def show_data_limit_alert(self):
+        """Ask whether to use the exceeded data limit and send the answer to the daemon"""
+        if self.alert_in_progress:
+            # Prevent multiple dialogs
+            return
+        self.alert_in_progress = True
+
+        msg_box = QMessageBox()
+        msg_box.setIcon(QMessageBox.Warning)
+        msg_box.setWindowTitle("Data Limit Reached")
+        msg_box.setText("You have reached your data limit. Do you want to use the exceeded data limit?")
+        msg_box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        # Ensure the dialog is always on top
+        msg_box.setWindowFlags(msg_box.windowFlags() | Qt.WindowStaysOnTopHint)
+        msg_box.raise_()
+        msg_box.activateWindow()
+
+        if msg_box.exec_() == QMessageBox.Yes:
+            self.client.command("accept-exceeded-limit")
+        else:
+            self.client.command("disconnect-wifi")
+        self.alert_in_progress = False
 
-    
     #stay on top of other window
     def handle_always_on_top(self, toggled: bool):
         self.setWindowFlag(Qt.WindowStaysOnTopHint, toggled)
@@ -111,33 +147,14 @@ class RealTimeInternetUsageMonitor(QWidget):
         # Open the Settings Window
         settings_window = SettingsWindow(self)
         settings_window.exec_()
+        # The daemon re-reads the data limit and app quotas
+        self.client.command("reload-settings")
         
-    '''def data_wifi_control(self):
-        # Open data wifi control window
-        #if os.path.exists("settings_data.json"):
-        data_wifi_control = DataUsageTracker(self)
-        data_wifi_control.exec_()'''
-        
-    '''def start_data_tracker(self):
-        os.system("python data_wifi_control.py")'''
-
-    
-    def start_data_tracker(self):
-        """Start the data tracker program as an external script."""
-        try:
-            # Use subprocess to run the external script
-            self.data_tracker_process = subprocess.Popen(
-                [sys.executable, "data_wifi_control.py"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-        except Exception as e:
-            print(f"Failed to start data tracker: {e}")
-            
     def closeEvent(self, event):
-        """Ensure the data tracker process is terminated when the main window is closed."""
-        if self.data_tracker_process:
-            self.data_tracker_process.terminate()
+        """Detach from the tracker daemon, which keeps tracking after the window is closed."""
+        self.client.close()
+        if self.counters is not None:
+            self.counters.close()
         super().closeEvent(event)
 
 
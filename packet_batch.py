@@ -0,0 +1,190 @@
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, fold_batch falls back to a plain loop
+    np = None
+
+from packet_headers import HEADER_SNAPLEN, parse_ip_packet
+
+UPLOAD = 0
+DOWNLOAD = 1
+
+# below this many packets the NumPy setup costs more than the Python loop
+NUMPY_MIN_BATCH = 256
+
+
+class PacketRingBuffer:
+    """Fixed-size single-producer / single-consumer ring of (flow, direction, length).
+
+    The capture thread only writes slots and advances `write_index`, the consumer only
+    reads and advances `read_index`, so no lock is taken on the per-packet path.
+    When the ring is full new packets are counted in `dropped_packets`/`dropped_bytes`.
+    """
+
+    def __init__(self, capacity=1 << 17):
+        self.capacity = capacity
+        self.flows = [None] * capacity
+        self.directions = array("B", bytes(capacity))
+        self.lengths = array("I", bytes(4 * capacity))
+        self.write_index = 0
+        self.read_index = 0
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+
+    def __len__(self):
+        return self.write_index - self.read_index
+
+    def push(self, flow, direction, length):
+        write_index = self.write_index
+        if write_index - self.read_index >= self.capacity:
+            self.dropped_packets += 1
+            self.dropped_bytes += length
+            return False
+        slot = write_index % self.capacity
+        self.flows[slot] = flow
+        self.directions[slot] = direction
+        self.lengths[slot] = length
+        self.write_index = write_index + 1
+        return True
+
+    def drain(self):
+        """Return everything pushed so far as (flows, directions, lengths) sequences"""
+        start, end = self.read_index, self.write_index
+        if start == end:
+            return [], array("B"), array("I")
+        first, last = start % self.capacity, end % self.capacity
+        if first < last:
+            batch = (self.flows[first:last], self.directions[first:last], self.lengths[first:last])
+        else:
+            batch = (
+                self.flows[first:] + self.flows[:last],
+                self.directions[first:] + self.directions[:last],
+                self.lengths[first:] + self.lengths[:last],
+            )
+        self.read_index = end
+        return batch
+
+
+class HeaderRingBuffer:
+    """Single-producer / single-consumer ring of raw IP headers in one preallocated buffer.
+
+    `push` copies at most `slot_size` bytes of the packet into the next slot, so the
+    capture thread allocates nothing and never parses. The consumer parses the slots in
+    place through memoryviews and only then releases them to the producer.
+    """
+
+    def __init__(self, capacity=1 << 15, slot_size=HEADER_SNAPLEN):
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.buffer = bytearray(capacity * slot_size)
+        self.view = memoryview(self.buffer)
+        self.sizes = array("H", bytes(2 * capacity))
+        self.directions = array("B", bytes(capacity))
+        self.write_index = 0
+        self.read_index = 0
+        self.dropped_packets = 0
+
+    def __len__(self):
+        return self.write_index - self.read_index
+
+    def push(self, raw, direction):
+        write_index = self.write_index
+        if write_index - self.read_index >= self.capacity:
+            self.dropped_packets += 1
+            return False
+        slot = write_index % self.capacity
+        size = min(len(raw), self.slot_size)
+        start = slot * self.slot_size
+        self.view[start:start + size] = raw[:size]
+        self.sizes[slot] = size
+        self.directions[slot] = direction
+        self.write_index = write_index + 1
+        return True
+
+    def drain(self, parse=parse_ip_packet):
+        """Parse everything pushed so far into (flows, directions, lengths) sequences"""
+        flows, directions, lengths = [], array("B"), array("I")
+        end = self.write_index
+        view, slot_size = self.view, self.slot_size
+        for index in range(self.read_index, end):
+            slot = index % self.capacity
+            start = slot * slot_size
+            header = parse(view[start:start + self.sizes[slot]])
+            if header is None:
+                continue
+            direction = self.directions[slot]
+            flows.append(flow_of(header, direction))
+            directions.append(direction)
+            lengths.append(header.length)
+        self.read_index = end
+        return flows, directions, lengths
+
+
+def flow_of(header, direction):
+    """Local-first flow key (proto, local ip, local port, remote ip, remote port)"""
+    if direction == UPLOAD:
+        return header[1:6]
+    return (header.proto, header.dst, header.dport, header.src, header.sport)
+
+
+def fold_batch(flows, directions, lengths):
+    """Fold a batch into {flow: [upload bytes, download bytes, packets]} in one pass"""
+    if np is None or len(flows) < NUMPY_MIN_BATCH:
+        counters = {}
+        for flow, direction, length in zip(flows, directions, lengths):
+            counter = counters.get(flow)
+            if counter is None:
+                counter = counters[flow] = [0, 0, 0]
+            counter[direction] += length
+            counter[2] += 1
+        return counters
+
+    # give every distinct flow a dense id, then group with bincount
+    index = {}
+    ids = np.fromiter(
+        (index.setdefault(flow, len(index)) for flow in flows), dtype=np.int64, count=len(flows)
+    )
+    slots = ids * 2 + np.frombuffer(directions, dtype=np.uint8)
+    byte_sums = np.bincount(
+        slots, weights=np.frombuffer(lengths, dtype=np.uint32), minlength=2 * len(index)
+    ).astype(np.int64).reshape(-1, 2)
+    packet_counts = np.bincount(ids, minlength=len(index))
+    return {
+        flow: [int(up), int(down), int(packets)]
+        for flow, (up, down), packets in zip(index, byte_sums.tolist(), packet_counts.tolist())
+    }
+
+
+class PacketAccountant:
+    """Glue between a capture thread (`add`) and a consumer thread (`fold`)"""
+
+    def __init__(self, capacity=1 << 17):
+        self.ring = PacketRingBuffer(capacity)
+        # bound method lookup once, the capture loop calls this per packet
+        self.add = self.ring.push
+        self.drain = self.ring.drain
+
+    def fold(self):
+        return fold_batch(*self.drain())
+
+    def run_consumer(self, apply, is_running, interval=0.1):
+        """Drain and fold the ring every `interval` seconds, passing each result to `apply`"""
+        while is_running():
+            started = time.monotonic()
+            # called even for an empty batch so time-based housekeeping still runs
+            apply(self.fold())
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+class HeaderAccountant(PacketAccountant):
+    """PacketAccountant fed raw IP headers (`add(raw, direction)`), parsed on the consumer side"""
+
+    def __init__(self, capacity=1 << 15, parse=parse_ip_packet):
+        self.ring = HeaderRingBuffer(capacity)
+        self.add = self.ring.push
+        self.parse = parse
+
+    def drain(self):
+        return self.ring.drain(self.parse)
@@ -0,0 +1,139 @@
+import struct
+from typing import NamedTuple, Optional
+
+# Kernel-side capture filter: only IPv4/IPv6 TCP and UDP frames ever reach Python
+BPF_FILTER = "(ip or ip6) and (tcp or udp)"
+
+# Ethernet (+ one VLAN tag) + IPv6 header + the first 4 bytes of TCP/UDP
+HEADER_SNAPLEN = 96
+
+ETH_HEADER_LEN = 14
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+_unpack_ethertype = struct.Struct("!H").unpack_from
+_unpack_ports = struct.Struct("!HH").unpack_from
+
+
+class PacketHeader(NamedTuple):
+    # source MAC address as 6 raw bytes (empty when there is no L2 header)
+    src_mac: bytes
+    # IP protocol number (PROTO_TCP / PROTO_UDP)
+    proto: int
+    # packed source / destination addresses (4 bytes for IPv4, 16 for IPv6)
+    src: bytes
+    sport: int
+    dst: bytes
+    dport: int
+    # length of the frame on the wire, taken from the IP header
+    length: int
+
+
+def mac_to_bytes(mac: str) -> bytes:
+    """Convert 'aa:bb:cc:dd:ee:ff' into its 6 raw bytes"""
+    return bytes.fromhex(mac.replace(":", "").replace("-", ""))
+
+
+def parse_ip_packet(raw, offset=0, src_mac=b"", l2_len=0) -> Optional[PacketHeader]:
+    """Parse the fixed IPv4/IPv6 and TCP/UDP port fields of `raw` starting at `offset`.
+
+    Only the header bytes are touched, so `raw` may be truncated by a short snaplen.
+    Returns None for anything that is not a first-fragment TCP/UDP packet.
+    """
+    try:
+        version = raw[offset] >> 4
+        if version == 4:
+            ihl = (raw[offset] & 0x0F) * 4
+            # skip non-first fragments, they carry no ports
+            if _unpack_ethertype(raw, offset + 6)[0] & 0x1FFF:
+                return None
+            proto = raw[offset + 9]
+            if proto != PROTO_TCP and proto != PROTO_UDP:
+                return None
+            total_length = _unpack_ethertype(raw, offset + 2)[0]
+            src = bytes(raw[offset + 12:offset + 16])
+            dst = bytes(raw[offset + 16:offset + 20])
+            l4 = offset + ihl
+        elif version == 6:
+            proto = raw[offset + 6]
+            if proto != PROTO_TCP and proto != PROTO_UDP:
+                return None
+            total_length = 40 + _unpack_ethertype(raw, offset + 4)[0]
+            src = bytes(raw[offset + 8:offset + 24])
+            dst = bytes(raw[offset + 24:offset + 40])
+            l4 = offset + 40
+        else:
+            return None
+        sport, dport = _unpack_ports(raw, l4)
+    except (IndexError, struct.error):
+        # truncated header
+        return None
+    return PacketHeader(src_mac, proto, src, sport, dst, dport, l2_len + total_length)
+
+
+def parse_ethernet_frame(raw) -> Optional[PacketHeader]:
+    """Parse an Ethernet II frame (optionally VLAN tagged) down to its L4 ports"""
+    try:
+        ethertype = _unpack_ethertype(raw, 12)[0]
+        offset = ETH_HEADER_LEN
+        if ethertype in ETHERTYPE_VLAN:
+            ethertype = _unpack_ethertype(raw, 16)[0]
+            offset += 4
+    except struct.error:
+        return None
+    if ethertype != ETHERTYPE_IPV4 and ethertype != ETHERTYPE_IPV6:
+        return None
+    return parse_ip_packet(raw, offset, bytes(raw[6:12]), offset)
+
+
+def ip_payload(raw, offset=0):
+    """(proto, src, sport, dst, dport, L4 payload) of a TCP/UDP packet starting at `offset`.
+
+    Unlike parse_ip_packet this needs the whole packet, it is for the few packets
+    whose contents are read (DNS answers, TLS handshakes). None for anything else.
+    """
+    try:
+        version = raw[offset] >> 4
+        if version == 4:
+            ihl = (raw[offset] & 0x0F) * 4
+            if _unpack_ethertype(raw, offset + 6)[0] & 0x1FFF:
+                return None
+            proto = raw[offset + 9]
+            end = offset + _unpack_ethertype(raw, offset + 2)[0]
+            src, dst = bytes(raw[offset + 12:offset + 16]), bytes(raw[offset + 16:offset + 20])
+            l4 = offset + ihl
+        elif version == 6:
+            proto = raw[offset + 6]
+            end = offset + 40 + _unpack_ethertype(raw, offset + 4)[0]
+            src, dst = bytes(raw[offset + 8:offset + 24]), bytes(raw[offset + 24:offset + 40])
+            l4 = offset + 40
+        else:
+            return None
+        sport, dport = _unpack_ports(raw, l4)
+        if proto == PROTO_TCP:
+            data = l4 + (raw[l4 + 12] >> 4) * 4
+        elif proto == PROTO_UDP:
+            data = l4 + 8
+        else:
+            return None
+    except (IndexError, struct.error):
+        return None
+    # Ethernet pads short frames, the IP length says where the packet really ends
+    return proto, src, sport, dst, dport, bytes(raw[data:min(end, len(raw))])
+
+
+def ethernet_payload_offset(raw):
+    """Offset of the IP header in an Ethernet II frame, None if it doesn't carry IP"""
+    try:
+        ethertype = _unpack_ethertype(raw, 12)[0]
+        offset = ETH_HEADER_LEN
+        if ethertype in ETHERTYPE_VLAN:
+            ethertype = _unpack_ethertype(raw, 16)[0]
+            offset += 4
+    except struct.error:
+        return None
+    return offset if ethertype == ETHERTYPE_IPV4 or ethertype == ETHERTYPE_IPV6 else None
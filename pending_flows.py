@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+# pid2traffic key for bytes whose owning process was never found
+UNATTRIBUTED_PID = -1
+UNATTRIBUTED_NAME = "Unattributed"
+
+
+class PendingFlows:
+    """Bounded, time-evicted byte counts for flows that have no known PID yet.
+
+    Packets of a connection that opened between two connection refreshes land here.
+    Once the flow table learns the owner, `settle` hands the buffered bytes to that
+    PID; whatever is still unknown after `ttl` seconds (or pushed out because more
+    than `max_flows` are pending) is reported under UNATTRIBUTED_PID instead.
+    """
+
+    def __init__(self, ttl=10.0, max_flows=4096):
+        self.ttl = ttl
+        self.max_flows = max_flows
+        # flow -> [upload, download, first seen], oldest first
+        self.flows = OrderedDict()
+        self.overflow = [0, 0]
+        self.generation = None
+
+    def __len__(self):
+        return len(self.flows)
+
+    def add(self, flow, upload, download, now=None):
+        entry = self.flows.get(flow)
+        if entry is None:
+            if len(self.flows) >= self.max_flows:
+                _, evicted = self.flows.popitem(last=False)
+                self.overflow[0] += evicted[0]
+                self.overflow[1] += evicted[1]
+            self.flows[flow] = [upload, download, time.monotonic() if now is None else now]
+        else:
+            entry[0] += upload
+            entry[1] += download
+
+    def settle(self, lookup, generation=None, now=None):
+        """Attribute pending flows `lookup` can now resolve and expire stale ones.
+
+        `generation` is the flow table's change counter; the (full) lookup pass is
+        skipped while it has not moved. Returns {pid: [upload, download]}.
+        """
+        settled = {}
+        if generation is None or generation != self.generation:
+            self.generation = generation
+            for flow in list(self.flows):
+                pid = lookup(flow)
+                if pid:
+                    upload, download, _ = self.flows.pop(flow)
+                    traffic = settled.setdefault(pid, [0, 0])
+                    traffic[0] += upload
+                    traffic[1] += download
+
+        upload, download = self.overflow
+        self.overflow = [0, 0]
+        deadline = (time.monotonic() if now is None else now) - self.ttl
+        while self.flows:
+            flow, entry = next(iter(self.flows.items()))
+            if entry[2] > deadline:
+                break
+            del self.flows[flow]
+            upload += entry[0]
+            download += entry[1]
+        if upload or download:
+            traffic = settled.setdefault(UNATTRIBUTED_PID, [0, 0])
+            traffic[0] += upload
+            traffic[1] += download
+        return settled
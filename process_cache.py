@@ -0,0 +1,116 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import psutil
+
+
+class ProcessInfo(NamedTuple):
+    pid: int
+    name: str
+    # seconds since the epoch, boot time for system processes that hide it
+    create_time: float
+    alive: bool
+    # None when the OS won't tell us (system processes, access denied)
+    exe: str = None
+
+
+class ProcessInfoCache:
+    """(pid, create_time) keyed cache of process metadata, indexed by pid and name.
+
+    `refresh` diffs the running PID set, so a tick only pays psutil calls for processes
+    that started or exited. Exited processes stay readable in a bounded LRU so their
+    final totals can still be shown, and live entries are re-validated every
+    `revalidate_after` seconds to catch a PID being reused between two refreshes.
+    """
+
+    def __init__(self, max_exited=256, revalidate_after=30.0):
+        self.max_exited = max_exited
+        self.revalidate_after = revalidate_after
+        # pid -> (ProcessInfo, monotonic time it was last validated)
+        self.live = {}
+        # (pid, create_time) -> ProcessInfo, oldest exit first
+        self.exited = OrderedDict()
+        # pid -> most recently exited ProcessInfo with that pid
+        self.exited_by_pid = {}
+        # name -> pids of cached live processes with that name
+        self.by_name = {}
+        self.running_pids = set()
+
+    def refresh(self):
+        """Sync with the running PID set, returns (started, exited) PID sets"""
+        current = set(psutil.pids())
+        exited = self.running_pids - current
+        for pid in exited:
+            self._retire(pid)
+        started = current - self.running_pids
+        self.running_pids = current
+        return started, exited
+
+    def _store(self, info, now):
+        self.live[info.pid] = (info, now)
+        self.by_name.setdefault(info.name, set()).add(info.pid)
+
+    def _retire(self, pid):
+        cached = self.live.pop(pid, None)
+        if cached is None:
+            return
+        pids = self.by_name.get(cached[0].name)
+        if pids is not None:
+            pids.discard(pid)
+            if not pids:
+                del self.by_name[cached[0].name]
+        info = cached[0]._replace(alive=False)
+        self.exited[(info.pid, info.create_time)] = info
+        self.exited_by_pid[pid] = info
+        while len(self.exited) > self.max_exited:
+            (old_pid, _), old_info = self.exited.popitem(last=False)
+            if self.exited_by_pid.get(old_pid) is old_info:
+                del self.exited_by_pid[old_pid]
+
+    def _load(self, pid):
+        try:
+            # one round trip for all fields, AccessDenied on a single field gives None
+            attrs = psutil.Process(pid).as_dict(attrs=["name", "exe", "create_time"], ad_value=None)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+        create_time = attrs["create_time"]
+        if create_time is None:
+            create_time = psutil.boot_time()
+        return ProcessInfo(pid, attrs["name"] or str(pid), create_time, True, attrs["exe"] or None)
+
+    def get(self, pid, now=None):
+        """ProcessInfo for `pid`, the most recently exited one if it is gone, else None"""
+        now = time.monotonic() if now is None else now
+        cached = self.live.get(pid)
+        if cached is not None:
+            info, checked_at = cached
+            if now - checked_at < self.revalidate_after:
+                return info
+            fresh = self._load(pid)
+            if fresh is not None and fresh.create_time == info.create_time:
+                self.live[pid] = (info, now)
+                return info
+            # the process exited, and maybe its PID now belongs to someone else
+            self._retire(pid)
+            if fresh is not None:
+                self._store(fresh, now)
+                return fresh
+        elif pid in self.running_pids or not self.running_pids:
+            info = self._load(pid)
+            if info is not None:
+                self._store(info, now)
+                return info
+        return self.exited_by_pid.get(pid)
+
+    def exe_for_pid(self, pid):
+        info = self.get(pid)
+        return info.exe if info is not None else None
+
+    def exe_for_name(self, name):
+        """Executable of any cached live process called `name`, without scanning the system"""
+        for pid in self.by_name.get(name, ()):
+            exe = self.live[pid][0].exe
+            if exe:
+                return exe
+        return None
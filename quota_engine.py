@@ -0,0 +1,94 @@
+import math
+import threading
+from typing import NamedTuple
+
+import psutil
+
+# assume at least this much bandwidth (bytes/s) when nothing better is known
+DEFAULT_RATE_FLOOR = 1024 ** 2
+
+
+class Threshold(NamedTuple):
+    name: str
+    # bytes of usage at which the threshold fires
+    limit: int
+
+
+def link_capacity():
+    """Sum of the speeds of all NICs that are up, in bytes/s (0 if unknown)"""
+    try:
+        stats = psutil.net_if_stats()
+    except OSError:
+        return 0
+    return sum(s.speed for s in stats.values() if s.isup and s.speed > 0) * 1_000_000 // 8
+
+
+class ThresholdEngine:
+    """Predicts when usage thresholds will be crossed instead of polling for them.
+
+    `observe` is fed the current usage whenever the owner wakes up; it returns the
+    thresholds crossed since the last call and updates a smoothed usage rate.
+    `sleep_time` is how long the owner can sleep before the next threshold could
+    possibly be crossed: the remaining bytes at the fastest plausible rate (link speed
+    or the highest rate seen). Far from a limit that is minutes, close to it the
+    wakeups get denser, and a sudden burst can't overshoot by more than one interval.
+    The thresholds may be replaced from another thread (settings) while the owner
+    observes, a lock keeps them and the crossed set in step.
+    """
+
+    def __init__(self, min_sleep=0.25, max_sleep=300.0, rate_floor=DEFAULT_RATE_FLOOR, smoothing=0.3):
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.rate_floor = rate_floor
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.thresholds = ()
+        self.crossed = set()
+        self.usage = 0
+        self.rate = 0.0
+        self.peak_rate = 0.0
+        self.last_observed = None
+
+    def set_thresholds(self, thresholds):
+        """Replace the thresholds; crossed ones whose limit is unchanged don't fire again.
+
+        A new threshold, or one whose limit changed (a new limit in the settings), is
+        armed, and fires on the next `observe` if usage is already past it.
+        """
+        thresholds = tuple(sorted(thresholds, key=lambda t: t.limit))
+        with self.lock:
+            previous = set(t for t in self.thresholds if t.name in self.crossed)
+            self.crossed = {t.name for t in thresholds if t in previous}
+            self.thresholds = thresholds
+
+    def observe(self, usage, now):
+        """Record the usage at `now`, returns the newly crossed thresholds (lowest first)"""
+        if self.last_observed is not None and now > self.last_observed:
+            instant = max(0, usage - self.usage) / (now - self.last_observed)
+            self.rate += self.smoothing * (instant - self.rate)
+            self.peak_rate = max(self.peak_rate, instant)
+        self.usage = usage
+        self.last_observed = now
+        with self.lock:
+            crossed = [t for t in self.thresholds if t.name not in self.crossed and usage >= t.limit]
+            self.crossed.update(t.name for t in crossed)
+        return crossed
+
+    def pending(self):
+        with self.lock:
+            return [t for t in self.thresholds if t.name not in self.crossed]
+
+    def predictions(self):
+        """{threshold name: seconds until it is crossed at the current rate, or None}"""
+        return {
+            t.name: (t.limit - self.usage) / self.rate if self.rate > 0 else None
+            for t in self.pending()
+        }
+
+    def sleep_time(self):
+        pending = self.pending()
+        if not pending:
+            return math.inf
+        remaining = pending[0].limit - self.usage
+        fastest = max(self.rate_floor, self.peak_rate, self.rate)
+        return min(self.max_sleep, max(self.min_sleep, remaining / fastest))
@@ -0,0 +1,149 @@
+import math
+import threading
+from typing import NamedTuple
+
+DEFAULT_WINDOWS = (1, 10, 60)
+
+
+class Rates(NamedTuple):
+    # window lengths in seconds, the other tuples follow the same order
+    windows: tuple
+    # bytes/s averaged over each window
+    upload: tuple
+    download: tuple
+    # exponentially weighted bytes/s
+    ewma_upload: float
+    ewma_download: float
+    # highest bytes/s of a single bucket so far
+    peak_upload: float
+    peak_download: float
+
+
+class _KeyRates:
+    __slots__ = (
+        "bucket", "current_up", "current_down", "ring_up", "ring_down", "sums_up", "sums_down",
+        "ewma_up", "ewma_down", "peak_up", "peak_down",
+    )
+
+    def __init__(self, bucket, ring_size, window_count):
+        self.bucket = bucket
+        self.current_up = self.current_down = 0
+        self.ring_up = [0] * ring_size
+        self.ring_down = [0] * ring_size
+        self.sums_up = [0] * window_count
+        self.sums_down = [0] * window_count
+        self.ewma_up = self.ewma_down = 0.0
+        self.peak_up = self.peak_down = 0.0
+
+
+class RateEngine:
+    """Sliding-window, EWMA and peak upload/download rates per key (PID, app, ...).
+
+    Bytes are added to the key's current bucket of `resolution` seconds. When a
+    bucket closes it goes into a ring as long as the longest window and every
+    window's running sum gains it and loses the bucket that just left that window,
+    so an update is O(1) and a reading is one division per window. The EWMA and the
+    peak are updated per closed bucket; idle time decays the EWMA in one step.
+    """
+
+    def __init__(self, windows=DEFAULT_WINDOWS, resolution=1.0, half_life=10.0):
+        self.resolution = resolution
+        self.windows = tuple(windows)
+        # window lengths in buckets
+        self.spans = tuple(max(1, round(window / resolution)) for window in self.windows)
+        self.ring_size = max(self.spans)
+        # weight a closed bucket gets in the EWMA
+        self.alpha = 1 - 0.5 ** (resolution / half_life)
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def _state(self, key, bucket):
+        state = self.keys.get(key)
+        if state is None:
+            state = self.keys[key] = _KeyRates(bucket, self.ring_size, len(self.spans))
+        elif bucket > state.bucket:
+            self._advance(state, bucket)
+        return state
+
+    def _advance(self, state, bucket):
+        """Close buckets up to `bucket`, the new current one"""
+        resolution, alpha, spans, size = self.resolution, self.alpha, self.spans, self.ring_size
+        ring_up, ring_down, sums_up, sums_down = state.ring_up, state.ring_down, state.sums_up, state.sums_down
+        closing = state.bucket
+        if bucket - closing > size:
+            # idle for longer than the longest window: every window is empty, and the
+            # EWMA decays over the empty buckets in one go
+            up, down = state.current_up / resolution, state.current_down / resolution
+            state.ewma_up += alpha * (up - state.ewma_up)
+            state.ewma_down += alpha * (down - state.ewma_down)
+            state.peak_up = max(state.peak_up, up)
+            state.peak_down = max(state.peak_down, down)
+            decay = (1 - alpha) ** (bucket - closing - 1)
+            state.ewma_up *= decay
+            state.ewma_down *= decay
+            ring_up[:] = [0] * size
+            ring_down[:] = [0] * size
+            sums_up[:] = [0] * len(spans)
+            sums_down[:] = [0] * len(spans)
+        else:
+            up, down = state.current_up, state.current_down
+            while closing < bucket:
+                for i, span in enumerate(spans):
+                    leaving = (closing - span) % size
+                    sums_up[i] += up - ring_up[leaving]
+                    sums_down[i] += down - ring_down[leaving]
+                ring_up[closing % size] = up
+                ring_down[closing % size] = down
+                state.ewma_up += alpha * (up / resolution - state.ewma_up)
+                state.ewma_down += alpha * (down / resolution - state.ewma_down)
+                if up or down:
+                    state.peak_up = max(state.peak_up, up / resolution)
+                    state.peak_down = max(state.peak_down, down / resolution)
+                up = down = 0
+                closing += 1
+        state.bucket = bucket
+        state.current_up = state.current_down = 0
+
+    def add(self, key, upload, download, now):
+        bucket = math.floor(now / self.resolution)
+        with self.lock:
+            state = self._state(key, bucket)
+            state.current_up += upload
+            state.current_down += download
+
+    def rates(self, key, now):
+        """Rates of `key` over the buckets closed before `now`, None for an unknown key"""
+        bucket = math.floor(now / self.resolution)
+        with self.lock:
+            state = self.keys.get(key)
+            if state is None:
+                return None
+            if bucket > state.bucket:
+                self._advance(state, bucket)
+            return Rates(
+                self.windows,
+                tuple(total / (span * self.resolution) for total, span in zip(state.sums_up, self.spans)),
+                tuple(total / (span * self.resolution) for total, span in zip(state.sums_down, self.spans)),
+                state.ewma_up, state.ewma_down, state.peak_up, state.peak_down,
+            )
+
+    def forget(self, key):
+        with self.lock:
+            self.keys.pop(key, None)
+
+
+def combine_rates(rates):
+    """Rates of several keys added up (the processes of one app); peaks are the largest
+    single-key peak, a lower bound of the combined one"""
+    rates = [r for r in rates if r is not None]
+    if not rates:
+        return None
+    return Rates(
+        rates[0].windows,
+        tuple(map(sum, zip(*(r.upload for r in rates)))),
+        tuple(map(sum, zip(*(r.download for r in rates)))),
+        sum(r.ewma_upload for r in rates),
+        sum(r.ewma_download for r in rates),
+        max(r.peak_upload for r in rates),
+        max(r.peak_download for r in rates),
+    )
@@ -0,0 +1,183 @@
+import time
+from array import array
+
+SECOND, MINUTE, HOUR, DAY = 1, 60, 3600, 86400
+
+# (resolution, retention) in seconds, finest first; None keeps buckets forever
+DEFAULT_TIERS = (
+    (SECOND, HOUR),
+    (MINUTE, 7 * DAY),
+    (HOUR, None),
+    (DAY, None),
+)
+
+
+def local_utc_offset():
+    """Seconds to add to epoch time so day buckets start at local midnight"""
+    return time.localtime().tm_gmtoff
+
+
+class RollupTier:
+    """Upload/download sums per `resolution`-second bucket.
+
+    With a retention the buckets live in a fixed ring, otherwise in a dict that only
+    grows by one entry per bucket (8760 a year for hours).
+    """
+
+    def __init__(self, resolution, retention=None, offset=0):
+        self.resolution = resolution
+        self.offset = offset
+        self.capacity = None if retention is None else max(1, retention // resolution)
+        if self.capacity is None:
+            self.buckets = {}
+        else:
+            self.starts = array("q", [-1]) * self.capacity
+            self.uploads = array("Q", [0]) * self.capacity
+            self.downloads = array("Q", [0]) * self.capacity
+        # oldest bucket still held, and the first bucket ever added
+        self.oldest = None
+        self.first = None
+        self.newest = None
+
+    def bucket_start(self, timestamp):
+        shifted = int(timestamp) + self.offset
+        return shifted - shifted % self.resolution - self.offset
+
+    def add(self, timestamp, upload, download):
+        start = self.bucket_start(timestamp)
+        if self.newest is None or start > self.newest:
+            self.newest = start
+        if self.oldest is None or start < self.oldest:
+            self.oldest = start
+        if self.first is None or start < self.first:
+            self.first = start
+        if self.capacity is None:
+            bucket = self.buckets.get(start)
+            if bucket is None:
+                bucket = self.buckets[start] = [0, 0]
+            bucket[0] += upload
+            bucket[1] += download
+            return
+        slot = (start // self.resolution) % self.capacity
+        if self.starts[slot] != start:
+            if self.starts[slot] > start:
+                # older than anything the ring still holds
+                return
+            self.starts[slot] = start
+            self.uploads[slot] = 0
+            self.downloads[slot] = 0
+        self.uploads[slot] += upload
+        self.downloads[slot] += download
+        # the ring only reaches back `capacity` buckets from the newest one
+        self.oldest = max(self.oldest, self.newest - (self.capacity - 1) * self.resolution)
+
+    def covers(self, start):
+        """True if no bucket from `start` onwards has been evicted yet"""
+        return self.oldest is not None and (self.oldest <= start or self.oldest == self.first)
+
+    def range(self, start, end):
+        """(upload, download) over buckets in [start, end), both aligned to the resolution"""
+        upload = download = 0
+        if self.newest is None:
+            return upload, download
+        start = max(start, self.oldest)
+        end = min(end, self.newest + self.resolution)
+        for bucket_start in range(start, end, self.resolution):
+            if self.capacity is None:
+                bucket = self.buckets.get(bucket_start)
+                if bucket is not None:
+                    upload += bucket[0]
+                    download += bucket[1]
+            else:
+                slot = (bucket_start // self.resolution) % self.capacity
+                if self.starts[slot] == bucket_start:
+                    upload += self.uploads[slot]
+                    download += self.downloads[slot]
+        return upload, download
+
+    def series(self, start, end):
+        """[(bucket start, upload, download)] for charting, empty buckets included"""
+        points = []
+        start = self.bucket_start(start)
+        for bucket_start in range(start, end, self.resolution):
+            points.append((bucket_start, *self.range(bucket_start, bucket_start + self.resolution)))
+        return points
+
+
+class RollupEngine:
+    """Second/minute/hour/day rollups of one upload/download series.
+
+    `total` answers the aligned middle of a range from the coarsest tier that still
+    holds it and only uses finer tiers for the ragged edges, so a month costs about
+    30 daily buckets plus a few hundred fine ones instead of 2.6M seconds. Edges
+    older than a finer tier's retention are answered with what that tier still has.
+    """
+
+    def __init__(self, tiers=DEFAULT_TIERS, offset=None):
+        offset = local_utc_offset() if offset is None else offset
+        self.tiers = [RollupTier(resolution, retention, offset) for resolution, retention in tiers]
+
+    def add(self, timestamp, upload, download):
+        if upload <= 0 and download <= 0:
+            return
+        upload, download = max(0, upload), max(0, download)
+        for tier in self.tiers:
+            tier.add(timestamp, upload, download)
+
+    def load(self, records):
+        """Rebuild from UsageStore.query() style (timestamp, app, upload, download) rows"""
+        for timestamp, _, upload, download in records:
+            self.add(timestamp, upload, download)
+
+    def total(self, start, end=None):
+        """(upload, download) used in [start, end)"""
+        end = time.time() + 1 if end is None else end
+        return self._total(len(self.tiers) - 1, int(start), int(end))
+
+    def _total(self, level, start, end):
+        if start >= end:
+            return 0, 0
+        tier = self.tiers[level]
+        inner_start = -(-(start + tier.offset) // tier.resolution) * tier.resolution - tier.offset
+        inner_end = tier.bucket_start(end)
+        if level == 0:
+            return tier.range(tier.bucket_start(start), end)
+        if inner_start >= inner_end or not tier.covers(inner_start):
+            return self._total(level - 1, start, end)
+        upload, download = tier.range(inner_start, inner_end)
+        for edge_start, edge_end in ((start, inner_start), (inner_end, end)):
+            edge_upload, edge_download = self._total(level - 1, edge_start, edge_end)
+            upload += edge_upload
+            download += edge_download
+        return upload, download
+
+    def tier_for(self, start, end=None, max_points=500):
+        """Finest tier that still holds `start` and draws [start, end) in <= max_points buckets"""
+        end = time.time() if end is None else end
+        for tier in self.tiers:
+            if tier.covers(tier.bucket_start(start)) and (end - start) / tier.resolution <= max_points:
+                return tier
+        return self.tiers[-1]
+
+
+class RollupSet:
+    """Lazily created RollupEngine per key (e.g. per application)"""
+
+    def __init__(self, tiers=DEFAULT_TIERS, offset=None):
+        self.tiers = tiers
+        self.offset = local_utc_offset() if offset is None else offset
+        self.engines = {}
+
+    def add(self, key, timestamp, upload, download):
+        engine = self.engines.get(key)
+        if engine is None:
+            engine = self.engines[key] = RollupEngine(self.tiers, self.offset)
+        engine.add(timestamp, upload, download)
+
+    def load(self, records):
+        for timestamp, key, upload, download in records:
+            self.add(key, timestamp, upload, download)
+
+    def total(self, key, start, end=None):
+        engine = self.engines.get(key)
+        return engine.total(start, end) if engine is not None else (0, 0)
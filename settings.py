@@ -7,6 +7,8 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt
 
+from settings_service import DEFAULT_SETTINGS, save_settings
+
 
 class ToggleButton(QPushButton):
     def __init__(self, text_on="ON", text_off="OFF", parent=None):
@@ -221,19 +223,17 @@ class SettingsWindow(QDialog):
                 return
 
         # Save settings to file
-        self.save_settings_to_file()
+        try:
+            self.save_settings_to_file()
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Error", f"Settings were not saved: {e}")
+            return
         QMessageBox.information(self, "Success", "Settings saved successfully.")
         self.close()  # Close the settings window
 
     def load_settings(self):
         if not os.path.exists("settings_data.json"):
-            with open("settings_data.json", "w") as f:
-                json.dump({
-                    "data-limit": 'Null',
-                    "exceeded-data-limit": 'Unlimited',
-                    "enable-data-limit": False,
-                    "enable-alert-message": False
-                }, f)
+            save_settings(dict(DEFAULT_SETTINGS))
         try:
             with open("settings_data.json", "r") as f:
                 return json.load(f)
@@ -241,7 +241,8 @@ class SettingsWindow(QDialog):
             return {}
 
     def save_settings_to_file(self):
-        with open("settings_data.json", "w") as f:
-            json.dump(self.settings_data, f, indent=4)
+        # written to a temporary file and renamed over the old one, so the tracker's
+        # settings watcher never reads a half-written file
+        save_settings(self.settings_data)
 
 
@@ -0,0 +1,183 @@
+"""settings_data.json as validated, immutable snapshots that follow the file as it changes.
+
+SettingsService watches the file (QFileSystemWatcher, plus an mtime poll for the
+changes a watcher misses) and hands every new snapshot to its subscribers, so a
+limit saved in the settings window applies without restarting the tracker.
+"""
+import json
+import os
+import tempfile
+import threading
+from typing import NamedTuple, Optional
+
+from PyQt5.QtCore import QFileSystemWatcher, QThread, QTimer, Qt, pyqtSignal
+
+from app_policy import load_app_policies
+
+SETTINGS_FILE = "settings_data.json"
+DEFAULT_SETTINGS = {
+    "data-limit": "Null",
+    "exceeded-data-limit": "Unlimited",
+    "enable-data-limit": False,
+    "enable-alert-message": False,
+}
+# the file is also stat'ed this often, in case the watcher missed a change
+POLL_INTERVAL = 2.0
+
+
+class Settings(NamedTuple):
+    # bytes, None while no limit is set ("Null")
+    data_limit: Optional[int] = None
+    # extra bytes once the user accepts going over the limit, None for "Unlimited"
+    exceeded_data_limit: Optional[int] = None
+    enable_data_limit: bool = False
+    enable_alert_message: bool = False
+    # AppPolicy per "app-quotas" entry
+    app_policies: tuple = ()
+
+
+def _byte_count(data, key, unset):
+    value = data.get(key, unset)
+    if value == unset or value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 1:
+        raise ValueError(f"{key} must be a positive number of bytes or {unset!r}, not {value!r}")
+    return int(value)
+
+
+def _flag(data, key):
+    value = data.get(key, False)
+    if not isinstance(value, bool):
+        raise ValueError(f"{key} must be true or false, not {value!r}")
+    return value
+
+
+def parse_settings(data):
+    """Settings from the decoded JSON, ValueError if a field is invalid"""
+    if not isinstance(data, dict):
+        raise ValueError("settings must be a JSON object")
+    return Settings(
+        _byte_count(data, "data-limit", "Null"),
+        _byte_count(data, "exceeded-data-limit", "Unlimited"),
+        _flag(data, "enable-data-limit"),
+        _flag(data, "enable-alert-message"),
+        tuple(load_app_policies(data)),
+    )
+
+
+def read_settings_data(path=SETTINGS_FILE):
+    """The decoded JSON, the defaults when the file doesn't exist"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict(DEFAULT_SETTINGS)
+
+
+def load_settings(path=SETTINGS_FILE):
+    return parse_settings(read_settings_data(path))
+
+
+def save_settings(data, path=SETTINGS_FILE):
+    """Validate `data` and replace the file atomically, readers see the old or the new file"""
+    parse_settings(data)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".settings_data.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class SettingsService(QThread):
+    """Current Settings snapshot of one file, re-read whenever the file changes.
+
+    Subscribers are called with the new snapshot from the service thread, `changed`
+    carries it to Qt slots in their own threads. A file that fails to parse is
+    reported and ignored, the last good snapshot stays current.
+    """
+
+    changed = pyqtSignal(object)
+
+    def __init__(self, path=SETTINGS_FILE, poll_interval=POLL_INTERVAL, parent=None):
+        super().__init__(parent)
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.watcher = None
+        self.signature = file_signature(self.path)
+        try:
+            self.settings = load_settings(self.path)
+        except ValueError as e:
+            print(f"Invalid settings in {self.path}, using the defaults: {e}")
+            self.settings = Settings()
+
+    def subscribe(self, callback):
+        """Call `callback(settings)` now and after every change"""
+        self.subscribers.append(callback)
+        callback(self.settings)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def run(self):
+        # the watcher and the timer belong to this thread's event loop, so this works
+        # in processes whose main thread never runs one (the tracker daemon)
+        self.watcher = QFileSystemWatcher()
+        # the directory too: an atomic save replaces the file, and a watch on the old one ends
+        self.watcher.addPath(os.path.dirname(self.path))
+        if os.path.exists(self.path):
+            self.watcher.addPath(self.path)
+        self.watcher.fileChanged.connect(self.check, Qt.DirectConnection)
+        self.watcher.directoryChanged.connect(self.check, Qt.DirectConnection)
+        timer = QTimer()
+        timer.timeout.connect(self.check, Qt.DirectConnection)
+        timer.start(int(self.poll_interval * 1000))
+        self.exec_()
+        timer.stop()
+        self.watcher = None
+
+    def check(self, *_):
+        """Re-read the file if it changed since the last look; safe to call from any thread"""
+        with self.lock:
+            signature = file_signature(self.path)
+            if signature == self.signature:
+                return
+            self.signature = signature
+            watcher = self.watcher
+            if watcher is not None and QThread.currentThread() is self and signature is not None:
+                # re-watch, the file may be a new inode since an atomic save
+                if self.path in watcher.files():
+                    watcher.removePath(self.path)
+                watcher.addPath(self.path)
+            try:
+                settings = load_settings(self.path)
+            except ValueError as e:
+                # also a file caught half-written by an editor that doesn't save atomically
+                print(f"Ignoring invalid settings in {self.path}: {e}")
+                return
+            if settings == self.settings:
+                return
+            self.settings = settings
+            for callback in list(self.subscribers):
+                callback(settings)
+        self.changed.emit(settings)
+
+    def stop(self):
+        self.quit()
+        self.wait()
@@ -0,0 +1,161 @@
+"""Live counters in shared memory, written by the tracker daemon and read by the windows.
+
+The block is a fixed-layout header followed by `capacity` per-process rows. A seqlock
+keeps readers consistent without locks, syscalls or serialisation: the writer makes
+the sequence odd, writes, then makes it even again, and a reader retries whenever the
+sequence was odd or moved while it copied.
+"""
+import getpass
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+SHARED_NAME = f"data_usage_tracker_{getpass.getuser()}"
+MAGIC = b"DUTC"
+VERSION = 2
+DEFAULT_CAPACITY = 1024
+NAME_SIZE = 48
+
+# magic, version, capacity, sequence, row count, timestamp, upload, download, today
+HEADER = struct.Struct("<4sIIQIdQQQ")
+SEQUENCE_OFFSET = 12
+SEQUENCE = struct.Struct("<Q")
+# pid (signed, the unattributed row is -1), upload, download, process name (utf-8, truncated)
+ROW = struct.Struct(f"<qQQ{NAME_SIZE}s")
+
+# a reader gives up after this many torn reads in a row
+MAX_RETRIES = 1000
+
+
+class CounterRow(NamedTuple):
+    pid: int
+    name: str
+    upload: int
+    download: int
+
+
+class CounterSnapshot(NamedTuple):
+    sequence: int
+    timestamp: float
+    upload: int
+    download: int
+    today: int
+    rows: tuple
+
+
+def block_size(capacity):
+    return HEADER.size + capacity * ROW.size
+
+
+class SharedCounters:
+    """Writer side, owned by the tracker daemon"""
+
+    def __init__(self, name=SHARED_NAME, capacity=DEFAULT_CAPACITY):
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=block_size(capacity))
+        except FileExistsError:
+            # left behind by a daemon that didn't shut down cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=block_size(capacity))
+        self.capacity = capacity
+        self.sequence = 0
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, capacity, 0, 0, 0.0, 0, 0, 0)
+
+    def publish(self, upload, download, today, processes=()):
+        """Replace the contents with the given totals and per-process rows.
+
+        `processes` are the dicts AppAccounting.processes builds; when there are more
+        than fit, the heaviest users are kept.
+        """
+        if len(processes) > self.capacity:
+            processes = sorted(processes, key=lambda p: p["Upload"] + p["Download"], reverse=True)
+            processes = processes[:self.capacity]
+        # everything is packed before the sequence goes odd, so a row that doesn't pack
+        # can't leave the block looking mid-write to readers
+        writing = self.sequence + 1
+        rows = b"".join(
+            ROW.pack(
+                process["pid"], process["Upload"], process["Download"],
+                process["name"].encode("utf-8")[:NAME_SIZE],
+            )
+            for process in processes
+        )
+        header = HEADER.pack(
+            MAGIC, VERSION, self.capacity, writing, len(processes), time.time(), upload, download, today,
+        )
+        buf = self.shm.buf
+        # odd while the block is being rewritten
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, writing)
+        buf[HEADER.size:HEADER.size + len(rows)] = rows
+        buf[:HEADER.size] = header
+        self.sequence += 2
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedCountersReader:
+    """Read side; attaching raises FileNotFoundError while no daemon publishes"""
+
+    def __init__(self, name=SHARED_NAME):
+        self.shm = attach(name)
+        magic, version, self.capacity = HEADER.unpack_from(self.shm.buf, 0)[:3]
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"{name} isn't a version {VERSION} counter block")
+
+    @property
+    def sequence(self):
+        """Changes whenever the writer publishes, cheap enough to poll"""
+        return SEQUENCE.unpack_from(self.shm.buf, SEQUENCE_OFFSET)[0]
+
+    def totals(self):
+        """Snapshot without the per-process rows"""
+        return self.read(rows=False)
+
+    def read(self, rows=True):
+        buf = self.shm.buf
+        for _ in range(MAX_RETRIES):
+            before = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0]
+            if before & 1:
+                # a publish is in progress, let the writer finish it
+                time.sleep(0)
+                continue
+            header = HEADER.unpack_from(buf, 0)
+            count = header[4]
+            data = bytes(buf[HEADER.size:HEADER.size + count * ROW.size]) if rows else b""
+            if SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0] == before:
+                break
+            time.sleep(0)
+        else:
+            raise TimeoutError("counter block kept changing while being read")
+        return CounterSnapshot(
+            before, header[5], header[6], header[7], header[8],
+            tuple(
+                CounterRow(pid, name.rstrip(b"\0").decode("utf-8", "replace"), upload, download)
+                for pid, upload, download, name in ROW.iter_unpack(data)
+            ),
+        )
+
+    def close(self):
+        self.shm.close()
+
+
+def attach(name):
+    """Map an existing block without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before Python 3.13 every attach is registered with the resource tracker,
+        # which would unlink the daemon's block when this process exits
+        shm = shared_memory.SharedMemory(name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
@@ -0,0 +1,52 @@
+"""Wall-clock breakdown of how a window starts up.
+
+Import this module first; `startup_profile.phase(name)` times a block (an import, the
+window, the capture backend) and `report()` lists the phases in the order they ran,
+together with the interpreter start-up before the first import.
+
+    python app_data_usage.py --startup-report
+"""
+import time
+from contextlib import contextmanager
+
+PROFILED_SINCE = time.perf_counter()
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = PROFILED_SINCE
+        # (name, seconds since started, duration), in the order they finished
+        self.phases = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            self.phases.append((name, finished - self.started, finished - started))
+
+    def mark(self, name):
+        """Record a moment (the window was painted, capture started) as a zero-length phase"""
+        self.phases.append((name, self.elapsed(), 0.0))
+
+    def report(self):
+        lines = []
+        try:
+            import psutil
+            # time between the process being created and this module being imported
+            boot = time.time() - self.elapsed() - psutil.Process().create_time()
+            lines.append(f"{'interpreter start-up':<34} {boot * 1000:9.1f} ms")
+        except (ImportError, OSError):
+            pass
+        for name, at, duration in self.phases:
+            took = f"{duration * 1000:9.1f} ms" if duration else " " * 12
+            lines.append(f"{name:<34} {took}   at {at * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+startup_profile = StartupProfile()
@@ -0,0 +1,77 @@
+from app_policy import (
+    ACCEPT, BLOCK, DELAY, DROP, MAX_DELAY, AppPolicy, PolicyEngine, TokenBucket, load_app_policies, simulate,
+)
+
+IDENTITIES = {
+    1: ("updater.exe", r"c:\program files\vendor\updater.exe"),
+    2: ("browser.exe", r"c:\program files\browser\browser.exe"),
+}
+
+
+def engine(policies, usage=None):
+    engine = PolicyEngine(resolve=lambda pid: IDENTITIES.get(pid, (None, None)))
+    engine.set_policies(policies, usage)
+    return engine
+
+
+def test_load_app_policies_skips_invalid_entries():
+    policies = load_app_policies({"app-quotas": {
+        "updater.exe": {"budget": 1000, "action": "block"},
+        "broken.exe": {"action": "throttle"},
+        "odd.exe": {"budget": 1, "action": "explode"},
+    }})
+    assert policies == [AppPolicy("updater.exe", 1000, BLOCK)]
+
+
+def test_apps_without_a_policy_are_always_accepted():
+    policies = engine([AppPolicy("updater.exe", 0, BLOCK)])
+    assert policies.decide(2, 10_000, 0.0) == (ACCEPT, 0.0)
+    assert policies.decide(None, 10_000, 0.0) == (ACCEPT, 0.0)
+
+
+def test_block_after_the_budget():
+    policies = engine([AppPolicy("updater.exe", 1500, BLOCK)])
+    assert policies.decide(1, 1000, 0.0)[0] == ACCEPT
+    assert policies.decide(1, 1000, 0.0)[0] == DROP
+
+
+def test_throttle_limits_the_rate():
+    results = simulate(
+        engine([AppPolicy("updater.exe", 0, rate=10_000)]),
+        [(1, 1000, i * 0.01) for i in range(100)],
+    )
+    accepted, delayed, dropped, _ = results[1]
+    # one second at 10 kB/s, the burst, and what may still wait up to MAX_DELAY for tokens
+    assert accepted + delayed <= 10_000 * (1 + MAX_DELAY) + TokenBucket(10_000).capacity
+    assert delayed and dropped
+
+
+def test_token_bucket_delay():
+    bucket = TokenBucket(1000, capacity=1000, now=0.0)
+    assert bucket.reserve(1000, 0.0) == 0.0
+    assert bucket.reserve(500, 0.0) == 0.5
+
+
+def test_name_policies_are_seeded_from_path_keyed_usage():
+    usage = {r"C:\Program Files\Vendor\Updater.exe": 900, "updater.exe": 100, "other": 5}
+    assert engine([AppPolicy("updater.exe", 1000)], usage).usage() == {"updater.exe": 1000}
+    path = r"c:\program files\vendor\updater.exe"
+    assert engine([AppPolicy(path, 1000)], usage).usage() == {path: 900}
+
+
+def test_reload_keeps_usage_of_unchanged_policies():
+    policy = AppPolicy("updater.exe", 1000, BLOCK)
+    policies = engine([policy])
+    policies.decide(1, 800, 0.0)
+    policies.set_policies([policy, AppPolicy("browser.exe", 10)], {})
+    assert policies.usage() == {"updater.exe": 800, "browser.exe": 0}
+    policies.set_policies([policy._replace(budget=2000)], {})
+    assert policies.usage() == {"updater.exe": 0}
+    policies.set_policies([policy], {"updater.exe": 50}, reset=True)
+    assert policies.usage() == {"updater.exe": 50}
+
+
+def test_delay_verdict_for_a_short_wait():
+    policies = engine([AppPolicy("updater.exe", 0, rate=100_000)])
+    verdicts = {policies.decide(1, 1500, 0.0)[0] for _ in range(30)}
+    assert DELAY in verdicts
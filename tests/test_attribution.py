@@ -0,0 +1,103 @@
+import socket
+
+from connection_refresher import InodePidIndex, read_proc_net
+from flow_table import FlowKey, FlowTable, pack_address
+from packet_headers import PROTO_TCP, PROTO_UDP
+from pending_flows import UNATTRIBUTED_PID, PendingFlows
+
+LOCAL = pack_address("10.0.0.2")
+OTHER_LOCAL = pack_address("172.17.0.1")
+REMOTE = pack_address("1.1.1.1")
+REMOTE2 = pack_address("8.8.8.8")
+
+
+def test_pack_address_folds_mapped_ipv4():
+    assert pack_address("::ffff:1.1.1.1") == REMOTE
+    assert pack_address("fe80::1%eth0") == socket.inet_pton(socket.AF_INET6, "fe80::1")
+
+
+def test_lookup_exact_and_through_the_port_index():
+    table = FlowTable()
+    table.add(FlowKey(PROTO_TCP, LOCAL, 50000, REMOTE, 443), 10)
+    assert table.lookup((PROTO_TCP, LOCAL, 50000, REMOTE, 443)) == 10
+    # a wildcard bind seen from another local address
+    assert table.lookup((PROTO_TCP, OTHER_LOCAL, 50000, REMOTE, 443)) == 10
+    assert table.lookup((PROTO_TCP, LOCAL, 50000, REMOTE2, 443)) is None
+    assert table.lookup((PROTO_UDP, LOCAL, 50000, REMOTE, 443)) is None
+
+
+def test_port_collisions_are_told_apart_by_remote():
+    table = FlowTable()
+    table.add(FlowKey(PROTO_UDP, LOCAL, 5353, REMOTE, 53), 1)
+    table.add(FlowKey(PROTO_UDP, LOCAL, 5353, REMOTE2, 53), 2)
+    assert table.lookup((PROTO_UDP, OTHER_LOCAL, 5353, REMOTE2, 53)) == 2
+    table.remove(FlowKey(PROTO_UDP, LOCAL, 5353, REMOTE2, 53))
+    assert table.lookup((PROTO_UDP, OTHER_LOCAL, 5353, REMOTE, 53)) == 1
+
+
+def test_closed_flows_linger_before_they_expire():
+    table = FlowTable(linger=30)
+    key = FlowKey(PROTO_TCP, LOCAL, 50000, REMOTE, 443)
+    table.sync({key: 10}, now=0)
+    table.sync({}, now=1)
+    assert table.lookup(key) == 10
+    table.sync({}, now=40)
+    assert table.lookup(key) is None
+
+
+def test_pending_bytes_settle_once_the_owner_is_known():
+    table = FlowTable()
+    pending = PendingFlows(ttl=10)
+    key = FlowKey(PROTO_TCP, LOCAL, 50000, REMOTE, 443)
+    pending.add(key, 100, 200, now=0)
+    assert pending.settle(table.lookup, table.generation, now=1) == {}
+    table.add(key, 10)
+    assert pending.settle(table.lookup, table.generation, now=2) == {10: [100, 200]}
+    assert len(pending) == 0
+
+
+def test_unknown_bytes_expire_to_unattributed():
+    pending = PendingFlows(ttl=10, max_flows=1)
+    pending.add("a", 1, 2, now=0)
+    # pushed out by the bound
+    pending.add("b", 3, 4, now=5)
+    assert pending.settle(lambda flow: None, now=6) == {UNATTRIBUTED_PID: [1, 2]}
+    assert pending.settle(lambda flow: None, now=20) == {UNATTRIBUTED_PID: [3, 4]}
+
+
+def write_proc(root, sockets, fds):
+    (root / "net").mkdir(parents=True, exist_ok=True)
+    header = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+    (root / "net" / "tcp").write_text(header + "".join(
+        f"   0: {local}:{lport:04X} {remote}:{rport:04X} 01 00000000:00000000 00:00000000 00000000  1000        0 {inode}\n"
+        for local, lport, remote, rport, inode in sockets
+    ))
+    for pid, inodes in fds.items():
+        fd_dir = root / str(pid) / "fd"
+        fd_dir.mkdir(parents=True, exist_ok=True)
+        for number, inode in enumerate(inodes):
+            link = fd_dir / str(number)
+            if not link.is_symlink():
+                link.symlink_to(f"socket:[{inode}]")
+
+
+def test_read_proc_net_decodes_connected_sockets(tmp_path):
+    # 10.0.0.2:50000 -> 1.1.1.1:443, and a listening socket that is skipped
+    write_proc(tmp_path, [("0200000A", 50000, "01010101", 443, 7), ("00000000", 22, "00000000", 0, 8)], {})
+    assert read_proc_net(str(tmp_path)) == {7: FlowKey(PROTO_TCP, LOCAL, 50000, REMOTE, 443)}
+
+
+def test_inode_index_skips_unresolvable_inodes_until_a_process_starts(tmp_path):
+    write_proc(tmp_path, [], {1: [10], 2: [20]})
+    index = InodePidIndex(str(tmp_path))
+    scanned = []
+    scan_pid = index.scan_pid
+    index.scan_pid = lambda pid: scanned.append(pid) or scan_pid(pid)
+    inodes = {10: None, 20: None, 99: None}.keys()
+    assert index.resolve(inodes) == {10: 1, 20: 2}
+    scanned.clear()
+    assert index.resolve(inodes) == {10: 1, 20: 2}
+    assert scanned == []
+    write_proc(tmp_path, [], {3: [99]})
+    assert index.resolve(inodes) == {10: 1, 20: 2, 99: 3}
+    assert scanned == [3]
@@ -0,0 +1,45 @@
+from counter_table import OTHER_REMOTE, CounterTable, RemoteCounters
+
+
+def test_add_and_snapshot():
+    table = CounterTable()
+    table.add(10, 100, 200, 3)
+    table.add(20, 5, 0, 1)
+    table.add(10, 1, 1, 1)
+    columns = table.snapshot()
+    rows = dict(zip(columns.pids.tolist(), zip(columns.upload.tolist(), columns.download.tolist())))
+    assert rows == {10: (101, 201), 20: (5, 0)}
+    assert columns.totals() == (106, 201)
+
+
+def test_release_waits_for_the_adding_thread():
+    table = CounterTable()
+    table.add(10, 100, 200)
+    table.release(10)
+    assert table.get(10) == (100, 200)
+    table.collect()
+    assert 10 not in table
+    assert table.snapshot().pids.tolist() == []
+
+
+def test_reused_slot_starts_from_zero():
+    table = CounterTable()
+    slot = table.slot(10)
+    table.release(10)
+    table.collect()
+    # bytes an add wrote into the slot after it was freed
+    table.upload[slot] += 500
+    table.add(20, 1, 2)
+    assert table.slot(20) == slot
+    assert table.get(20) == (1, 2)
+
+
+def test_remote_counters_fold_extra_remotes():
+    remotes = RemoteCounters(max_remotes=2)
+    for address in (b"a", b"b", b"c", b"d"):
+        remotes.add(1, address, 10, 1)
+    assert remotes.get(1) == {b"a": (10, 1), b"b": (10, 1), OTHER_REMOTE: (20, 2)}
+    remotes.release(1)
+    assert remotes.get(1)
+    remotes.collect()
+    assert remotes.get(1) == {}
@@ -0,0 +1,88 @@
+import socket
+import struct
+
+from host_names import HostNameCache, NameSniffer, parse_client_hello, parse_dns_response
+
+CLIENT = socket.inet_aton("192.168.1.10")
+SERVER = socket.inet_aton("93.184.216.34")
+
+
+def client_hello(name, padding=0):
+    server_name = name.encode("ascii")
+    sni = struct.pack("!HBH", len(server_name) + 3, 0, len(server_name)) + server_name
+    extensions = struct.pack("!HH", 0, len(sni)) + sni
+    if padding:
+        # a large key share after the SNI, like post-quantum hybrid groups
+        extensions += struct.pack("!HH", 51, padding) + b"\0" * padding
+    body = (
+        b"\x03\x03" + b"\x11" * 32 + b"\x00"
+        + struct.pack("!H", 2) + b"\x13\x01" + b"\x01\x00"
+        + struct.pack("!H", len(extensions)) + extensions
+    )
+    handshake = b"\x01" + len(body).to_bytes(3, "big") + body
+    return b"\x16\x03\x01" + struct.pack("!H", len(handshake)) + handshake
+
+
+def tcp_packet(payload, src=CLIENT, dst=SERVER, sport=50000, dport=443):
+    tcp = struct.pack("!HHIIBBHHH", sport, dport, 0, 0, 5 << 4, 0x18, 65535, 0, 0)
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(tcp) + len(payload), 0, 0, 64, 6, 0, src, dst)
+    return ip + tcp + payload
+
+
+def udp_packet(payload, src=SERVER, dst=CLIENT, sport=53, dport=50000):
+    udp = struct.pack("!HHHH", sport, dport, 8 + len(payload), 0)
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp) + len(payload), 0, 0, 64, 17, 0, src, dst)
+    return ip + udp + payload
+
+
+def dns_response(name, address, ttl=300):
+    question = b"".join(bytes([len(label)]) + label.encode() for label in name.split(".")) + b"\0"
+    header = struct.pack("!HHHHHH", 1, 0x8180, 1, 1, 0, 0)
+    answer = b"\xc0\x0c" + struct.pack("!HHIH", 1, 1, ttl, 4) + address
+    return header + question + struct.pack("!HH", 1, 1) + answer
+
+
+def test_parse_client_hello():
+    assert parse_client_hello(client_hello("Example.COM")) == "example.com"
+    assert parse_client_hello(b"\x17\x03\x03\x00\x10" + b"\0" * 16) is None
+
+
+def test_parse_dns_response():
+    assert parse_dns_response(dns_response("www.example.com", SERVER, 120)) == [(SERVER, "www.example.com", 120)]
+
+
+def test_sni_from_first_segment_of_a_two_segment_hello():
+    hello = client_hello("split.example.com", padding=1400)
+    first, second = hello[:1200], hello[1200:]
+    cache = HostNameCache()
+    sniffer = NameSniffer(cache)
+    # the capture filters drop the continuation, the first segment alone has to do
+    sniffer.feed(tcp_packet(first))
+    assert cache.name(SERVER) == "split.example.com"
+    assert not sniffer.partial_hellos
+    sniffer.feed(tcp_packet(second))
+    assert cache.name(SERVER) == "split.example.com"
+
+
+def test_hello_reassembled_when_the_name_is_in_a_later_segment():
+    hello = client_hello("late.example.com")
+    cache = HostNameCache()
+    sniffer = NameSniffer(cache)
+    sniffer.feed(tcp_packet(hello[:60]))
+    assert cache.name(SERVER) is None
+    sniffer.feed(tcp_packet(hello[60:]))
+    assert cache.name(SERVER) == "late.example.com"
+
+
+def test_sni_name_wins_over_dns_until_it_expires():
+    cache = HostNameCache()
+    cache.learn(SERVER, "cdn.example.net", "sni", ttl=60, now=0)
+    cache.learn(SERVER, "other.example.org", "dns", ttl=60, now=1)
+    assert cache.name(SERVER, now=2) == "cdn.example.net"
+    assert cache.name(SERVER, now=100) is None
+
+
+def test_dns_answer_names_the_address():
+    cache = HostNameCache()
+    NameSniffer(cache).feed(udp_packet(dns_response("www.example.com", SERVER)))
+    assert cache.name(SERVER) == "www.example.com"
@@ -0,0 +1,77 @@
+import socket
+import struct
+from array import array
+
+import packet_batch
+from packet_batch import DOWNLOAD, UPLOAD, flow_of, fold_batch
+from packet_headers import PROTO_TCP, PROTO_UDP, ip_payload, parse_ethernet_frame, parse_ip_packet
+
+LOCAL_MAC = bytes.fromhex("020000000001")
+REMOTE_MAC = bytes.fromhex("020000000002")
+LOCAL = socket.inet_aton("10.0.0.2")
+REMOTE = socket.inet_aton("1.1.1.1")
+LOCAL6 = socket.inet_pton(socket.AF_INET6, "2001:db8::2")
+REMOTE6 = socket.inet_pton(socket.AF_INET6, "2001:db8::1")
+
+
+def ipv4(proto, src, dst, sport, dport, payload=b"", fragment=0):
+    l4 = struct.pack("!HHHH", sport, dport, 8 + len(payload), 0) + payload
+    return struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(l4), 0, fragment, 64, proto, 0, src, dst) + l4
+
+
+def ipv6(proto, src, dst, sport, dport, payload=b""):
+    l4 = struct.pack("!HHHH", sport, dport, 8 + len(payload), 0) + payload
+    return struct.pack("!IHBB16s16s", 6 << 28, len(l4), proto, 64, src, dst) + l4
+
+
+def ethernet(packet, ethertype=0x0800, vlan=False):
+    header = REMOTE_MAC + LOCAL_MAC
+    if vlan:
+        header += struct.pack("!HH", 0x8100, 7)
+    return header + struct.pack("!H", ethertype) + packet
+
+
+def test_ipv4_frame():
+    header = parse_ethernet_frame(ethernet(ipv4(PROTO_TCP, LOCAL, REMOTE, 50000, 443, b"x" * 100)))
+    assert header == (LOCAL_MAC, PROTO_TCP, LOCAL, 50000, REMOTE, 443, 14 + 20 + 108)
+
+
+def test_vlan_tagged_ipv6_frame():
+    header = parse_ethernet_frame(ethernet(ipv6(PROTO_UDP, REMOTE6, LOCAL6, 53, 40000, b"y" * 10), 0x86DD, vlan=True))
+    assert header.proto == PROTO_UDP
+    assert (header.src, header.sport, header.dst, header.dport) == (REMOTE6, 53, LOCAL6, 40000)
+    assert header.length == 18 + 40 + 18
+
+
+def test_header_only_snaplen_is_enough():
+    frame = ethernet(ipv4(PROTO_TCP, LOCAL, REMOTE, 50000, 443, b"x" * 1000))
+    assert parse_ethernet_frame(frame[:96]).length == len(frame)
+
+
+def test_ignored_packets():
+    # ARP, a non-first fragment, ICMP and a truncated header
+    assert parse_ethernet_frame(ethernet(b"\0" * 28, 0x0806)) is None
+    assert parse_ip_packet(ipv4(PROTO_UDP, LOCAL, REMOTE, 1, 2, fragment=10)) is None
+    assert parse_ip_packet(ipv4(1, LOCAL, REMOTE, 1, 2)) is None
+    assert parse_ip_packet(ipv4(PROTO_TCP, LOCAL, REMOTE, 1, 2)[:21]) is None
+
+
+def test_ip_payload_stops_at_the_ip_length():
+    packet = ipv4(PROTO_UDP, REMOTE, LOCAL, 53, 40000, b"answer") + b"\0" * 12
+    assert ip_payload(packet) == (PROTO_UDP, REMOTE, 53, LOCAL, 40000, b"answer")
+
+
+def test_flows_are_local_first():
+    out = parse_ip_packet(ipv4(PROTO_TCP, LOCAL, REMOTE, 50000, 443))
+    back = parse_ip_packet(ipv4(PROTO_TCP, REMOTE, LOCAL, 443, 50000))
+    assert flow_of(out, UPLOAD) == flow_of(back, DOWNLOAD) == (PROTO_TCP, LOCAL, 50000, REMOTE, 443)
+
+
+def test_fold_batch_paths_agree(monkeypatch):
+    flows = [("a",), ("b",), ("a",)] * 200
+    directions = array("B", [UPLOAD, DOWNLOAD, DOWNLOAD] * 200)
+    lengths = array("I", [100, 40, 60] * 200)
+    expected = {("a",): [20000, 12000, 400], ("b",): [0, 8000, 200]}
+    assert fold_batch(flows, directions, lengths) == expected
+    monkeypatch.setattr(packet_batch, "np", None)
+    assert fold_batch(flows, directions, lengths) == expected
@@ -0,0 +1,39 @@
+import math
+
+from quota_engine import Threshold, ThresholdEngine
+
+GB = 1024 ** 3
+
+
+def test_thresholds_fire_once_in_order():
+    engine = ThresholdEngine()
+    engine.set_thresholds([Threshold("limit", 100), Threshold("warning", 80)])
+    assert engine.observe(50, 0.0) == []
+    assert [t.name for t in engine.observe(120, 1.0)] == ["warning", "limit"]
+    assert engine.observe(130, 2.0) == []
+    assert engine.sleep_time() == math.inf
+
+
+def test_unchanged_crossed_threshold_stays_crossed():
+    engine = ThresholdEngine()
+    engine.set_thresholds([Threshold("limit", 100)])
+    engine.observe(150, 0.0)
+    engine.set_thresholds([Threshold("limit", 100), Threshold("extra", 500)])
+    assert engine.observe(160, 1.0) == []
+
+
+def test_limit_lowered_below_usage_fires():
+    engine = ThresholdEngine()
+    engine.observe(2 * GB, 0.0)
+    engine.set_thresholds([Threshold("data-limit", GB)])
+    assert engine.sleep_time() == engine.min_sleep
+    assert [t.name for t in engine.observe(2 * GB, 1.0)] == ["data-limit"]
+
+
+def test_sleep_time_shrinks_near_the_limit():
+    engine = ThresholdEngine(rate_floor=1000, max_sleep=1000.0)
+    engine.set_thresholds([Threshold("limit", 100_000)])
+    engine.observe(0, 0.0)
+    far = engine.sleep_time()
+    engine.observe(90_000, 1.0)
+    assert engine.sleep_time() < far
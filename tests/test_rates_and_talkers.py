@@ -0,0 +1,63 @@
+import pytest
+
+from heavy_hitters import SpaceSaving, TopTalkers, WindowedTopK
+from rate_engine import RateEngine, combine_rates
+
+
+def test_window_rates():
+    engine = RateEngine(windows=(1, 10), resolution=1.0)
+    for second in range(10):
+        engine.add("a", 1000, 100, second + 0.5)
+    rates = engine.rates("a", 10.0)
+    assert rates.upload == (1000.0, 1000.0)
+    assert rates.download == (100.0, 100.0)
+    assert rates.peak_upload == 1000.0
+    assert engine.rates("missing", 10.0) is None
+
+
+def test_rates_fall_to_zero_when_idle():
+    engine = RateEngine(windows=(1, 10), resolution=1.0, half_life=1.0)
+    engine.add("a", 5000, 0, 0.5)
+    rates = engine.rates("a", 100.0)
+    assert rates.upload == (0.0, 0.0)
+    assert rates.ewma_upload == pytest.approx(0.0, abs=1e-6)
+    assert rates.peak_upload == 5000.0
+
+
+def test_combined_rates_add_up():
+    engine = RateEngine(windows=(1,), resolution=1.0)
+    engine.add("a", 100, 0, 0.5)
+    engine.add("b", 300, 0, 0.5)
+    combined = combine_rates([engine.rates("a", 1.0), None, engine.rates("b", 1.0)])
+    assert combined.upload == (400.0,)
+    assert combine_rates([None]) is None
+
+
+def test_space_saving_keeps_heavy_keys():
+    sketch = SpaceSaving(capacity=4)
+    for i in range(1000):
+        sketch.add(f"light{i}", 1)
+        if i % 10 == 0:
+            sketch.add("heavy", 50)
+    top = sketch.top(1)[0]
+    assert top.key == "heavy"
+    assert 5000 <= top.count <= 5000 + top.error
+    assert len(sketch) == 4
+
+
+def test_windowed_top_forgets_old_traffic():
+    top = WindowedTopK(capacity=8, window=60, slices=6)
+    top.add("old", 1000, 0.0)
+    top.add("new", 10, 100.0)
+    assert [hitter.key for hitter in top.recent(100.0)] == ["new"]
+    assert top.count("old") == 1000
+    assert top.top(1)[0].key == "old"
+
+
+def test_top_talkers_group_a_batch():
+    talkers = TopTalkers(capacity=8)
+    talkers.add([(1, b"r1", 100), (1, b"r2", 50), (None, b"r1", 10), (2, None, 5)], 0.0)
+    assert talkers.processes.count(1) == 150
+    assert talkers.remotes.count(b"r1") == 110
+    assert talkers.pairs.count((1, b"r1")) == 100
+    assert talkers.processes.count(2) == 5
@@ -0,0 +1,92 @@
+import pytest
+
+from app_accounting import UsageRecorder
+from rollups import DAY, HOUR, MINUTE, RollupEngine, RollupSet
+from usage_store import INDEX_STRIDE, UsageStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = UsageStore("apps", directory=str(tmp_path), interval=10)
+    yield store
+    store.close()
+
+
+def test_totals_over_interval_ranges(store):
+    store.record("a", 100, 10, 1000)
+    store.record("b", 5, 5, 1004)
+    store.record("a", 1, 1, 1012)
+    store.flush()
+    assert store.totals(1000, 1010) == {"a": [100, 10], "b": [5, 5]}
+    assert store.totals(1010, 1020) == {"a": [1, 1]}
+    assert store.totals(0, 2000) == {"a": [101, 11], "b": [5, 5]}
+
+
+def test_open_interval_is_queried(store):
+    store.record("a", 7, 0, 1000)
+    assert store.totals(1000, 1010) == {"a": [7, 0]}
+
+
+def test_interval_spanning_an_index_stride(store):
+    apps = INDEX_STRIDE - 12
+    for start in (1000, 1010):
+        for app in range(apps):
+            store.record(f"app{app}", 1, 1, start)
+    store.flush()
+    # the second interval starts before the stride boundary and ends after it
+    assert store.index_starts == [1000, 1010]
+    assert len(store.totals(1010, 1020)) == apps
+    assert len(store.totals(1000, 1010)) == apps
+
+
+def test_reopened_store_keeps_history(tmp_path):
+    store = UsageStore("apps", directory=str(tmp_path), interval=10)
+    store.record("a", 3, 4, 1000)
+    store.close()
+    store = UsageStore("apps", directory=str(tmp_path), interval=10)
+    store.record("a", 1, 1, 1100)
+    store.flush()
+    assert store.totals(0, 2000) == {"a": [4, 5]}
+    store.close()
+
+
+def process(pid, exe, upload, download):
+    return {"pid": pid, "name": exe.rsplit("/", 1)[-1], "exe": exe, "Upload": upload, "Download": download}
+
+
+def test_recorder_takes_deltas_per_process(store):
+    rollups = RollupSet(offset=0)
+    recorder = UsageRecorder(store, rollups)
+    recorder.record([process(1, "/bin/app", 100, 10), process(2, "/bin/app", 50, 5)])
+    # pid 1 exited and was released, pid 2 kept going: the app's sum went down
+    recorder.record([process(2, "/bin/app", 60, 6)])
+    store.flush()
+    assert store.totals(0, 2 ** 32 - 1) == {"/bin/app": [160, 16]}
+
+
+def test_recorder_restarts_a_reused_pid(store):
+    recorder = UsageRecorder(store, RollupSet(offset=0))
+    recorder.record([process(1, "/bin/app", 100, 0)])
+    recorder.record([process(1, "/bin/app", 30, 0)])
+    store.flush()
+    assert store.totals(0, 2 ** 32 - 1) == {"/bin/app": [130, 0]}
+
+
+def test_rollup_totals_match_the_raw_series():
+    engine = RollupEngine(offset=0)
+    start = 10 * DAY
+    for second in range(0, 3 * HOUR, 7):
+        engine.add(start + second, 1, 2)
+    samples = len(range(0, 3 * HOUR, 7))
+    assert engine.total(start, start + 3 * HOUR) == (samples, 2 * samples)
+    # ragged edges come from the finer tiers, the seconds only cover the last hour
+    first = len(range(0, 150 * MINUTE + 13, 7))
+    assert engine.total(start, start + 150 * MINUTE + 13) == (first, 2 * first)
+
+
+def test_rollup_set_keeps_keys_apart():
+    rollups = RollupSet(offset=0)
+    rollups.add("a", 100, 1, 1)
+    rollups.add("b", 100, 5, 5)
+    assert rollups.total("a", 0, 200) == (1, 1)
+    assert rollups.total("missing", 0, 200) == (0, 0)
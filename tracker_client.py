@@ -0,0 +1,203 @@
+"""Thin client for tracker_daemon.py.
+
+    python tracker_client.py totals|apps|talkers|watch|reload|stop
+    python tracker_client.py hosts [app]
+"""
+import os
+import secrets
+import subprocess
+import sys
+import time
+import threading
+from collections import deque
+from multiprocessing.connection import Client
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from usage_store import DATA_DIR
+
+if sys.platform == "win32":
+    DAEMON_ADDRESS = r"\\.\pipe\data_usage_tracker"
+else:
+    DAEMON_ADDRESS = os.path.join(DATA_DIR, "daemon.sock")
+# shared secret for the connection handshake, readable by the current user only
+AUTHKEY_PATH = os.path.join(DATA_DIR, "daemon.key")
+DAEMON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracker_daemon.py")
+
+# what a client can subscribe to
+TOPICS = ("totals", "apps", "talkers", "events")
+
+
+def daemon_authkey(create=False):
+    try:
+        with open(AUTHKEY_PATH, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        if not create:
+            raise
+    os.makedirs(DATA_DIR, exist_ok=True)
+    key = secrets.token_bytes(32)
+    try:
+        fd = os.open(AUTHKEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # another process created it first
+        return daemon_authkey()
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+class TrackerClient:
+    """One connection to the daemon.
+
+    Messages are dicts. `subscribe` and `command` are one-way; `query` waits for its
+    reply and keeps pushed updates that arrive meanwhile for `receive`. Don't call
+    `query` while another thread is reading `updates()` from the same client.
+    """
+
+    def __init__(self, address=DAEMON_ADDRESS, authkey=None):
+        self.conn = Client(address, authkey=authkey or daemon_authkey())
+        self.send_lock = threading.Lock()
+        self.pushed = deque()
+        self.next_id = 0
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def subscribe(self, topics=TOPICS, interval=1.0):
+        """Ask for pushed updates of `topics` at most every `interval` seconds"""
+        self.send({"op": "subscribe", "topics": list(topics), "interval": interval})
+
+    def command(self, name, **arguments):
+        self.send(dict(arguments, op="command", name=name))
+
+    def query(self, what, **arguments):
+        self.next_id += 1
+        request_id = self.next_id
+        self.send(dict(arguments, op="query", what=what, id=request_id))
+        while True:
+            message = self.conn.recv()
+            if message.get("id") == request_id:
+                if message["type"] == "error":
+                    raise ValueError(message["error"])
+                return message["data"]
+            self.pushed.append(message)
+
+    def receive(self, timeout=None):
+        """Next pushed message, None if nothing arrived within `timeout` seconds"""
+        if self.pushed:
+            return self.pushed.popleft()
+        if timeout is not None and not self.conn.poll(timeout):
+            return None
+        return self.conn.recv()
+
+    def updates(self):
+        """Yield pushed messages until the daemon goes away"""
+        while True:
+            try:
+                yield self.receive()
+            except (EOFError, OSError):
+                return
+
+    def close(self):
+        self.conn.close()
+
+
+def connect(start=True, timeout=15.0):
+    """TrackerClient for the running daemon, starting the daemon first if needed and `start`"""
+    try:
+        return TrackerClient()
+    except OSError:
+        if not start:
+            raise
+    options = {}
+    if sys.platform == "win32":
+        options["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        options["start_new_session"] = True
+    subprocess.Popen(
+        [sys.executable, DAEMON_SCRIPT], cwd=os.path.dirname(DAEMON_SCRIPT),
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **options
+    )
+    deadline = time.monotonic() + timeout
+    while True:
+        time.sleep(0.2)
+        try:
+            return TrackerClient()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
+
+class DaemonClientThread(QThread):
+    """Receives the daemon's pushes on a worker thread and re-emits them as Qt signals"""
+
+    updated = pyqtSignal(dict)
+    event = pyqtSignal(dict)
+    disconnected = pyqtSignal()
+
+    def __init__(self, client, topics, interval=1.0, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.topics = topics
+        self.interval = interval
+
+    def run(self):
+        try:
+            self.client.subscribe(self.topics, self.interval)
+        except OSError:
+            self.disconnected.emit()
+            return
+        for message in self.client.updates():
+            if message["type"] == "update":
+                self.updated.emit(message)
+            elif message["type"] == "event":
+                self.event.emit(message)
+        self.disconnected.emit()
+
+
+def main():
+    from usage_model import get_size, talker_label
+    action = sys.argv[1] if len(sys.argv) > 1 else "totals"
+    client = connect(start=action not in ("stop",))
+    if action == "totals":
+        totals = client.query("totals")
+        print(f"upload {get_size(totals['upload'])}, download {get_size(totals['download'])}, "
+              f"today {get_size(totals['today'])}")
+    elif action == "apps":
+        for process in sorted(client.query("apps"), key=lambda p: p["Upload"] + p["Download"], reverse=True):
+            speed = process.get("Upload Speed", 0) + process.get("Download Speed", 0)
+            print(f"{process['pid']:>7} {process['name']:30} {get_size(process['Upload']):>10} "
+                  f"{get_size(process['Download']):>10} {get_size(speed) + '/s':>12}")
+    elif action == "talkers":
+        talkers = client.query("talkers", limit=10)
+        for title, kind in (("Processes", "processes"), ("Remote hosts", "remotes"), ("Process -> remote host", "pairs")):
+            print(f"{title} (last minute):")
+            for row in talkers[kind]:
+                print(f"  {talker_label(row):50} {get_size(row['recent']):>10}")
+    elif action == "hosts":
+        # per host name where one is known, what the app(s) moved to and from it
+        apps = client.query("hosts", app=sys.argv[2] if len(sys.argv) > 2 else None, by_name=True)
+        for app, rows in apps.items():
+            print(app)
+            for row in rows[:20]:
+                host = row["host"] or (", ".join(row["addresses"]) or "other")
+                print(f"  {host:50} {get_size(row['Upload']):>10} {get_size(row['Download']):>10}")
+    elif action == "watch":
+        client.subscribe(("totals", "events"), 1.0)
+        for message in client.updates():
+            if message["type"] == "event":
+                print("event:", message)
+            else:
+                totals = message["totals"]
+                print(f"upload {get_size(totals['upload'])}, download {get_size(totals['download'])}")
+    elif action in ("reload", "stop"):
+        client.command("reload-settings" if action == "reload" else "stop")
+    else:
+        sys.exit(__doc__)
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""Headless tracker that owns capture, accounting, persistence and the data limit checks.
+
+Windows and command line tools attach through tracker_client.TrackerClient instead of
+running their own capture, so there is one engine however many windows are open.
+
+    python tracker_daemon.py [--backend scapy|pydivert|conntrack]
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import date, datetime
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from PyQt5.QtCore import QCoreApplication, Qt
+
+from app_accounting import AppAccounting, UsageRecorder
+from app_policy import PolicyEngine
+from capture_backends import PydivertBackend, create_backend
+from counter_sampler import shared_sampler
+from data_wifi_control import DataUsageTracker
+from host_names import NameSniffer
+from packet_batch import fold_batch
+from rollups import DAY, RollupEngine, RollupSet
+from settings_service import SettingsService
+from shared_counters import SharedCounters
+from tracker_client import DAEMON_ADDRESS, TOPICS, daemon_authkey
+from usage_store import TOTAL_APP, UsageStore
+
+# how often the whole-machine counters are sampled and recorded
+TICK_INTERVAL = 0.1
+# how often the per-process rows are rebuilt and recorded
+APPS_INTERVAL = 1.0
+# clients can't ask for pushes more often than this
+MIN_PUSH_INTERVAL = 0.1
+
+
+def midnight():
+    return datetime.combine(date.today(), datetime.min.time()).timestamp()
+
+
+class ClientSession(threading.Thread):
+    """One attached client: reads its requests, and the daemon pushes to it with `send`"""
+
+    def __init__(self, daemon, conn):
+        super().__init__(daemon=True)
+        self.tracker_daemon = daemon
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.topics = set()
+        self.interval = 1.0
+        self.next_push = 0.0
+        self.closed = False
+
+    def run(self):
+        try:
+            while True:
+                self.tracker_daemon.handle(self, self.conn.recv())
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.close()
+
+    def send(self, message):
+        if self.closed:
+            return False
+        try:
+            with self.send_lock:
+                self.conn.send(message)
+            return True
+        except (OSError, ValueError):
+            self.close()
+            return False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.conn.close()
+            self.tracker_daemon.remove(self)
+
+
+class TrackerDaemon:
+    def __init__(self, backend=None, address=DAEMON_ADDRESS):
+        self.running = True
+        self.policy_engine = PolicyEngine()
+        self.accounting = AppAccounting(on_exit=self.policy_engine.forget)
+        self.app_store = UsageStore("apps")
+        self.app_rollups = RollupSet()
+        self.app_recorder = UsageRecorder(self.app_store, self.app_rollups)
+        if backend is None:
+            # per-app quotas can only be enforced inline on WinDivert
+            backend = PydivertBackend() if sys.platform == "win32" else create_backend("scapy")
+        self.backend = backend
+        # settings_data.json is watched, saved changes reach the policies, the capture
+        # mode and the tracker live
+        self.settings_service = SettingsService()
+        self.settings_service.subscribe(self.apply_settings)
+        # host names from the DNS answers and TLS handshakes on the same traffic
+        self.name_sniffer = NameSniffer.for_backend(self.accounting.host_names, backend)
+
+        # whole-machine totals, kept on disk and rolled up for cheap range queries
+        self.sampler = shared_sampler()
+        self.baseline = self.sampler.sample()
+        self.recorded = self.baseline
+        self.total_store = UsageStore("total")
+        self.rollups = RollupEngine()
+        self.rollups.load(self.total_store.query(time.time() - 35 * DAY, float("inf")))
+
+        # data limit warnings, alerts and the Wi-Fi cut-off; its signals are forwarded
+        # to clients straight from the tracker thread. When it stops (connection cut, or
+        # an unlimited exceeded limit accepted) only the limit checks end, capture and
+        # the stores carry on
+        self.tracker = DataUsageTracker(settings_service=self.settings_service, exit_app=False)
+        self.tracker.wifi_disabled.connect(lambda: self.broadcast("wifi-disabled"), Qt.DirectConnection)
+        self.tracker.data_limit_alert.connect(lambda: self.broadcast("data-limit"), Qt.DirectConnection)
+        self.tracker.exceeded_data_limit_alert.connect(
+            lambda: self.broadcast("exceeded-data-limit"), Qt.DirectConnection
+        )
+        self.tracker.data_limit_warning.connect(
+            lambda percent: self.broadcast("data-limit-warning", percent=percent), Qt.DirectConnection
+        )
+        # the data limit question is repeated to clients that attach before it is answered
+        self.pending_alert = None
+
+        self.sessions = []
+        self.lock = threading.Lock()
+        self.apps = []
+        self.apps_updated = 0.0
+        # the latest totals and per-process rows for readers that map them instead of
+        # subscribing, created before the listener so it exists once clients connect
+        self.shared_counters = SharedCounters()
+        self.listener = Listener(address, authkey=daemon_authkey(create=True))
+
+    def apply_settings(self, settings):
+        self.settings = settings
+        self.load_app_policies()
+        self.update_backend()
+
+    def update_backend(self):
+        """Hold WinDivert traffic for verdicts only while there are app quotas to enforce"""
+        backend = self.backend
+        if not isinstance(backend, PydivertBackend) or (backend.decide is not None) == self.policy_engine.active:
+            return
+        # the capture thread stops the old backend and carries on with this one
+        self.backend = PydivertBackend(
+            self._decide if self.policy_engine.active else None, backend.sniff_only, backend.interval
+        )
+
+    def load_app_policies(self, new_day=False):
+        # budgets are per day, so start from what each app already used today
+        self.policy_day = date.today()
+        used_today = {
+            app: upload + download
+            for app, (upload, download) in self.app_store.totals(midnight(), time.time() + 1).items()
+        }
+        self.policy_engine.set_policies(self.settings.app_policies, used_today, reset=new_day)
+
+    def _decide(self, flow, length):
+        return self.policy_engine.decide(self.accounting.flow_table.lookup(flow), length, time.monotonic())
+
+    # threads
+
+    def capture(self):
+        # update_backend swaps the backend when app quotas are turned on or off
+        while self.running:
+            backend = self.backend
+            for batch in backend.batches():
+                self.accounting.apply(fold_batch(*batch))
+                if not self.running or backend is not self.backend:
+                    backend.stop()
+            if backend is self.backend:
+                # the source ran out, nothing to carry on with
+                break
+
+    def accept(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                # closed by stop(), or a client that failed the handshake
+                continue
+            session = ClientSession(self, conn)
+            with self.lock:
+                self.sessions.append(session)
+            session.start()
+
+    def serve(self):
+        threading.Thread(target=self.capture, name="capture", daemon=True).start()
+        threading.Thread(
+            target=self.accounting.run_connections, args=(lambda: self.running,), name="connections", daemon=True
+        ).start()
+        threading.Thread(target=self.accept, name="accept", daemon=True).start()
+        self.name_sniffer.start()
+        self.settings_service.start()
+        self.tracker.start()
+        while self.running:
+            started = time.monotonic()
+            self.tick(started)
+            time.sleep(max(0.0, TICK_INTERVAL - (time.monotonic() - started)))
+        self.shutdown()
+
+    def tick(self, now):
+        sample = self.sampler.sample()
+        sent = sample.bytes_sent - self.recorded.bytes_sent
+        received = sample.bytes_recv - self.recorded.bytes_recv
+        self.recorded = sample
+        timestamp = time.time()
+        self.total_store.record(TOTAL_APP, sent, received, timestamp)
+        self.rollups.add(timestamp, sent, received)
+
+        if now - self.apps_updated >= APPS_INTERVAL:
+            self.apps_updated = now
+            self.apps = self.accounting.processes()
+            self.app_recorder.record(self.apps)
+            if date.today() != self.policy_day:
+                # a new day, every app gets its full budget back
+                self.load_app_policies(new_day=True)
+
+        totals = self.totals(sample)
+        self.shared_counters.publish(totals["upload"], totals["download"], totals["today"], self.apps)
+
+        with self.lock:
+            due = [s for s in self.sessions if s.topics - {"events"} and now >= s.next_push]
+        if due:
+            update = {"type": "update", "totals": totals, "apps": self.apps}
+            if any("talkers" in s.topics for s in due):
+                update["talkers"] = self.accounting.top_talkers()
+            for session in due:
+                session.next_push = now + session.interval
+                session.send({key: value for key, value in update.items() if key == "type" or key in session.topics})
+
+    def totals(self, sample=None):
+        sample = sample or self.sampler.sample()
+        return {
+            "upload": sample.bytes_sent - self.baseline.bytes_sent,
+            "download": sample.bytes_recv - self.baseline.bytes_recv,
+            "today": sum(self.rollups.total(midnight())),
+            "timestamp": time.time(),
+        }
+
+    # requests
+
+    def handle(self, session, message):
+        op = message.get("op")
+        try:
+            if op == "subscribe":
+                session.topics = set(message.get("topics", ())) & set(TOPICS)
+                session.interval = max(MIN_PUSH_INTERVAL, float(message.get("interval", 1.0)))
+                session.next_push = 0.0
+                if "events" in session.topics and self.pending_alert is not None:
+                    session.send(self.pending_alert)
+            elif op == "query":
+                session.send({"type": "reply", "id": message.get("id"), "data": self.query(message)})
+            elif op == "command":
+                self.command(message["name"])
+            else:
+                raise ValueError(f"unknown op {op!r}")
+        except (KeyError, TypeError, ValueError) as e:
+            session.send({"type": "error", "id": message.get("id"), "error": str(e)})
+
+    def query(self, message):
+        what = message["what"]
+        if what == "totals":
+            return self.totals()
+        if what == "apps":
+            return self.apps
+        if what == "talkers":
+            return self.accounting.top_talkers(int(message.get("limit", 20)))
+        if what == "hosts":
+            # per remote host of one app, or of all of them
+            return self.accounting.remote_hosts(message.get("app"), bool(message.get("by_name")))
+        if what == "history":
+            # (upload, download) over [start, end) for one app, or the whole machine
+            start, end, app = message["start"], message.get("end"), message.get("app")
+            if app is None:
+                return self.rollups.total(start, end)
+            return self.app_rollups.total(app, start, end)
+        raise ValueError(f"unknown query {what!r}")
+
+    def command(self, name):
+        if name == "accept-exceeded-limit":
+            self.pending_alert = None
+            self.tracker.exceeded_data_limit = True
+        elif name == "disconnect-wifi":
+            self.pending_alert = None
+            # disconnect_wifi ends the tracker thread's program, let it run off this session
+            threading.Thread(target=self.tracker.disconnect_wifi, daemon=True).start()
+        elif name == "reload-settings":
+            # changes are picked up by the watcher anyway, this just doesn't wait for it
+            self.settings_service.check()
+        elif name == "stop":
+            self.stop()
+        else:
+            raise ValueError(f"unknown command {name!r}")
+
+    def broadcast(self, name, **fields):
+        event = dict(fields, type="event", name=name)
+        if name == "data-limit":
+            self.pending_alert = event
+        with self.lock:
+            sessions = [s for s in self.sessions if "events" in s.topics]
+        for session in sessions:
+            session.send(event)
+
+    def remove(self, session):
+        with self.lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+
+    def stop(self):
+        self.running = False
+
+    def shutdown(self):
+        self.backend.stop()
+        self.name_sniffer.stop()
+        self.tracker.running = False
+        self.tracker.wakeup.set()
+        self.settings_service.stop()
+        with self.lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.close()
+        self.listener.close()
+        self.shared_counters.close()
+        self.total_store.close()
+        self.app_store.close()
+
+
+def daemon_running(address=DAEMON_ADDRESS):
+    try:
+        Client(address, authkey=daemon_authkey()).close()
+        return True
+    except (OSError, AuthenticationError):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data usage tracker daemon")
+    parser.add_argument("--backend", help="scapy, pydivert or conntrack (default: pydivert on Windows, scapy elsewhere)")
+    args = parser.parse_args()
+    if daemon_running():
+        sys.exit("The tracker daemon is already running")
+    if sys.platform != "win32" and os.path.exists(DAEMON_ADDRESS):
+        # left behind by a daemon that didn't shut down cleanly
+        os.unlink(DAEMON_ADDRESS)
+    # DataUsageTracker is a QThread, it needs an application object but no event loop
+    app = QCoreApplication(sys.argv[:1])
+    daemon = TrackerDaemon(create_backend(args.backend) if args.backend else None)
+    signal.signal(signal.SIGINT, lambda *_: daemon.stop())
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    daemon.serve()
+
+
+if __name__ == "__main__":
+    main()
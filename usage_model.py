@@ -0,0 +1,243 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QSortFilterProxyModel, Qt
+from PyQt5.QtWidgets import QApplication, QStyle, QStyledItemDelegate, QStyleOptionProgressBar
+
+from rate_engine import combine_rates
+
+# role used by the sort proxy: lower-cased name for the app column, bytes for usage
+SORT_ROLE = Qt.UserRole
+USAGE_ROLE = Qt.UserRole + 1
+
+APP_COLUMN = 0
+USAGE_COLUMN = 1
+SPEED_COLUMN = 2
+
+
+def get_size(bytes: int) -> str:
+    """
+    Returns size of bytes in a nice format
+    """
+    for unit in ["", "K", "M", "G", "T", "P"]:
+        if bytes < 1024:
+            return f"{bytes:.2f}{unit}B"
+        bytes /= 1024
+
+
+class AppUsageRow:
+    __slots__ = ("key", "name", "exe", "pids", "upload", "download", "rates", "peak")
+
+    def __init__(self, key, name, exe):
+        self.key = key
+        self.name = name
+        self.exe = exe
+        self.pids = ()
+        self.upload = 0
+        self.download = 0
+        # rate_engine.Rates of all its processes together, None when unknown
+        self.rates = None
+        # highest combined bytes/s seen
+        self.peak = 0.0
+
+    @property
+    def usage(self):
+        return self.upload + self.download
+
+    @property
+    def speed(self):
+        """bytes/s over the shortest rate window"""
+        return self.rates.upload[0] + self.rates.download[0] if self.rates is not None else 0.0
+
+
+class AppUsageModel(QAbstractTableModel):
+    """One row per executable, aggregating every PID that ran it.
+
+    `update` only emits dataChanged for rows whose counters moved, plus the usage
+    column when the total its bars are relative to changed, and inserts or removes
+    rows as applications appear or drop out of the process list.
+    """
+
+    def __init__(self, icon_provider=None, parent=None):
+        super().__init__(parent)
+        # exe path -> QPixmap, e.g. IconCache.pixmap
+        self.icon_provider = icon_provider
+        self.rows = []
+        self.row_of = {}
+        self.total = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 3
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return ("Application", "Data usage", "Speed")[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if index.column() == APP_COLUMN:
+            if role == Qt.DisplayRole:
+                return row.name
+            if role == Qt.DecorationRole and self.icon_provider is not None:
+                return self.icon_provider(row.exe)
+            if role == Qt.ToolTipRole:
+                pids = ", ".join(str(pid) for pid in row.pids)
+                return f"{row.exe or row.name}\nPID: {pids}"
+            if role == SORT_ROLE:
+                return row.name.lower()
+        elif index.column() == USAGE_COLUMN:
+            if role == Qt.DisplayRole:
+                return get_size(row.usage)
+            if role in (SORT_ROLE, USAGE_ROLE):
+                return row.usage
+            if role == Qt.ToolTipRole:
+                return f"Upload: {get_size(row.upload)}\nDownload: {get_size(row.download)}"
+        else:
+            if role == Qt.DisplayRole:
+                return f"{get_size(row.speed)}/s"
+            if role == SORT_ROLE:
+                return row.speed
+            if role == Qt.ToolTipRole and row.rates is not None:
+                rates = row.rates
+                lines = [
+                    f"{window} s: {get_size(up)}/s up, {get_size(down)}/s down"
+                    for window, up, down in zip(rates.windows, rates.upload, rates.download)
+                ]
+                lines.append(f"Average: {get_size(rates.ewma_upload)}/s up, {get_size(rates.ewma_download)}/s down")
+                lines.append(f"Peak: {get_size(row.peak)}/s")
+                return "\n".join(lines)
+        return None
+
+    def update(self, processes):
+        """Fold print_pid2traffic() dicts into per-executable rows"""
+        groups = {}
+        for process in processes:
+            key = process.get("exe") or process["name"]
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [process["name"], process.get("exe"), [], 0, 0, []]
+            group[2].append(process["pid"])
+            group[3] += process["Upload"]
+            group[4] += process["Download"]
+            group[5].append(process.get("Rates"))
+
+        # drop applications that no longer have any process behind them
+        gone = sorted((self.row_of[key] for key in self.row_of.keys() - groups.keys()), reverse=True)
+        for position in gone:
+            self.beginRemoveRows(QModelIndex(), position, position)
+            del self.rows[position]
+            self.endRemoveRows()
+        if gone:
+            self.row_of = {row.key: position for position, row in enumerate(self.rows)}
+
+        total = 0
+        for key, (name, exe, pids, upload, download, rates) in groups.items():
+            total += upload + download
+            rates = combine_rates(rates)
+            position = self.row_of.get(key)
+            if position is None:
+                position = len(self.rows)
+                self.beginInsertRows(QModelIndex(), position, position)
+                row = AppUsageRow(key, name, exe)
+                row.pids, row.upload, row.download, row.rates = tuple(pids), upload, download, rates
+                row.peak = row.speed
+                self.rows.append(row)
+                self.row_of[key] = position
+                self.endInsertRows()
+                continue
+            row = self.rows[position]
+            pids = tuple(pids)
+            if row.upload != upload or row.download != download or row.pids != pids or row.rates != rates:
+                row.pids, row.upload, row.download, row.rates = pids, upload, download, rates
+                row.peak = max(row.peak, row.speed)
+                self.dataChanged.emit(self.index(position, 0), self.index(position, SPEED_COLUMN))
+        if total != self.total and self.rows:
+            # every usage bar is drawn relative to the total
+            self.dataChanged.emit(
+                self.index(0, USAGE_COLUMN), self.index(len(self.rows) - 1, USAGE_COLUMN), [USAGE_ROLE]
+            )
+        self.total = total
+
+    def refresh_icon(self, exe):
+        position = self.row_of.get(exe)
+        if position is not None:
+            index = self.index(position, APP_COLUMN)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+def talker_label(row):
+    """"name", "host" or "name -> host" of an AppAccounting.top_talkers row, hosts by
+    their DNS / SNI name where one was seen"""
+    if row["remote"] is None:
+        return row["name"]
+    host = f"{row['host']} ({row['remote']})" if row.get("host") else row["remote"]
+    if row["name"] is None:
+        return host
+    return f"{row['name']} -> {host}"
+
+
+class TopTalkersModel(QAbstractTableModel):
+    """Rows of one AppAccounting.top_talkers list, heaviest of the last minute first"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 3
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return ("Talker", "Last minute", "Total")[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        row = self.rows[index.row()]
+        if index.column() == 0:
+            return talker_label(row)
+        if index.column() == 1:
+            return get_size(row["recent"])
+        # counts are upper bounds, and totals of talkers that were quiet for a long time are gone
+        return get_size(row["total"]) if row["total"] is not None else "-"
+
+    def update(self, rows):
+        # a few dozen rows at most, replacing them all is cheaper than diffing
+        if rows != self.rows:
+            self.beginResetModel()
+            self.rows = list(rows)
+            self.endResetModel()
+
+
+class UsageSortProxyModel(QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setSortRole(SORT_ROLE)
+        self.setDynamicSortFilter(True)
+
+
+class UsageBarDelegate(QStyledItemDelegate):
+    """Paints the usage column as a progress bar relative to the model's total"""
+
+    def __init__(self, usage_model, parent=None):
+        super().__init__(parent)
+        self.usage_model = usage_model
+
+    def paint(self, painter, option, index):
+        usage = index.data(USAGE_ROLE) or 0
+        total = self.usage_model.total
+        bar = QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(2, 2, -2, -2)
+        bar.minimum = 0
+        bar.maximum = 1000
+        bar.progress = int(usage * 1000 / total) if total else 0
+        bar.text = index.data(Qt.DisplayRole)
+        bar.textVisible = True
+        QApplication.style().drawControl(QStyle.CE_ProgressBar, bar, painter)
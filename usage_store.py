@@ -0,0 +1,187 @@
+import bisect
+import os
+import struct
+import time
+
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".data_usage_tracker")
+
+# app name used for whole-machine totals
+TOTAL_APP = "__total__"
+
+# interval start (epoch seconds), app id, upload bytes, download bytes
+RECORD = struct.Struct("<IIII")
+MAX_DELTA = 0xFFFFFFFF
+# one index entry (first interval start, record number) every INDEX_STRIDE records
+INDEX_ENTRY = struct.Struct("<IQ")
+INDEX_STRIDE = 512
+
+
+class UsageStore:
+    """Append-only log of per-interval, per-app upload/download deltas.
+
+    Each store is three files in `directory`:
+      <name>.log   fixed 16-byte records, interval start never decreases
+      <name>.idx   sparse (interval start, record number) index for range queries
+      <name>.apps  app names, line number = app id
+    Deltas are summed in memory per `interval` seconds and written when the interval
+    closes; the log is fsync'd at most every `sync_interval` seconds. One writer per
+    name, so each process uses its own store name.
+    """
+
+    def __init__(self, name, directory=DATA_DIR, interval=10, sync_interval=30.0):
+        os.makedirs(directory, exist_ok=True)
+        self.interval = interval
+        self.sync_interval = sync_interval
+        base = os.path.join(directory, name)
+        self.log_path, self.index_path, self.apps_path = base + ".log", base + ".idx", base + ".apps"
+
+        self.app_names = []
+        if os.path.exists(self.apps_path):
+            with open(self.apps_path, encoding="utf-8") as f:
+                self.app_names = [line.rstrip("\n") for line in f]
+        self.app_ids = {app: app_id for app_id, app in enumerate(self.app_names)}
+
+        self.log = open(self.log_path, "ab")
+        # drop a torn record left by a crash mid-write
+        size = self.log.tell()
+        if size % RECORD.size:
+            self.log.truncate(size - size % RECORD.size)
+        self.record_count = self.log.tell() // RECORD.size
+        self.index_starts, self.index_records = self._load_index()
+        self.index_file = open(self.index_path, "ab")
+        self.last_start = self._read_record(self.record_count - 1)[0] if self.record_count else 0
+
+        # app id -> [upload, download] for the interval that is still open
+        self.bucket_start = None
+        self.bucket = {}
+        self.unsynced = False
+        self.last_sync = time.monotonic()
+
+    def _read_record(self, number):
+        with open(self.log_path, "rb") as f:
+            f.seek(number * RECORD.size)
+            return RECORD.unpack(f.read(RECORD.size))
+
+    def _load_index(self):
+        starts, records = [], []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for start, number in INDEX_ENTRY.iter_unpack(data[:usable]):
+                if number >= self.record_count:
+                    break
+                starts.append(start)
+                records.append(number)
+            if usable != len(data) or len(records) != usable // INDEX_ENTRY.size:
+                with open(self.index_path, "wb") as f:
+                    f.write(b"".join(INDEX_ENTRY.pack(s, n) for s, n in zip(starts, records)))
+        # index whatever the log gained after the last index entry
+        next_number = records[-1] + INDEX_STRIDE if records else 0
+        if next_number < self.record_count:
+            with open(self.index_path, "ab") as index, open(self.log_path, "rb") as log:
+                while next_number < self.record_count:
+                    log.seek(next_number * RECORD.size)
+                    start = RECORD.unpack(log.read(RECORD.size))[0]
+                    index.write(INDEX_ENTRY.pack(start, next_number))
+                    starts.append(start)
+                    records.append(next_number)
+                    next_number += INDEX_STRIDE
+        return starts, records
+
+    def _app_id(self, app):
+        app_id = self.app_ids.get(app)
+        if app_id is None:
+            app_id = self.app_ids[app] = len(self.app_names)
+            self.app_names.append(app)
+            with open(self.apps_path, "a", encoding="utf-8") as f:
+                f.write(app.replace("\n", " ") + "\n")
+        return app_id
+
+    def record(self, app, upload, download, timestamp=None):
+        """Add usage deltas (bytes) for `app`"""
+        if upload <= 0 and download <= 0:
+            return
+        now = time.time() if timestamp is None else timestamp
+        bucket_start = int(now) - int(now) % self.interval
+        if self.bucket_start is not None and bucket_start != self.bucket_start:
+            self._write_bucket()
+        self.bucket_start = bucket_start
+        counters = self.bucket.setdefault(self._app_id(app), [0, 0])
+        counters[0] += max(0, upload)
+        counters[1] += max(0, download)
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.flush(sync=True)
+
+    def _write_bucket(self):
+        if not self.bucket:
+            return
+        # the log must stay sorted, a clock step backwards is folded into the last interval
+        start = max(self.bucket_start, self.last_start)
+        chunks = []
+        for app_id, (upload, download) in self.bucket.items():
+            while upload or download:
+                up, down = min(upload, MAX_DELTA), min(download, MAX_DELTA)
+                chunks.append(RECORD.pack(start, app_id, up, down))
+                upload -= up
+                download -= down
+        self.log.write(b"".join(chunks))
+        first = self.record_count
+        self.record_count += len(chunks)
+        # the first record of each stride goes to the index
+        next_indexed = -(-first // INDEX_STRIDE) * INDEX_STRIDE
+        while next_indexed < self.record_count:
+            self.index_file.write(INDEX_ENTRY.pack(start, next_indexed))
+            self.index_starts.append(start)
+            self.index_records.append(next_indexed)
+            next_indexed += INDEX_STRIDE
+        self.last_start = start
+        self.bucket = {}
+        self.unsynced = True
+
+    def flush(self, sync=False):
+        """Write the open interval; `sync` also fsyncs, which record() batches by itself"""
+        self._write_bucket()
+        self.bucket_start = None
+        self.log.flush()
+        self.index_file.flush()
+        if sync and self.unsynced:
+            os.fsync(self.log.fileno())
+            self.unsynced = False
+        self.last_sync = time.monotonic()
+
+    def query(self, start, end):
+        """Yield (interval start, app, upload, download) for intervals in [start, end)"""
+        self.log.flush()
+        # the entry before the first one at `start`: an interval can span a stride
+        # boundary, and its records before the boundary are only reached from there
+        position = bisect.bisect_left(self.index_starts, start) - 1
+        first = self.index_records[position] if position >= 0 else 0
+        with open(self.log_path, "rb") as f:
+            f.seek(first * RECORD.size)
+            while True:
+                chunk = f.read(RECORD.size * 4096)
+                if not chunk:
+                    break
+                for interval_start, app_id, upload, download in RECORD.iter_unpack(chunk):
+                    if interval_start >= end:
+                        return
+                    if interval_start >= start:
+                        yield interval_start, self.app_names[app_id], upload, download
+        if self.bucket_start is not None and start <= self.bucket_start < end:
+            for app_id, (upload, download) in self.bucket.items():
+                yield self.bucket_start, self.app_names[app_id], upload, download
+
+    def totals(self, start, end):
+        """{app: [upload, download]} summed over [start, end)"""
+        totals = {}
+        for _, app, upload, download in self.query(start, end):
+            counters = totals.setdefault(app, [0, 0])
+            counters[0] += upload
+            counters[1] += download
+        return totals
+
+    def close(self):
+        self.flush(sync=True)
+        self.log.close()
+        self.index_file.close()